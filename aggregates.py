@@ -0,0 +1,165 @@
+# aggregates.py
+"""
+Time-bucketed emission totals for /api/aggregates (trend charts):
+- granularity 'day', 'month' or 'fy' (fiscal year starting FISCAL_YEAR_START_MONTH, April by default)
+- grouping by bucket, scope and process_code happens in SQL; month and fy read only the covering
+  expression index idx_emissions_user_month_cover (user_uk, substr(created_at, 1, 7), scope, process_code,
+  emission, created_at): SQLite does not treat the substr() key as holding created_at, so the column
+  itself is in the index too or every row is looked up in the table; day ranges use idx_emissions_user_created
+- month / fy ranges are widened to whole months / fiscal years; every bucket in the range is
+  listed, empty ones as 0
+- results are cached per (user_uk, granularity, range, scope) and dropped as soon as the user's
+  data version (page_cache.user_data_versions) moves, i.e. on their next write
+"""
+
+import os, threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from page_cache import data_version
+
+FISCAL_YEAR_START_MONTH = int(os.getenv("FISCAL_YEAR_START_MONTH", "4"))
+AGG_CACHE_SIZE = int(os.getenv("AGG_CACHE_SIZE", "256"))
+GRANULARITIES = ("day", "month", "fy")
+DEFAULT_DAYS = 90
+MAX_DAYS = 1096
+
+MONTH_INDEX_SQL = """
+DROP INDEX IF EXISTS idx_emissions_user_month;
+CREATE INDEX IF NOT EXISTS idx_emissions_user_month_cover
+    ON emissions(user_uk, (substr(created_at, 1, 7)), scope, process_code, emission, created_at);
+"""
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def create_month_index(conn):
+    conn.executescript(MONTH_INDEX_SQL)
+
+def parse_granularity(args):
+    granularity = (args.get("granularity") or "month").strip().lower()
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"'granularity' must be one of: {', '.join(GRANULARITIES)}")
+    return granularity
+
+def fiscal_year(year, month, start_month=FISCAL_YEAR_START_MONTH):
+    """Fiscal year a calendar month falls in, named by the calendar year it starts in."""
+    return year if month >= start_month else year - 1
+
+def fy_label(fy, start_month=FISCAL_YEAR_START_MONTH):
+    return f"FY{fy}" if start_month == 1 else f"FY{fy}-{str(fy + 1)[-2:]}"
+
+def _month_range(first, last):
+    y, m = int(first[:4]), int(first[5:7])
+    out = []
+    while f"{y:04d}-{m:02d}" <= last:
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return out
+
+def resolve_range(granularity, start=None, end=None):
+    """Fill in the default daily window; raises ValueError on an oversized one."""
+    if granularity != "day":
+        return start, end
+    end = end or date.today()
+    start = start or end - timedelta(days=DEFAULT_DAYS - 1)
+    if (end - start).days >= MAX_DAYS:
+        raise ValueError(f"A daily range can span at most {MAX_DAYS} days; use granularity=month.")
+    return start, end
+
+def _month_bounds(granularity, start, end):
+    """(first, last) 'YYYY-MM' bounds, widened to whole fiscal years for fy; None where open-ended."""
+    first = last = None
+    if start:
+        y, m = start.year, start.month
+        if granularity == "fy":
+            y, m = fiscal_year(y, m), FISCAL_YEAR_START_MONTH
+        first = f"{y:04d}-{m:02d}"
+    if end:
+        y, m = end.year, end.month
+        if granularity == "fy":
+            y = fiscal_year(y, m) + (1 if FISCAL_YEAR_START_MONTH > 1 else 0)
+            m = FISCAL_YEAR_START_MONTH - 1 or 12
+        last = f"{y:04d}-{m:02d}"
+    return first, last
+
+def _query_months(cur, user_uk, first, last, scope):
+    where = ["user_uk = ?"]; params = [user_uk]
+    if first:
+        where.append("substr(created_at, 1, 7) >= ?"); params.append(first)
+    if last:
+        where.append("substr(created_at, 1, 7) <= ?"); params.append(last)
+    if scope:
+        where.append("scope = ?"); params.append(scope)
+    cur.execute(f"""
+        SELECT substr(created_at, 1, 7) AS bucket, scope, process_code, SUM(emission), COUNT(*)
+        FROM emissions
+        WHERE {" AND ".join(where)}
+        GROUP BY substr(created_at, 1, 7), scope, process_code
+    """, params)
+    return [(r[0], r[1], r[2], float(r[3] or 0.0), r[4]) for r in cur.fetchall() if r[0]]
+
+def _query_days(cur, user_uk, start, end, scope):
+    where = ["user_uk = ?", "created_at >= ?", "created_at < ?"]
+    params = [user_uk, start.isoformat(), (end + timedelta(days=1)).isoformat()]
+    if scope:
+        where.append("scope = ?"); params.append(scope)
+    cur.execute(f"""
+        SELECT substr(created_at, 1, 10) AS bucket, scope, process_code, SUM(emission), COUNT(*)
+        FROM emissions
+        WHERE {" AND ".join(where)}
+        GROUP BY substr(created_at, 1, 10), scope, process_code
+        ORDER BY bucket
+    """, params)
+    return [(r[0], r[1], r[2], float(r[3] or 0.0), r[4]) for r in cur.fetchall()]
+
+def _shape(buckets, rows):
+    """{'buckets': [{bucket, total, entries, by_scope}], 'rows': [{bucket, scope, process_code, emission, entries}]}"""
+    series = {b: {"bucket": b, "total": 0.0, "entries": 0, "by_scope": {}} for b in buckets}
+    out_rows = []
+    for bucket, scope, code, emission, n in rows:
+        s = series.setdefault(bucket, {"bucket": bucket, "total": 0.0, "entries": 0, "by_scope": {}})
+        s["total"] += emission; s["entries"] += n
+        s["by_scope"][scope] = s["by_scope"].get(scope, 0.0) + emission
+        out_rows.append({"bucket": bucket, "scope": scope, "process_code": code, "emission": emission, "entries": n})
+    return {"buckets": [series[b] for b in sorted(series)], "rows": out_rows}
+
+def compute_aggregates(cur, user_uk, granularity, start=None, end=None, scope=None):
+    """Bucketed totals for one user; start/end are dates (inclusive) or None."""
+    start, end = resolve_range(granularity, start, end)
+    if granularity == "day":
+        rows = _query_days(cur, user_uk, start, end, scope)
+        buckets = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        return _shape(buckets, rows)
+    first, last = _month_bounds(granularity, start, end)
+    rows = _query_months(cur, user_uk, first, last, scope)
+    months = [r[0] for r in rows]
+    first = first or (min(months) if months else None)
+    last = last or (max(months) if months else None)
+    buckets = _month_range(first, last) if first and last else []
+    if granularity == "month":
+        return _shape(buckets, rows)
+    def to_fy(bucket):
+        return fy_label(fiscal_year(int(bucket[:4]), int(bucket[5:7])))
+    fy_rows = {}
+    for bucket, sc, code, emission, n in rows:
+        t = fy_rows.setdefault((to_fy(bucket), sc, code), [0.0, 0])
+        t[0] += emission; t[1] += n
+    return _shape(list(dict.fromkeys(to_fy(b) for b in buckets)),
+                  [(b, sc, code, e, n) for (b, sc, code), (e, n) in sorted(fy_rows.items())])
+
+def cached_aggregates(cur, user_uk, granularity, start=None, end=None, scope=None):
+    start, end = resolve_range(granularity, start, end)
+    key = (user_uk, granularity, str(start), str(end), scope)
+    signature = data_version(cur, user_uk)
+    with _lock:
+        hit = _cache.get(key)
+        if hit and hit[0] == signature:
+            _cache.move_to_end(key)
+            return hit[1]
+    result = compute_aggregates(cur, user_uk, granularity, start, end, scope)
+    with _lock:
+        _cache[key] = (signature, result)
+        _cache.move_to_end(key)
+        while len(_cache) > AGG_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -1,67 +1,100 @@
 # app.py (fixed, complete)
-from flask import Flask, render_template, request, redirect, url_for, session, Response, jsonify
-import sqlite3, os, json, uuid, re
+from flask import Flask, render_template, request, redirect, url_for, session, g, Response, jsonify, send_file
+import os, json, uuid, base64, hmac
 from datetime import datetime
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 from process_questions import PROCESS_QUESTIONS
+from calc_engine import get_plan
+from exports import parse_export_filters, iter_csv, gzip_stream
+from aggregates import parse_granularity
+from emission_inputs import details_text, numeric_details
+import export_jobs
+import factor_versions
+import bulk
+import catalog
+import db
+import repository
+import page_cache
+import profiles
+import instrumentation
+import write_queue
+from repository import get_repo
 
-DB = "emissions.db"
+DB = os.getenv("EMISSIONS_DB", "emissions.db")
+PAGE_SIZE = 50
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")  # unset: the /admin endpoints answer 404
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET", "super_secret_key_for_carbon_dashboard_project")
+repository.init_app(app, DB)
+instrumentation.init_app(app)  # no-op unless INSTRUMENTATION=1
+write_queue.init_app(app)  # no-op unless WRITE_QUEUE=1
 
 # --- Helpers ---
-def get_db():
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user' not in session:
+        # the cookie holds only user_uk; g.user is the worker-cached profile (profiles.User)
+        user_uk = profiles.session_user_uk(session)
+        user = profiles.get_user(get_repo(), user_uk) if user_uk else None
+        if user is None:
+            session.pop('user_uk', None)
             return redirect(url_for('index'))
+        g.user = user
+        write_queue.wait_for_user(user.user_uk)  # read-your-writes when submissions are queued
         return f(*args, **kwargs)
     return decorated_function
 
-def parse_float_safe(v):
-    """Try to parse numeric user input to float, return None if not numeric."""
-    if v is None:
-        return None
-    if isinstance(v, (int, float)):
-        return float(v)
-    s = str(v).strip()
-    if s == "":
-        return None
-    # remove commas and non-numeric trailing text
-    s = s.replace(",", "")
-    m = re.search(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", s)
-    if m:
-        try:
-            return float(m.group(0))
-        except:
-            return None
-    return None
-
-def dict_to_obj(d: dict):
-    """Convert dict to simple object so templates can use dot notation."""
-    class O: pass
-    o = O()
-    for k,v in d.items():
-        setattr(o, k, v)
-    return o
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not ADMIN_PASSWORD:
+            return jsonify({"error": "Not found."}), 404
+        given = request.headers.get("X-Admin-Password") or request.form.get("pwd") or ""
+        if not hmac.compare_digest(given.encode(), ADMIN_PASSWORD.encode()):
+            return jsonify({"error": "Forbidden."}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def encode_cursor(created_at, row_id):
+    """Opaque keyset cursor pointing just past (created_at, id)."""
+    return base64.urlsafe_b64encode(json.dumps([created_at, row_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor."""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(row_id)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def fetch_entries_page(repo, user_uk, cursor=None, limit=PAGE_SIZE):
+    """One page of a user's entries, newest first, plus the cursor for the next page (or None)."""
+    after = decode_cursor(cursor) if cursor else None
+    rows = repo.entries_page(user_uk, after, limit + 1)
+    inputs = repo.inputs_for([r["id"] for r in rows[:limit]])
+    entries = []
+    for r in rows[:limit]:
+        d = dict(r)
+        d["input_details"] = numeric_details(inputs[d["id"]])
+        entries.append(d)
+    next_cursor = encode_cursor(entries[-1]["created_at"], entries[-1]["id"]) if len(rows) > limit else None
+    return entries, next_cursor
+
+repository.init_schema(app.config["DATABASE"])
 
 # --- Routes ---
 @app.route("/", methods=["GET", "POST"])
 def index():
     error = None
     success = None
-    if 'user' in session:
+    if profiles.session_user_uk(session):
         return redirect(url_for('dashboard'))
 
     if request.method == "POST":
         action = request.form.get("action")
         if action == "register":
+            repo = get_repo()
             try:
                 username = request.form["username"]
                 password = request.form["password"]
@@ -74,14 +107,11 @@ def index():
                 hashed_password = generate_password_hash(password)
                 user_uk = str(uuid.uuid4())
 
-                conn = get_db(); cur = conn.cursor()
-                cur.execute("""
-                    INSERT INTO users (user_uk, username, password, nodal_person, designation, company, phone, email, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (user_uk, username, hashed_password, nodal_person, designation, company, phone, email, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-                conn.commit(); conn.close()
+                repo.create_user(user_uk, username, hashed_password, nodal_person, designation, company, phone, email,
+                                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                repo.commit()
                 success = "Registration successful! Please log in."
-            except sqlite3.IntegrityError:
+            except repo.IntegrityError:
                 error = "Username or Email already exists."
             except Exception as e:
                 error = f"Registration failed: {e}"
@@ -90,12 +120,9 @@ def index():
             try:
                 username = request.form["username"]
                 password = request.form["password"]
-                conn = get_db(); cur = conn.cursor()
-                cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-                user_row = cur.fetchone(); conn.close()
+                user_row = get_repo().get_user(username)
                 if user_row and check_password_hash(user_row["password"], password):
-                    # store as dict
-                    session["user"] = dict(user_row)
+                    session["user_uk"] = user_row["user_uk"]
                     return redirect(url_for('dashboard'))
                 else:
                     error = "Invalid Username or Password."
@@ -111,196 +138,245 @@ def get_questions(process_code):
         return jsonify({"questions": [], "operation": "single"})
     return jsonify({"questions": proc.get("fields", []), "operation": proc.get("operation", "single")})
 
+@app.route("/api/catalog")
+def api_catalog():
+    """Every process's questions, unit and scope in one precompressed, ETagged response."""
+    return catalog.response(get_repo())
+
 @app.route("/logout")
 def logout():
-    session.pop('user', None)
+    session.pop('user_uk', None)
+    session.pop('user', None)  # cookies from before the slim session
     return redirect(url_for('index'))
 
 @app.route("/concepts")
 def concepts():
     return render_template("concepts.html")
 
-@app.route("/calculator", methods=["GET", "POST"])
-@login_required
-def calculator():
-    # convert session user dict to object for templates
-    user_dict = session["user"]
-    user_obj = dict_to_obj(user_dict)
-
-    conn = get_db(); cur = conn.cursor()
-    # processes list
-    cur.execute("SELECT * FROM emission_factors ORDER BY process_desc")
-    processes = cur.fetchall()
-
-    # user activity (last 10) for this user_uk
-    user_uk = user_dict.get("user_uk")
-    cur.execute("""
-        SELECT id, process_code, process_desc, scope, unit, input_details, factor_used, emission, created_at
-        FROM emissions
-        WHERE user_uk = ?
-        ORDER BY created_at DESC
-        LIMIT 10
-    """, (user_uk,))
-    activity_data_rows = cur.fetchall()
-
-    # format activity entries
+def recent_activities(repo, user_uk, limit=10):
+    """The user's latest entries with their answers flattened for the calculator's activity table."""
+    rows = repo.recent_emissions(user_uk, limit)
+    inputs = repo.inputs_for([r["id"] for r in rows])
     activities = []
-    for r in activity_data_rows:
+    for r in rows:
         d = dict(r)
-        try:
-            inputs = json.loads(d.get("input_details") or "{}")
-            d['input_value_str'] = "; ".join([f"{k}: {v}" for k, v in inputs.items()])
-        except:
-            d['input_value_str'] = "N/A"
+        d['input_value_str'] = details_text(inputs[d["id"]])
         activities.append(d)
+    return activities
+
+@app.route("/calculator", methods=["GET", "POST"])
+@login_required
+def calculator():
+    user_obj = g.user
+    user_uk = user_obj.user_uk
+    repo = get_repo()
+
+    def render(error=None):
+        # processes list (cached per worker, refreshed when factors_version changes) + user activity (last 10)
+        return render_template("calculator.html", processes=repo.processes(), user=user_obj,
+                               activities=recent_activities(repo, user_uk), error=error,
+                               catalog_url=url_for("api_catalog", v=catalog.version(repo)))
 
     if request.method == "POST":
         proc = request.form.get("process")
-        cur.execute("SELECT * FROM emission_factors WHERE process_code = ?", (proc,))
-        p = cur.fetchone()
+        p = repo.get_factor(proc)
         if not p:
-            conn.close()
-            return render_template("calculator.html", processes=processes, user=user_obj, activities=activities, error="Invalid process selected.")
+            return render("Invalid process selected.")
 
-        # get factor, desc, unit
-        process_desc = p["process_desc"]
-        scope = p["scope"]
-        unit = p["unit"]
         factor = float(p["factor"] or 0.0)
 
-        # get process question definition
-        proc_meta = PROCESS_QUESTIONS.get(proc, {})
-        fields = proc_meta.get("fields", [])
-        operation = proc_meta.get("operation", "single")
-
-        # collect input details with friendly labels
-        input_details = {}
-        numeric_values = {}  # key -> float
-        for f in fields:
-            key = f.get("key")
-            q = f.get("question")
-            raw = request.form.get(key)
-            input_details[q] = raw if raw is not None else ""
-            num = parse_float_safe(raw)
-            if num is not None:
-                numeric_values[key] = num
-
-        # Fallback: if no mapped fields (no questions), check existing 'quantity' form
-        if not fields:
-            raw_qty = request.form.get("quantity")
-            num = parse_float_safe(raw_qty)
-            if num is None:
-                conn.close()
-                return render_template("calculator.html", processes=processes, user=user_obj, activities=activities, error="Please enter a numeric quantity.")
-            activity_value = num
-        else:
-            # compute activity_value based on operation
-            activity_value = 0.0
-            if operation == "multiply":
-                prod = 1.0
-                found = False
-                for k,v in numeric_values.items():
-                    prod *= v
-                    found = True
-                activity_value = prod if found else 0.0
-            elif operation == "sum":
-                s = sum(numeric_values.values()) if numeric_values else 0.0
-                activity_value = s
-            else:  # 'single' or default
-                # choose the most relevant numeric field:
-                # priority list of likely numeric keys
-                priority = ["Fuel_Con", "Fuel_cons", "Total_Consumption", "Annual_cons", "Tot_Fuel_cons", "quantity", "Distance", "Distance_km", "Total_Consumption", "Total_Consumption_kWh", "Total_Consumption(kWh)"]
-                picked = None
-                for key in priority:
-                    if key in numeric_values:
-                        picked = numeric_values[key]; break
-                if not picked and numeric_values:
-                    # pick first numeric value
-                    picked = next(iter(numeric_values.values()))
-                activity_value = float(picked) if picked is not None else 0.0
-
-                # special per-process adjustments:
-                if proc == "TRANS_LMV_EM":
-                    # if user entered Distance one-way, double it
-                    if "Distance" in numeric_values:
-                        activity_value = numeric_values.get("Distance", activity_value) * 2.0
+        # activity value from the precompiled plan for this process's questions
+        plan = get_plan(proc)
+        input_details = plan.input_details(request.form)
+        activity_value = plan.compute(request.form)
+        if activity_value is None:
+            return render("Please enter a numeric quantity.")
 
         # Final emission calculation (activity_value x factor)
         emission = activity_value * factor
 
-        # Save to DB under this user's user_uk
+        # Save to DB under this user's user_uk (the emissions trigger bumps their data version)
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cur.execute("""
-            INSERT INTO emissions (user_uk, process_code, process_desc, scope, unit, input_details, factor_used, emission, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_uk, proc, process_desc, scope, unit, json.dumps(input_details, ensure_ascii=False), factor, emission, now))
-        conn.commit()
-        conn.close()
+        details_json = json.dumps(input_details, ensure_ascii=False)
+        if write_queue.enabled():
+            p = dict(p)
+            write_queue.submit(user_uk, lambda r: r.add_emission(user_uk, p, details_json, factor, emission, now))
+        else:
+            repo.add_emission(user_uk, p, details_json, factor, emission, now)
+            repo.commit()
         return redirect(url_for('calculator'))
 
-    conn.close()
-    return render_template("calculator.html", processes=processes, user=user_obj, activities=activities)
-    
+    # reused until the user's entries or the factor table change
+    return page_cache.cached_page("calculator", user_uk, [repo.data_version(user_uk), repo.factors_version()], render)
+
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    user_dict = session["user"]
-    user_obj = dict_to_obj(user_dict)
-    user_uk = user_dict.get("user_uk")
-    conn = get_db(); cur = conn.cursor()
-    cur.execute("""
-        SELECT created_at, process_desc, scope, unit, input_details, emission
-        FROM emissions
-        WHERE user_uk = ?
-        ORDER BY created_at DESC
-    """, (user_uk,))
-    rows = cur.fetchall()
-    entries = []
-    total_emission = 0.0
-    scope_data = {}
-    process_emissions = {}
-    for r in rows:
-        d = dict(r)
-        try:
-            d["input_details"] = json.loads(d.get("input_details") or "{}")
-        except:
-            d["input_details"] = {}
-        entries.append(d)
-        e = float(d.get("emission") or 0.0)
-        total_emission += e
-        scope = d.get("scope", "Unknown")
-        scope_data[scope] = scope_data.get(scope, 0.0) + e
-        process_emissions[d.get("process_desc","Unknown")] = process_emissions.get(d.get("process_desc","Unknown"), 0.0) + e
-    conn.close()
+    user_obj = g.user
+    user_uk = user_obj.user_uk
+    repo = get_repo()
+
+    def render():
+        entries, next_cursor = fetch_entries_page(repo, user_uk)
+        total_emission, scope_data, top = repo.dashboard_summary(user_uk)
+
+        labels = [t[0] for t in top]; values = [round(t[1],2) for t in top]
+
+        return render_template("dashboard.html", entries=entries, total_emission_kg=total_emission,
+                               scope_data=scope_data, process_labels=labels, process_values=values, user=user_obj,
+                               next_cursor=next_cursor)
+
+    # reused (or answered with 304) until the user's entries change
+    return page_cache.cached_page("dashboard", user_uk, [repo.data_version(user_uk)], render)
+
+@app.route("/dashboard/entries")
+@login_required
+def dashboard_entries():
+    user_uk = g.user.user_uk
+    try:
+        limit = min(max(int(request.args.get("limit", PAGE_SIZE)), 1), 500)
+    except ValueError:
+        limit = PAGE_SIZE
+    try:
+        entries, next_cursor = fetch_entries_page(get_repo(), user_uk, request.args.get("cursor"), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"entries": entries, "next_cursor": next_cursor})
+
+@app.route("/api/emissions/bulk", methods=["POST"])
+@login_required
+def bulk_submit():
+    user_uk = g.user.user_uk
+    try:
+        records = bulk.parse_records(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    atomic = request.args.get("atomic") in ("1", "true")
 
-    top = sorted(process_emissions.items(), key=lambda x:x[1], reverse=True)[:5]
-    labels = [t[0] for t in top]; values = [round(t[1],2) for t in top]
+    repo = get_repo()
+    factors = repo.factors_by_code()
+    valid, results = bulk.validate_records(records, factors)
+    if atomic and len(valid) < len(records):
+        return jsonify({"inserted": 0, "results": [r or {"index": i, "status": "skipped"} for i, r in enumerate(results)]}), 400
+    rows = bulk.compute_rows(user_uk, valid, factors, results)
+    if atomic and len(rows) < len(records):
+        return jsonify({"inserted": 0, "results": results}), 400
+    if write_queue.enabled():
+        # one job, so the records land (or fail) together under its savepoint
+        write_queue.submit(user_uk, lambda r: r.add_rows(user_uk, rows))
+        inserted = len(rows)
+    else:
+        inserted = repo.add_rows(user_uk, rows)
+        repo.commit()
+    return jsonify({"inserted": inserted, "results": results}), 200
 
-    return render_template("dashboard.html", entries=entries, total_emission_kg=total_emission,
-                           scope_data=scope_data, process_labels=labels, process_values=values, user=user_obj)
+@app.route("/api/aggregates")
+@login_required
+def api_aggregates():
+    """?granularity=day|month|fy&start=YYYY-MM-DD&end=YYYY-MM-DD&scope=..."""
+    user_uk = g.user.user_uk
+    try:
+        granularity = parse_granularity(request.args)
+        filters = parse_export_filters(request.args)
+        if filters.get("start") and filters.get("end") and filters["start"] > filters["end"]:
+            raise ValueError("'start' must not be after 'end'")
+        result = get_repo().aggregates(user_uk, granularity, **filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"granularity": granularity, **{k: str(v) for k, v in filters.items()}, **result})
 
 @app.route("/export_data")
 @login_required
 def export_data():
-    user_uk = session["user"]["user_uk"]
-    conn = get_db(); cur = conn.cursor()
-    cur.execute("""
-        SELECT created_at, process_desc, scope, unit, input_details, factor_used, emission
-        FROM emissions
-        WHERE user_uk = ?
-        ORDER BY created_at DESC
-    """, (user_uk,))
-    rows = cur.fetchall(); conn.close()
-    csv = "Date,Process Description,Scope,Unit,Activity Details,Emission Factor (kg CO2e/unit),Emission (kg CO2e)\n"
-    for r in rows:
-        r_dict = dict(r)
+    user_uk = g.user.user_uk
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400, mimetype="text/plain")
+    # own connection: the body is streamed after the request's connection is released
+    repo = repository.open_repository(app.config["DATABASE"])
+    batches = repo.export_batches(user_uk, filters)
+
+    def generate():
         try:
-            inputs = json.loads(r_dict.get('input_details','{}'))
-            input_str = "; ".join([f"{k}: {v}" for k,v in inputs.items()])
-        except:
-            input_str = ""
-        csv += f"{r_dict['created_at']},\"{r_dict['process_desc']}\",{r_dict['scope']},{r_dict['unit']},\"{input_str.replace('\"','\"\"')}\",{r_dict['factor_used']},{r_dict['emission']}\n"
-    return Response(csv, mimetype="text/csv", headers={"Content-disposition": "attachment; filename=carbon_emissions_report.csv"})
+            yield from iter_csv(batches)
+        finally:
+            repo.close()
+
+    headers = {"Content-disposition": "attachment; filename=carbon_emissions_report.csv", "Vary": "Accept-Encoding"}
+    body = generate()
+    if request.accept_encodings["gzip"]:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype="text/csv", headers=headers)
+
+@app.route("/export_jobs", methods=["POST"])
+@login_required
+def create_export_job():
+    user_uk = g.user.user_uk
+    args = request.get_json(silent=True) or request.form
+    try:
+        filters = parse_export_filters(args)
+        job = export_jobs.submit_job(app.config["DATABASE"], user_uk, (args.get("format") or "").lower(), filters)
+    except ValueError as e:
+        return jsonify({"error": str(e), "formats": export_jobs.available_formats()}), 400
+    return jsonify({"job_id": job["id"], "status": job["status"],
+                    "status_url": url_for("export_job_status", job_id=job["id"])}), 202
+
+@app.route("/export_jobs/<job_id>")
+@login_required
+def export_job_status(job_id):
+    job = export_jobs.get_job(job_id)
+    if not job or job["user_uk"] != g.user.user_uk:
+        return jsonify({"error": "Export job not found."}), 404
+    out = {k: job[k] for k in ("id", "format", "status", "rows", "error", "created_at", "finished_at")}
+    if job["status"] == "done":
+        out["download_url"] = url_for("export_job_download", job_id=job_id)
+    return jsonify(out)
+
+@app.route("/export_jobs/<job_id>/download")
+@login_required
+def export_job_download(job_id):
+    job = export_jobs.get_job(job_id)
+    if not job or job["user_uk"] != g.user.user_uk or job["status"] != "done":
+        return jsonify({"error": "Export not ready."}), 404
+    ext, mimetype = export_jobs.FORMATS[job["format"]][:2]
+    return send_file(export_jobs.job_file(job), mimetype=mimetype, as_attachment=True,
+                     download_name=f"carbon_emissions_report{ext}")
+
+@app.route("/admin/recalc_jobs", methods=["POST"])
+@admin_required
+def create_recalc_job():
+    # restate stored emissions from factor_versions in the background (factor_versions.start_job)
+    args = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(args, dict):
+        return jsonify({"error": "Request body must be a JSON object."}), 400
+    codes = args.get("codes") if request.is_json else request.form.getlist("code")
+    if isinstance(codes, str):
+        codes = [codes]
+    try:
+        if not isinstance(codes, (list, type(None))) or not all(isinstance(c, str) for c in codes or []):
+            raise ValueError("codes must be a process code or a list of them.")
+        job = factor_versions.start_job(app.config["DATABASE"], [c.strip().upper() for c in codes or [] if c.strip()],
+                                        args.get("start") or None, args.get("end") or None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"job_id": job["id"], "status": job["status"],
+                    "status_url": url_for("recalc_job_status", job_id=job["id"])}), 202
+
+@app.route("/admin/recalc_jobs/<job_id>")
+@admin_required
+def recalc_job_status(job_id):
+    job = factor_versions.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Recalculation job not found."}), 404
+    return jsonify(job)
+
+@app.route("/healthz")
+def healthz():
+    # connection-layer counters: steadily growing lock waits or locked_errors mean
+    # writers are queueing on the single SQLite file
+    return jsonify({"status": "ok", "db": db.stats(), "write_queue": write_queue.stats()})
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,314 @@
+# benchmark.py
+"""
+Offline benchmark for the calculator, dashboard and export endpoints:
+- `generate` builds a synthetic DB (factor table from the workbook, N users x M rows spread over every
+  PROCESS_QUESTIONS code with a factor, created_at spread over the last --days days)
+- `run` replays scenarios through the Flask test client (--driver client) or over HTTP against a local
+  gunicorn (--driver gunicorn, --workers, --concurrency) and reports p50/p95/p99 latency + throughput
+- results are written as JSON (with the git commit) so runs can be compared: `compare old.json new.json`
+
+  python benchmark.py generate --users 20 --rows 2000 --db /tmp/bench.db
+  python benchmark.py run --db /tmp/bench.db --driver gunicorn --workers 2 --out bench.json
+"""
+
+import argparse, http.cookiejar, json, os, platform, random, socket, subprocess, sys, threading, time, uuid
+import urllib.error, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCH_PASSWORD = "bench-password"
+SCENARIOS = ["calculator_get", "calculator_post", "dashboard", "dashboard_entries", "aggregates", "export_csv"]
+
+# === SYNTHETIC DATA ===
+def random_inputs(rng, plan):
+    """Plausible raw form values for a process plan (numbers, or text / dates where the unit says so)."""
+    from process_questions import PROCESS_QUESTIONS
+    units = {f.get("key"): f.get("unit") for f in PROCESS_QUESTIONS.get(plan.process_code, {}).get("fields", [])}
+    inputs = {}
+    for key in plan.input_keys:
+        unit = units.get(key)
+        if unit == "-":
+            inputs[key] = rng.choice(["A", "B", "C"]) + str(rng.randint(1, 99))
+        elif unit == "date":
+            inputs[key] = (datetime.now() - timedelta(days=rng.randint(0, 1000))).strftime("%Y-%m-%d")
+        else:
+            inputs[key] = str(round(rng.uniform(1, 500), 2))
+    return inputs
+
+def generate(db_path, users, rows, days=1095, seed=42):
+    """Fresh DB at db_path with `users` bench users (bench_user_<i>) and `rows` entries each."""
+    import init_db, bulk
+    from calc_engine import get_plan
+    from werkzeug.security import generate_password_hash
+    rng = random.Random(seed)
+    init_db.DB = db_path
+    conn = init_db.recreate_db()
+    init_db.insert_factors_to_db(conn, init_db.load_factors_sheet())
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM emission_factors")
+    cols = [d[0] for d in cur.description]
+    factors = {r[cols.index("process_code")]: dict(zip(cols, r)) for r in cur.fetchall()}
+    codes = sorted(c for c in factors if get_plan(c).fields)
+    password = generate_password_hash(BENCH_PASSWORD)
+    now = datetime.now()
+    for u in range(users):
+        user_uk = str(uuid.uuid4())
+        cur.execute("""
+            INSERT INTO users (user_uk, username, password, nodal_person, designation, company, phone, email, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_uk, f"bench_user_{u}", password, "Bench", "Tester", f"Company {u}", "0", f"bench{u}@example.com",
+              now.strftime("%Y-%m-%d %H:%M:%S")))
+        records = [{"process_code": code, "inputs": random_inputs(rng, get_plan(code))}
+                   for code in (rng.choice(codes) for _ in range(rows))]
+        valid, results = bulk.validate_records(records, factors)
+        # dated before the insert, so the new rows never have to be found again by id
+        dated = [r[:-1] + ((now - timedelta(seconds=rng.randint(0, days * 86400))).strftime("%Y-%m-%d %H:%M:%S"),)
+                 for r in bulk.compute_rows(user_uk, valid, factors, results)]
+        bulk.write_rows(cur, user_uk, dated)
+        conn.commit()
+    total = cur.execute("SELECT COUNT(*) FROM emissions").fetchone()[0]
+    conn.close()
+    return {"users": users, "rows_per_user": rows, "emissions": total, "codes": len(codes)}
+
+# === STATS ===
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def summarize(latencies_ms, errors, elapsed_s):
+    lat = sorted(latencies_ms)
+    return {
+        "requests": len(lat) + errors, "errors": errors,
+        "p50_ms": percentile(lat, 50), "p95_ms": percentile(lat, 95), "p99_ms": percentile(lat, 99),
+        "mean_ms": sum(lat) / len(lat) if lat else None, "max_ms": lat[-1] if lat else None,
+        "throughput_rps": (len(lat) + errors) / elapsed_s if elapsed_s > 0 else None,
+    }
+
+# === DRIVERS ===
+def scenario_request(name, rng, plans):
+    """(method, path, form) for one request of a scenario."""
+    if name == "calculator_get":
+        return "GET", "/calculator", None
+    if name == "calculator_post":
+        plan = rng.choice(plans)
+        return "POST", "/calculator", {"process": plan.process_code, **random_inputs(rng, plan)}
+    if name == "dashboard":
+        return "GET", "/dashboard", None
+    if name == "dashboard_entries":
+        return "GET", "/dashboard/entries?limit=50", None
+    if name == "aggregates":
+        return "GET", "/api/aggregates?granularity=month", None
+    if name == "export_csv":
+        return "GET", "/export_data", None
+    raise ValueError(f"unknown scenario {name}")
+
+class ClientSession:
+    """One logged-in user through the Flask test client."""
+
+    def __init__(self, app, username):
+        self.client = app.test_client()
+        self.client.post("/", data={"action": "login", "username": username, "password": BENCH_PASSWORD})
+
+    def request(self, method, path, form=None):
+        r = self.client.open(path, method=method, data=form)
+        r.get_data()  # drain streamed bodies (CSV export)
+        return r.status_code
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpSession:
+    """One logged-in user over HTTP (stdlib only, cookies kept per session)."""
+
+    def __init__(self, base_url, username=None):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  _NoRedirect)
+        if username:
+            self.login(username)
+
+    def login(self, username, password=BENCH_PASSWORD):
+        """Sign in through index(); 302 means success, 200 re-renders the form with an error."""
+        return self.request("POST", "/", {"action": "login", "username": username, "password": password})
+
+    def request(self, method, path, form=None):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Gunicorn:
+    """Local `gunicorn app:app` on a free port against db_path; use as a context manager."""
+
+    def __init__(self, db_path, workers=2, threads=1, env=None, log_path=None):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+                    "-b", f"127.0.0.1:{self.port}", "--log-level", "warning", "app:app"]
+        self.env = {**os.environ, "EMISSIONS_DB": os.path.abspath(db_path), **(env or {})}
+        self.log_path = log_path  # gunicorn's error log (app tracebacks included), else inherited stderr
+        self.proc = None
+        self._log = None
+
+    def __enter__(self):
+        self._log = open(self.log_path, "w") if self.log_path else None
+        self.proc = subprocess.Popen(self.cmd, env=self.env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                     stderr=self._log)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                urllib.request.urlopen(self.base_url + "/healthz", timeout=1).read()
+                return self
+            except OSError:
+                if self.proc.poll() is not None:
+                    raise RuntimeError("gunicorn exited during startup")
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError("gunicorn did not start within 30s")
+
+    def __exit__(self, *exc):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self._log:
+            self._log.close()
+            self._log = None
+
+def run_scenario(name, sessions, requests, concurrency, warmup, seed):
+    from calc_engine import PLANS
+    rng = random.Random(seed)
+    plans = [p for p in PLANS.values() if p.fields]
+    jobs = [(sessions[i % len(sessions)], *scenario_request(name, rng, plans)) for i in range(warmup + requests)]
+    for session, method, path, form in jobs[:warmup]:
+        session.request(method, path, form)
+    latencies = []; errors = [0]; lock = threading.Lock()
+    def one(job):
+        session, method, path, form = job
+        t0 = time.perf_counter()
+        try:
+            ok = session.request(method, path, form) < 400
+        except Exception:
+            ok = False
+        ms = (time.perf_counter() - t0) * 1000
+        with lock:
+            if ok:
+                latencies.append(ms)
+            else:
+                errors[0] += 1
+    t0 = time.perf_counter()
+    if concurrency <= 1:
+        for job in jobs[warmup:]:
+            one(job)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, jobs[warmup:]))
+    return summarize(latencies, errors[0], time.perf_counter() - t0)
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    cache_env = {"PAGE_CACHE_SIZE": "0", "AGG_CACHE_SIZE": "0"} if args.no_cache else {}
+    scenarios = args.scenarios.split(",") if args.scenarios else SCENARIOS
+    import sqlite3
+    conn = sqlite3.connect(args.db)
+    usernames = [r[0] for r in conn.execute("SELECT username FROM users WHERE username LIKE 'bench_user_%' ORDER BY id")]
+    conn.close()
+    if not usernames:
+        raise SystemExit("❌ No bench users in this DB; run `python benchmark.py generate` first.")
+    usernames = usernames[:args.sessions]
+    results = {}
+    if args.driver == "client":
+        os.environ.update({"EMISSIONS_DB": os.path.abspath(args.db), **cache_env})
+        from app import app
+        sessions = [ClientSession(app, u) for u in usernames]
+        for name in scenarios:
+            results[name] = run_scenario(name, sessions, args.requests, 1, args.warmup, args.seed)
+            print(f"✅ {name}: {fmt(results[name])}")
+    else:
+        with Gunicorn(args.db, args.workers, args.threads, cache_env) as server:
+            sessions = [HttpSession(server.base_url, u) for u in usernames]
+            for name in scenarios:
+                results[name] = run_scenario(name, sessions, args.requests, args.concurrency, args.warmup, args.seed)
+                print(f"✅ {name}: {fmt(results[name])}")
+    report = {
+        "meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "driver": args.driver, "db": args.db,
+                 "sessions": len(usernames), "requests": args.requests, "warmup": args.warmup,
+                 "concurrency": args.concurrency if args.driver == "gunicorn" else 1,
+                 "workers": args.workers if args.driver == "gunicorn" else None, "cache": not args.no_cache},
+        "results": results,
+    }
+    out = args.out or f"bench-{report['meta']['commit'] or 'local'}-{args.driver}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"🎯 results written to {out}")
+
+def fmt(r):
+    def ms(v):
+        return "-" if v is None else f"{v:.1f}ms"
+    return (f"p50 {ms(r['p50_ms'])}  p95 {ms(r['p95_ms'])}  p99 {ms(r['p99_ms'])}  "
+            f"{r['throughput_rps'] or 0:.1f} req/s  errors {r['errors']}/{r['requests']}")
+
+def compare(old_path, new_path):
+    old, new = (json.load(open(p)) for p in (old_path, new_path))
+    print(f"{'scenario':<20}{'metric':<8}{old['meta']['commit'] or 'old':>12}{new['meta']['commit'] or 'new':>12}{'change':>10}")
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            a, b = old["results"][name][metric], new["results"][name][metric]
+            change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else "-"
+            print(f"{name:<20}{metric[:-3] if metric.endswith('_ms') else 'rps':<8}{a or 0:>12.2f}{b or 0:>12.2f}{change:>10}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    g = sub.add_parser("generate", help="build a synthetic benchmark DB")
+    g.add_argument("--db", default="bench.db")
+    g.add_argument("--users", type=int, default=20)
+    g.add_argument("--rows", type=int, default=2000, help="emissions rows per user")
+    g.add_argument("--days", type=int, default=1095, help="spread created_at over this many days")
+    g.add_argument("--seed", type=int, default=42)
+    r = sub.add_parser("run", help="replay scenarios and write a JSON report")
+    r.add_argument("--db", default="bench.db")
+    r.add_argument("--driver", choices=["client", "gunicorn"], default="client")
+    r.add_argument("--scenarios", help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    r.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    r.add_argument("--warmup", type=int, default=10)
+    r.add_argument("--sessions", type=int, default=20, help="logged-in users to spread requests over")
+    r.add_argument("--workers", type=int, default=2)
+    r.add_argument("--threads", type=int, default=1)
+    r.add_argument("--concurrency", type=int, default=4)
+    r.add_argument("--no-cache", action="store_true", help="disable the page / aggregate caches")
+    r.add_argument("--seed", type=int, default=7)
+    r.add_argument("--out")
+    c = sub.add_parser("compare", help="print the change between two reports")
+    c.add_argument("old"); c.add_argument("new")
+    args = parser.parse_args()
+    if args.command == "generate":
+        info = generate(args.db, args.users, args.rows, args.days, args.seed)
+        print(f"🎯 {args.db}: {info['emissions']} emissions rows for {info['users']} users over {info['codes']} process codes")
+    elif args.command == "run":
+        run(args)
+    else:
+        compare(args.old, args.new)
@@ -0,0 +1,96 @@
+# bulk.py
+"""
+Bulk activity submission for /api/emissions/bulk:
+- parse_records() accepts JSON ({"records": [...]} or a bare list of {process_code, inputs})
+  or CSV (a process_code column plus one column per input key)
+- validate_records() checks every record against PROCESS_QUESTIONS and the factor table
+- compute_rows() computes each process group with calc_engine.compute_batch, and write_rows() writes
+  the rows with their rollups and emission_inputs in the caller's transaction; the write queue runs
+  the two halves in different threads
+"""
+
+import csv, io, json
+from datetime import datetime
+from calc_engine import get_plan
+from process_questions import PROCESS_QUESTIONS
+from emission_inputs import insert_emissions
+from rollups import add_emissions
+
+MAX_BULK_RECORDS = 5000
+
+def parse_records(req):
+    """Records from a Flask request as a list of {"process_code", "inputs"}; raises ValueError on a bad payload."""
+    upload = req.files.get("file")
+    if upload is not None or (req.mimetype or "").endswith("csv"):
+        text = upload.read().decode("utf-8-sig") if upload is not None else req.get_data(as_text=True)
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or "process_code" not in reader.fieldnames:
+            raise ValueError("CSV needs a 'process_code' header column.")
+        records = []
+        for row in reader:
+            inputs = {k: v for k, v in row.items() if k != "process_code" and k is not None and v not in (None, "")}
+            records.append({"process_code": (row.get("process_code") or "").strip(), "inputs": inputs})
+    else:
+        payload = req.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload = payload.get("records")
+        if not isinstance(payload, list):
+            raise ValueError('Send JSON {"records": [{"process_code": ..., "inputs": {...}}, ...]} or a CSV file.')
+        records = payload
+    if len(records) > MAX_BULK_RECORDS:
+        raise ValueError(f"Too many records ({len(records)}); the limit is {MAX_BULK_RECORDS} per request.")
+    return records
+
+def validate_records(records, factors):
+    """Split records into (valid, results): valid is [(index, code, inputs)], results holds an entry per record."""
+    valid = []; results = [None] * len(records)
+    for i, rec in enumerate(records):
+        code = rec.get("process_code") if isinstance(rec, dict) else None
+        inputs = rec.get("inputs", {}) if isinstance(rec, dict) else None
+        error = None
+        if not code or not isinstance(code, str):
+            error = "Missing process_code."
+        elif code not in PROCESS_QUESTIONS:
+            error = f"Unknown process_code '{code}'."
+        elif code not in factors:
+            error = f"No emission factor configured for '{code}'."
+        elif not isinstance(inputs, dict):
+            error = "'inputs' must be an object of question key -> value."
+        else:
+            unknown = sorted(set(inputs) - set(get_plan(code).input_keys))
+            if unknown:
+                error = f"Unknown input key(s) for {code}: {', '.join(unknown)}."
+        if error:
+            results[i] = {"index": i, "status": "error", "error": error}
+        else:
+            valid.append((i, code, inputs))
+    return valid, results
+
+def compute_rows(user_uk, valid, factors, results):
+    """emissions rows for the valid records, in submission order; fills their entries in results."""
+    groups = {}
+    for i, code, inputs in valid:
+        groups.setdefault(code, []).append((i, inputs))
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    for code, items in groups.items():
+        plan = get_plan(code)
+        f = factors[code]
+        factor = float(f["factor"] or 0.0)
+        activity = plan.compute_batch({k: [inputs.get(k) for _, inputs in items] for k in plan.input_keys})
+        for (i, inputs), value in zip(items, activity.tolist()):
+            if value != value:  # NaN: question-less process without a numeric quantity
+                results[i] = {"index": i, "status": "error", "error": "Please enter a numeric quantity."}
+                continue
+            emission = value * factor
+            rows.append((i, (user_uk, code, f["process_desc"], f["scope"], f["unit"],
+                             json.dumps(plan.input_details(inputs), ensure_ascii=False), factor, emission, now)))
+            results[i] = {"index": i, "status": "ok", "process_code": code, "activity_value": value, "emission": emission}
+    rows.sort(key=lambda r: r[0])  # keep submission order in the table
+    return [r for _, r in rows]
+
+def write_rows(cur, user_uk, rows):
+    """Insert computed rows plus their rollups and emission_inputs (caller commits)."""
+    insert_emissions(cur, rows)
+    add_emissions(cur, [(r[0], r[1], r[2], r[3], r[7]) for r in rows])
+    return len(rows)
@@ -0,0 +1,160 @@
+# calc_engine.py
+"""
+One home for the activity-value rules used by the web calculator and the Excel importer:
+- every PROCESS_QUESTIONS entry is precompiled into a Plan at import (operation, the numeric
+  key to prefer for 'single', per-process adjustments), so a request does no list scanning
+- compute(process_code, inputs) handles one submitted record, compute_batch(process_code, columns)
+  the same plan over arrays of records
+- FORMULAS hold the per-sheet rules for workbook columns; compute_sheet() applies them
+"""
+
+import re
+import numpy as np
+from formula_engine import compile_formula, load_formulas
+from process_questions import PROCESS_QUESTIONS
+
+# keys a 'single' process prefers, most relevant first
+PRIORITY_KEYS = ["Fuel_Con", "Fuel_cons", "Total_Consumption", "Annual_cons", "Tot_Fuel_cons", "quantity", "Distance",
+                 "Distance_km", "Total_Consumption_kWh", "Total_Consumption(kWh)"]
+
+# processes whose form asks for a one-way value that is doubled for the round trip
+ROUND_TRIP_KEYS = {"TRANS_LMV_EM": "Distance"}
+
+# per-sheet formulas over workbook columns (see formula_engine for the allowed syntax)
+FORMULAS = {
+    "LPG_CONS_EM": "row.get('LPG_no',0) * row.get('Weight_LPG',0)",
+    "DG_CONS_EM": "row.get('Fuel_cons',0)",
+    "COMP_EM": "row.get('Compost_gen',0)",
+    "HEMV_FUEL_EM": "row.get('Fuel_Con',0) or row.get('Fuel_Cons',0)",
+    "OVER_B_EM": "row.get('T',0) or row.get('t',0) or row.get('m3',0)"
+}
+SHEET_FORMULAS = {code: compile_formula(src) for code, src in FORMULAS.items()}
+
+NUMBER_RE = re.compile(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?")
+
+def parse_float_safe(v):
+    """Try to parse numeric user input to float, return None if not numeric."""
+    if v is None:
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    s = str(v).strip()
+    if s == "":
+        return None
+    # remove commas and non-numeric trailing text
+    s = s.replace(",", "")
+    m = NUMBER_RE.search(s)
+    if m:
+        try:
+            return float(m.group(0))
+        except:
+            return None
+    return None
+
+def parse_float_column(values):
+    """parse_float_safe over a sequence; missing / non-numeric entries become NaN."""
+    out = np.empty(len(values))
+    for i, v in enumerate(values):
+        num = parse_float_safe(v)
+        out[i] = np.nan if num is None else num
+    return out
+
+class Plan:
+    """Precompiled activity-value rule for one process code."""
+    __slots__ = ("process_code", "fields", "keys", "input_keys", "operation", "preferred", "round_trip")
+
+    def __init__(self, process_code, meta):
+        self.process_code = process_code
+        self.fields = [(f.get("key"), f.get("question")) for f in meta.get("fields", [])]
+        self.keys = [k for k, _ in self.fields]
+        self.input_keys = self.keys or ["quantity"]  # what a submission may carry
+        self.operation = meta.get("operation", "single")
+        self.preferred = [k for k in dict.fromkeys(PRIORITY_KEYS) if k in self.keys]
+        self.round_trip = ROUND_TRIP_KEYS.get(process_code)
+
+    def input_details(self, inputs):
+        """Submitted raw values keyed by their question text, as stored in emissions.input_details."""
+        details = {}
+        for key, question in self.fields:
+            raw = inputs.get(key)
+            details[question] = raw if raw is not None else ""
+        return details
+
+    def compute(self, inputs):
+        """Activity value for one record of raw inputs; None when a question-less process has no numeric quantity."""
+        if not self.fields:
+            return parse_float_safe(inputs.get("quantity"))
+        numeric_values = {}
+        for key in self.keys:
+            num = parse_float_safe(inputs.get(key))
+            if num is not None:
+                numeric_values[key] = num
+        if self.operation == "multiply":
+            prod = 1.0
+            for v in numeric_values.values():
+                prod *= v
+            return prod if numeric_values else 0.0
+        if self.operation == "sum":
+            return sum(numeric_values.values()) if numeric_values else 0.0
+        # 'single': the preferred key, else (also when it is 0) the first numeric value
+        picked = next((numeric_values[k] for k in self.preferred if k in numeric_values), None)
+        if not picked and numeric_values:
+            picked = next(iter(numeric_values.values()))
+        activity_value = float(picked) if picked is not None else 0.0
+        if self.round_trip and self.round_trip in numeric_values:
+            activity_value = numeric_values[self.round_trip] * 2.0
+        return activity_value
+
+    def compute_batch(self, columns):
+        """Vectorized compute(): columns maps input key -> sequence of raw values (all the same length).
+
+        Returns a float array; for a question-less process, rows without a numeric quantity are NaN.
+        """
+        n = len(next(iter(columns.values()))) if columns else 0
+        def col(key):
+            return parse_float_column(columns[key]) if key in columns else np.full(n, np.nan)
+        if not self.fields:
+            return col("quantity")
+        vals = np.vstack([col(k) for k in self.keys])  # fields x rows
+        present = ~np.isnan(vals)
+        any_present = present.any(axis=0)
+        if self.operation == "multiply":
+            return np.where(any_present, np.prod(np.where(present, vals, 1.0), axis=0), 0.0)
+        if self.operation == "sum":
+            return np.where(any_present, np.sum(np.where(present, vals, 0.0), axis=0), 0.0)
+        picked = np.full(n, np.nan)
+        for k in reversed(self.preferred):
+            v = vals[self.keys.index(k)]
+            picked = np.where(np.isnan(v), picked, v)
+        first = np.full(n, np.nan)
+        for v in vals[::-1]:
+            first = np.where(np.isnan(v), first, v)
+        fallback = (np.isnan(picked) | (picked == 0)) & any_present
+        out = np.where(fallback, first, picked)
+        out = np.where(np.isnan(out), 0.0, out)
+        if self.round_trip:
+            dist = vals[self.keys.index(self.round_trip)]
+            out = np.where(np.isnan(dist), out, dist * 2.0)
+        return out
+
+PLANS = {code: Plan(code, meta) for code, meta in PROCESS_QUESTIONS.items()}
+
+def get_plan(process_code):
+    """Plan for a code; codes without questions get a plain 'quantity' plan."""
+    plan = PLANS.get(process_code)
+    return plan if plan is not None else Plan(process_code, {})
+
+def compute(process_code, inputs):
+    return get_plan(process_code).compute(inputs)
+
+def compute_batch(process_code, columns):
+    return get_plan(process_code).compute_batch(columns)
+
+def sheet_formulas(conn=None):
+    """Compiled per-sheet formulas, with calc_formulas overrides when a connection is given."""
+    return load_formulas(conn, FORMULAS) if conn is not None else dict(SHEET_FORMULAS)
+
+def compute_sheet(process_code, columns, n, formulas=None):
+    """Activity values for a workbook sheet from its parsed numeric columns; None if the sheet has no formula."""
+    formula = (formulas if formulas is not None else SHEET_FORMULAS).get(process_code)
+    return formula.evaluate_columns(columns, n) if formula else None
@@ -0,0 +1,77 @@
+# catalog.py
+"""
+Process catalog for the calculator (/api/catalog):
+- every PROCESS_QUESTIONS entry (fields, operation) merged with its emission_factors row
+  (process_desc, scope, unit, calc_type), plus factor rows that have no questions
+- serialised once per factors_version and per worker: the JSON bytes are kept with gzip and, when
+  the optional brotli package is installed (pip install brotli; it is not in requirements.txt),
+  brotli copies, so requests never re-encode or re-compress
+- the strong ETag is a hash of the JSON (with a suffix per encoding); the calculator loads
+  /api/catalog?v=<hash>, which is cached for a year as immutable, so switching processes makes no
+  requests and a factor change simply produces a new URL
+"""
+
+import gzip, hashlib, json, threading
+from flask import Response, request
+from process_questions import PROCESS_QUESTIONS
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, no-cache"
+
+_lock = threading.Lock()
+_state = {"version": object(), "built": None}
+
+def build(factors_by_code):
+    """{"processes": {code: {...}}} for every code with questions or a factor."""
+    processes = {}
+    for code in sorted(set(PROCESS_QUESTIONS) | set(factors_by_code)):
+        q = PROCESS_QUESTIONS.get(code, {})
+        f = factors_by_code.get(code) or {}
+        processes[code] = {
+            "process_desc": f.get("process_desc"), "scope": f.get("scope"), "unit": f.get("unit"),
+            "calc_type": f.get("calc_type"), "has_factor": code in factors_by_code,
+            "operation": q.get("operation", "single"), "questions": q.get("fields", []),
+        }
+    return {"processes": processes}
+
+def _encode(payload):
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()[:32]
+    bodies = {"identity": raw, "gzip": gzip.compress(raw, 9, mtime=0)}
+    try:
+        import brotli
+        bodies["br"] = brotli.compress(raw, quality=11)
+    except ImportError:
+        pass
+    return {"hash": digest, "bodies": bodies}
+
+def current(repo):
+    """The encoded catalog for the repository's factors_version (rebuilt only when it moves)."""
+    version = repo.factors_version()
+    with _lock:
+        if _state["built"] is not None and version is not None and version == _state["version"]:
+            return _state["built"]
+    built = _encode(build(repo.factors_by_code()))
+    with _lock:
+        _state.update(version=version, built=built)
+    return built
+
+def version(repo):
+    """Hash to put in the catalog URL (?v=...)."""
+    return current(repo)["hash"]
+
+def response(repo):
+    built = current(repo)
+    bodies = built["bodies"]
+    encoding = next((e for e in ("br", "gzip") if e in bodies and request.accept_encodings[e]), "identity")
+    etag = built["hash"] if encoding == "identity" else f"{built['hash']}-{encoding}"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = Response(bodies[encoding], mimetype="application/json")
+        if encoding != "identity":
+            resp.headers["Content-Encoding"] = encoding
+    resp.set_etag(etag)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = IMMUTABLE if request.args.get("v") == built["hash"] else REVALIDATE
+    return resp
@@ -0,0 +1,36 @@
+# conftest.py
+"""
+Shared pytest fixtures:
+- database: a scratch SQLite file with the app's schema and init_db's fallback factors (no workbook)
+- app / client: the Flask app pointed at that file, and a test client logged in as a fresh user
+EMISSIONS_DB is redirected before anything imports app.py, so the tests never open emissions.db.
+"""
+
+import os, tempfile
+import pytest
+
+os.environ["EMISSIONS_DB"] = os.path.join(tempfile.mkdtemp(prefix="carbon_tests_"), "emissions.db")
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    import init_db
+    monkeypatch.setattr(init_db, "DB", str(tmp_path / "emissions.db"))
+    conn = init_db.recreate_db()
+    init_db.insert_factors_to_db(conn, {})  # IPCC_FACTORS_BY_CODE only
+    conn.close()
+    return init_db.DB
+
+@pytest.fixture
+def app(database, monkeypatch):
+    from app import app
+    monkeypatch.setitem(app.config, "DATABASE", database)
+    return app
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post("/", data={"action": "register", "username": "tester", "password": "pw", "email": "tester@example.com"})
+    client.post("/", data={"action": "login", "username": "tester", "password": "pw"})
+    with client.session_transaction() as session:
+        client.user_uk = session["user_uk"]
+    return client
@@ -0,0 +1,217 @@
+# db.py
+"""
+SQLite connection layer for the web app:
+- one connection per worker thread, opened on first use and reused by every later request
+  on that thread (gunicorn sync workers have one thread, gthread workers a few)
+- each connection runs in WAL mode with busy_timeout, synchronous=NORMAL and the
+  mmap_size / cache_size below, all overridable through SQLITE_* environment variables
+- get_db() binds the thread's connection to the request (flask.g); teardown rolls back
+  whatever the route left uncommitted instead of closing the connection
+- STATS records how long writers waited for the write lock, plus "database is locked" failures,
+  so contention on the single file shows up early; under WAL that wait happens when a transaction
+  takes the lock (BEGIN IMMEDIATE, or the first INSERT / UPDATE / DELETE of an implicit one), not
+  at commit, so the first write of an implicit transaction gets an explicit, timed BEGIN IMMEDIATE
+- every execute / fetch is reported to the callables in QUERY_HOOKS (instrumentation.py registers
+  one); with no hooks registered nothing is timed
+"""
+
+import os, sqlite3, threading, time
+from flask import current_app, g
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-20000"))  # negative = KiB, so ~20 MB per connection
+SLOW_WAIT_MS = float(os.getenv("SQLITE_SLOW_WAIT_MS", "200"))
+IN_LIST_CHUNK = 500  # values per IN (...) list, well under SQLite's bound-parameter limit
+
+QUERY_HOOKS = []  # callables (sql, ms, kind) with kind "execute" or "fetch"
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+STATS = {
+    "connections_opened": 0,
+    "lock_waits": 0, "lock_wait_ms_total": 0.0, "lock_wait_ms_max": 0.0,
+    "slow_waits": 0, "locked_errors": 0,
+}
+
+WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+LOCKING_BEGINS = ("BEGIN IMMEDIATE", "BEGIN EXCLUSIVE")
+
+def _record_lock_wait(ms):
+    with _stats_lock:
+        STATS["lock_waits"] += 1
+        STATS["lock_wait_ms_total"] += ms
+        STATS["lock_wait_ms_max"] = max(STATS["lock_wait_ms_max"], ms)
+        if ms >= SLOW_WAIT_MS:
+            STATS["slow_waits"] += 1
+
+def _count_locked(e):
+    if isinstance(e, sqlite3.OperationalError) and "locked" in str(e):
+        with _stats_lock:
+            STATS["locked_errors"] += 1
+
+def report_query(sql, t0, kind="execute"):
+    """Pass a statement that started at perf_counter() t0 to QUERY_HOOKS."""
+    ms = (time.perf_counter() - t0) * 1000
+    for hook in QUERY_HOOKS:
+        hook(sql, ms, kind)
+
+def _lock_statement(conn, sql):
+    """The statement with which conn takes the write lock before running sql, or None.
+
+    An explicit BEGIN IMMEDIATE / EXCLUSIVE is its own; a write outside a transaction would make
+    sqlite3 open a deferred one and wait inside the INSERT, so it gets a BEGIN IMMEDIATE first.
+    """
+    head = sql.lstrip()[:15].upper()
+    if head.startswith(LOCKING_BEGINS):
+        return sql
+    if head.startswith(WRITE_VERBS) and not conn.in_transaction and conn.isolation_level is not None:
+        return "BEGIN IMMEDIATE"
+    return None
+
+class Cursor(sqlite3.Cursor):
+    """sqlite3 cursor reporting its statements and fetches to QUERY_HOOKS and timing write-lock waits."""
+    _sql = None
+
+    def _take_write_lock(self, sql):
+        """Run sql's locking statement (if any) timed; True if that was sql itself."""
+        lock = _lock_statement(self.connection, sql)
+        if lock is None:
+            return False
+        t0 = time.perf_counter()
+        try:
+            super().execute(lock)
+        except sqlite3.OperationalError as e:
+            _count_locked(e)
+            raise
+        finally:
+            _record_lock_wait((time.perf_counter() - t0) * 1000)
+            if QUERY_HOOKS:
+                report_query(lock, t0)
+        return lock is sql
+
+    def execute(self, sql, params=()):
+        if self._take_write_lock(sql):
+            return self
+        if not QUERY_HOOKS:
+            return super().execute(sql, params)
+        self._sql, t0 = sql, time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            report_query(sql, t0)
+
+    def executemany(self, sql, seq_of_params):
+        self._take_write_lock(sql)
+        if not QUERY_HOOKS:
+            return super().executemany(sql, seq_of_params)
+        self._sql, t0 = sql, time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            report_query(sql, t0)
+
+    # SQLite steps most of a SELECT while rows are fetched, so fetches count as database time too
+    def fetchone(self):
+        if not QUERY_HOOKS:
+            return super().fetchone()
+        t0 = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            report_query(self._sql, t0, "fetch")
+
+    def fetchmany(self, size=None):
+        if not QUERY_HOOKS:
+            return super().fetchmany(size or self.arraysize)
+        t0 = time.perf_counter()
+        try:
+            return super().fetchmany(size or self.arraysize)
+        finally:
+            report_query(self._sql, t0, "fetch")
+
+    def fetchall(self):
+        if not QUERY_HOOKS:
+            return super().fetchall()
+        t0 = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            report_query(self._sql, t0, "fetch")
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection handing out the timing Cursor, also for its execute shortcuts."""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or Cursor)
+
+    # sqlite3's own Connection.execute shortcuts bypass cursor(), so route them through Cursor
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            _count_locked(e)
+            raise
+        finally:
+            if QUERY_HOOKS:
+                report_query("COMMIT", t0)
+
+def connect(path, row_factory=sqlite3.Row):
+    """New connection to path with the pragmas above; for scripts, threads and streamed responses."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, factory=Connection)
+    conn.row_factory = row_factory
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+    with _stats_lock:
+        STATS["connections_opened"] += 1
+    return conn
+
+def _thread_connection(path):
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = connect(path)
+    return conn
+
+def get_db():
+    """The current thread's connection, bound to this request."""
+    if "db" not in g:
+        g.db = _thread_connection(current_app.config["DATABASE"])
+    return g.db
+
+def release_db(exc=None):
+    conn = g.pop("db", None)
+    if exc is not None:
+        _count_locked(exc)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+def close_thread_connections():
+    """Close this thread's cached connections (e.g. before init_db replaces the file)."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+def stats():
+    with _stats_lock:
+        out = dict(STATS)
+    n = out["lock_waits"]
+    out["lock_wait_ms_avg"] = out["lock_wait_ms_total"] / n if n else 0.0
+    return out
+
+def init_app(app, path):
+    app.config["DATABASE"] = path
+    app.teardown_appcontext(release_db)
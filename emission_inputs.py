@@ -0,0 +1,140 @@
+# emission_inputs.py
+"""
+Structured copy of emissions.input_details:
+- emission_inputs holds one row per submitted answer (emission_id, position, input_key, question,
+  value_text, value_num), written in the same transaction as the emissions rows
+- value_num is the answer as a number (NULL when it is not one), so the read paths never json.loads
+  and input totals are plain SQL, e.g. total diesel litres for a user:
+    SELECT SUM(i.value_num) FROM emission_inputs i JOIN emissions e ON e.id = i.emission_id
+    WHERE e.user_uk = ? AND i.input_key = 'Fuel_cons'
+- insert_emissions() inserts emissions rows one by one (INSERT ... RETURNING id, so ids are never
+  guessed) and writes their inputs from the rows it was handed; sync_inputs() reads stored
+  input_details back from the table instead, for migration 6's backfill and copies of older databases
+"""
+
+import json, math
+from calc_engine import get_plan
+from db import IN_LIST_CHUNK
+
+INPUTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS emission_inputs (
+    emission_id INTEGER NOT NULL, position INTEGER NOT NULL,
+    input_key TEXT, question TEXT, value_text TEXT, value_num REAL,
+    PRIMARY KEY (emission_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_emission_inputs_key ON emission_inputs(input_key, emission_id);
+CREATE TRIGGER IF NOT EXISTS trg_emission_inputs_del AFTER DELETE ON emissions
+BEGIN DELETE FROM emission_inputs WHERE emission_id = OLD.id; END;
+"""
+
+INSERT_SQL = """
+    INSERT INTO emission_inputs (emission_id, position, input_key, question, value_text, value_num)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_EMISSION_SQL = """
+    INSERT INTO emissions (user_uk, process_code, process_desc, scope, unit, input_details, factor_used, emission, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    RETURNING id
+"""
+
+def to_number(v):
+    """The answer as a float the way Jinja's |float reads it, or None (bools, text, NaN/inf)."""
+    if isinstance(v, bool) or v is None:
+        return None
+    try:
+        num = float(v)
+    except (TypeError, ValueError):
+        return None
+    return num if math.isfinite(num) else None
+
+def input_rows(emission_id, process_code, details):
+    """emission_inputs rows for one emissions row's input_details dict."""
+    plan = get_plan(process_code)
+    key_for = {question: key for key, question in plan.fields}
+    rows = []
+    for position, (question, value) in enumerate(details.items()):
+        key = key_for.get(question, question)  # workbook rows are keyed by column name already
+        rows.append((emission_id, position, key, question,
+                     None if value is None else str(value), to_number(value)))
+    return rows
+
+def _details(raw):
+    try:
+        details = json.loads(raw or "{}")
+    except ValueError:
+        return None
+    return details if isinstance(details, dict) else None
+
+def insert_emissions(cur, rows):
+    """Insert emissions rows (user_uk, process_code, process_desc, scope, unit, input_details,
+    factor_used, emission, created_at) and their emission_inputs; returns the new ids in row order."""
+    ids, inputs = [], []
+    for row in rows:
+        cur.execute(INSERT_EMISSION_SQL, row)
+        emission_id = cur.fetchone()[0]
+        ids.append(emission_id)
+        details = _details(row[5])
+        if details:
+            inputs.extend(input_rows(emission_id, row[1], details))
+    if inputs:
+        cur.executemany(INSERT_SQL, inputs)
+    return ids
+
+def sync_inputs(cur, after_id=0, user_uk=None, batch_size=1000):
+    """Write emission_inputs for emissions rows with id > after_id (of one user, if given) that have none yet."""
+    n = 0
+    while True:
+        where = ["e.id > ?", "NOT EXISTS (SELECT 1 FROM emission_inputs i WHERE i.emission_id = e.id)"]
+        params = [after_id]
+        if user_uk is not None:
+            where.append("e.user_uk = ?"); params.append(user_uk)
+        cur.execute(f"""
+            SELECT e.id, e.process_code, e.input_details FROM emissions e
+            WHERE {" AND ".join(where)} ORDER BY e.id LIMIT ?
+        """, params + [batch_size])
+        pending = cur.fetchall()
+        rows = []
+        for emission_id, code, raw in pending:
+            details = _details(raw)
+            if details:
+                rows.extend(input_rows(emission_id, code, details))
+        if rows:
+            cur.executemany(INSERT_SQL, rows)
+            n += len(rows)
+        if len(pending) < batch_size:
+            return n
+        after_id = pending[-1][0]
+
+def load_inputs(cur, ids):
+    """{emission_id: [(question, value_text, value_num), ...]} in submission order."""
+    out = {i: [] for i in ids}
+    ids = list(out)
+    for start in range(0, len(ids), IN_LIST_CHUNK):
+        chunk = ids[start:start + IN_LIST_CHUNK]
+        cur.execute(f"""
+            SELECT emission_id, question, value_text, value_num FROM emission_inputs
+            WHERE emission_id IN ({", ".join("?" * len(chunk))})
+            ORDER BY emission_id, position
+        """, chunk)
+        for r in cur.fetchall():
+            out[r[0]].append((r[1], r[2], r[3]))
+    return out
+
+def numeric_details(items):
+    """{question: value_num} for display; non-numeric answers are None."""
+    return {question: num for question, _, num in items}
+
+def details_text(items):
+    """'question: value; ...' as shown in the activity list and CSV exports."""
+    return "; ".join(f"{question}: {text}" for question, text, _ in items)
+
+def create_inputs_table(conn):
+    conn.executescript(INPUTS_SCHEMA)
+
+def backfill_inputs(conn):
+    """Create emission_inputs and fill it from every existing input_details blob."""
+    create_inputs_table(conn)
+    n = sync_inputs(conn.cursor())
+    conn.commit()
+    return n
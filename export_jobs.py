@@ -0,0 +1,147 @@
+# export_jobs.py
+"""
+Background export jobs for columnar / spreadsheet reports (XLSX, Parquet, Arrow):
+- submit_job() builds the file on a small thread pool so the request worker returns immediately
+- job state lives in a JSON file next to the output in EXPORT_DIR (a jobs.JobStore), so any gunicorn
+  worker can answer a poll
+- evict_expired() drops finished jobs older than EXPORT_TTL seconds and caps them at EXPORT_MAX_JOBS; queued
+  and running jobs are kept, unless untouched for EXPORT_STALE seconds (their worker was killed)
+- XLSX needs openpyxl; Parquet / Arrow need the optional pyarrow package
+"""
+
+import os, tempfile, time
+from exports import EXPORT_COLUMNS
+from jobs import JobStore
+from repository import open_repository
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "carbon_exports"))
+EXPORT_TTL = int(os.getenv("EXPORT_TTL", "3600"))
+EXPORT_MAX_JOBS = int(os.getenv("EXPORT_MAX_JOBS", "50"))
+EXPORT_STALE = int(os.getenv("EXPORT_STALE", "86400"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+
+_jobs = JobStore(EXPORT_DIR, EXPORT_WORKERS, "export")
+
+# --- Writers: each takes (path, batches) where batches yields lists of EXPORT_COLUMNS rows ---
+def _write_xlsx(path, batches):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)  # rows are streamed to disk, not kept in memory
+    ws = wb.create_sheet("Emissions")
+    ws.append(EXPORT_COLUMNS)
+    n = 0
+    for batch in batches:
+        for row in batch:
+            ws.append(row); n += 1
+    wb.save(path)
+    return n
+
+def _arrow_batches(batches):
+    import pyarrow as pa
+    schema = pa.schema([(c, pa.float64() if i >= 5 else pa.string()) for i, c in enumerate(EXPORT_COLUMNS)])
+    def to_batch(rows):
+        cols = list(zip(*rows))
+        return pa.record_batch([pa.array(col, type=f.type) for col, f in zip(cols, schema)], schema=schema)
+    return schema, (to_batch(b) for b in batches)
+
+def _write_parquet(path, batches):
+    import pyarrow.parquet as pq
+    schema, record_batches = _arrow_batches(batches)
+    n = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rb in record_batches:
+            writer.write_batch(rb); n += rb.num_rows
+    return n
+
+def _write_arrow(path, batches):
+    import pyarrow as pa
+    schema, record_batches = _arrow_batches(batches)
+    n = 0
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for rb in record_batches:
+            writer.write_batch(rb); n += rb.num_rows
+    return n
+
+FORMATS = {
+    "xlsx": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", _write_xlsx, "openpyxl"),
+    "parquet": (".parquet", "application/vnd.apache.parquet", _write_parquet, "pyarrow"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file", _write_arrow, "pyarrow"),
+}
+
+def available_formats():
+    """Formats whose writer library is importable in this environment."""
+    out = []
+    for fmt, (_, _, _, module) in FORMATS.items():
+        try:
+            __import__(module); out.append(fmt)
+        except ImportError:
+            pass
+    return out
+
+# --- Job state ---
+def get_job(job_id):
+    """Job status dict, or None if unknown / evicted."""
+    return _jobs.get(job_id)
+
+def job_file(status):
+    return os.path.join(EXPORT_DIR, status["id"] + FORMATS[status["format"]][0])
+
+def evict_expired(now=None):
+    """Remove expired finished jobs, then the oldest finished ones beyond EXPORT_MAX_JOBS."""
+    if not os.path.isdir(EXPORT_DIR):
+        return 0
+    now = now or time.time()
+    jobs, doomed = [], []
+    for name in os.listdir(EXPORT_DIR):
+        if name.endswith(".json"):
+            path = os.path.join(EXPORT_DIR, name)
+            try:
+                mtime = os.path.getmtime(path)  # the status is rewritten when the job finishes
+            except OSError:
+                continue
+            status = _jobs.get(name[:-5])
+            if status is not None and status["status"] in ("queued", "running"):
+                if now - mtime > EXPORT_STALE:
+                    doomed.append(name[:-5])
+                continue
+            jobs.append((mtime, name[:-5]))
+    jobs.sort()
+    doomed += [j for t, j in jobs if now - t > EXPORT_TTL]
+    keep = [j for t, j in jobs if now - t <= EXPORT_TTL]
+    doomed += keep[:max(len(keep) - EXPORT_MAX_JOBS, 0)]
+    for job_id in doomed:
+        for ext in [".json"] + [e for f in FORMATS.values() for e in (f[0], f[0] + ".part")]:
+            try:
+                os.remove(os.path.join(EXPORT_DIR, job_id + ext))
+            except OSError:
+                pass
+    return len(doomed)
+
+def _run_job(database, status, filters):
+    status.update(status="running"); _jobs.write(status)
+    ext, _, writer, _ = FORMATS[status["format"]]
+    out = job_file(status); tmp = out + ".part"
+    repo = open_repository(database)
+    try:
+        rows = writer(tmp, repo.export_batches(status["user_uk"], filters))
+        os.replace(tmp, out)
+        outcome = dict(status="done", rows=rows)
+    except Exception as e:
+        outcome = dict(status="failed", error=str(e))
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    finally:
+        repo.close()
+    _jobs.finish(status, **outcome)
+
+def submit_job(database, user_uk, fmt, filters):
+    """Queue an export and return its initial status; raises ValueError for an unsupported format."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Choose one of: {', '.join(FORMATS)}")
+    if fmt not in available_formats():
+        raise ValueError(f"Export format '{fmt}' is not available on this server ({FORMATS[fmt][3]} not installed).")
+    evict_expired()
+    status = _jobs.create(user_uk=user_uk, format=fmt, rows=None, filters={k: str(v) for k, v in filters.items()})
+    _jobs.submit(_run_job, database, dict(status), filters)
+    return status
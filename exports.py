@@ -0,0 +1,81 @@
+# exports.py
+"""
+Streaming export of a user's emissions for /export_data:
+- the query is read in fetchmany() batches, so memory stays flat for any export size
+- rows are written through the csv module into a small reusable buffer
+- optional date range (start/end, YYYY-MM-DD, both inclusive) and scope filters
+- gzip_stream() wraps the CSV chunks when the client accepts gzip
+"""
+
+import csv, io, zlib
+from datetime import datetime, timedelta
+from emission_inputs import details_text, load_inputs
+
+BATCH_SIZE = 1000
+EXPORT_COLUMNS = ["Date", "Process Description", "Scope", "Unit", "Activity Details",
+                  "Emission Factor (kg CO2e/unit)", "Emission (kg CO2e)"]
+
+def parse_export_filters(args):
+    """Read start/end/scope from request args; raises ValueError on a bad date."""
+    filters = {}
+    for key in ("start", "end"):
+        v = (args.get(key) or "").strip()
+        if v:
+            try:
+                filters[key] = datetime.strptime(v, "%Y-%m-%d").date()
+            except ValueError:
+                raise ValueError(f"'{key}' must be a date in YYYY-MM-DD format")
+    scope = (args.get("scope") or "").strip()
+    if scope:
+        filters["scope"] = scope
+    return filters
+
+def export_query(user_uk, start=None, end=None, scope=None):
+    """SQL + params for a user's export rows, newest first."""
+    where = ["user_uk = ?"]; params = [user_uk]
+    if start:
+        where.append("created_at >= ?"); params.append(start.strftime("%Y-%m-%d"))
+    if end:
+        where.append("created_at < ?"); params.append((end + timedelta(days=1)).strftime("%Y-%m-%d"))
+    if scope:
+        where.append("scope = ?"); params.append(scope)
+    sql = f"""
+        SELECT id, created_at, process_desc, scope, unit, factor_used, emission
+        FROM emissions
+        WHERE {" AND ".join(where)}
+        ORDER BY created_at DESC, id DESC
+    """
+    return sql, params
+
+def iter_export_rows(cur, inputs_cur, batch_size=BATCH_SIZE):
+    """Yield lists of export rows (EXPORT_COLUMNS order) from an executed cursor; each batch's
+    answers come from emission_inputs through inputs_cur (a second cursor on the same connection)."""
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        inputs = load_inputs(inputs_cur, [r["id"] for r in rows])
+        yield [[r["created_at"], r["process_desc"], r["scope"], r["unit"], details_text(inputs[r["id"]]),
+                r["factor_used"], r["emission"]] for r in rows]
+
+def iter_csv(batches):
+    """Yield CSV text one batch of export rows at a time, header first."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    def drain():
+        chunk = buf.getvalue(); buf.seek(0); buf.truncate()
+        return chunk
+    writer.writerow(EXPORT_COLUMNS)
+    yield drain()
+    for batch in batches:
+        writer.writerows(batch)
+        yield drain()
+
+def gzip_stream(chunks, level=6):
+    """gzip-encode an iterable of text chunks on the fly."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = z.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield z.flush()
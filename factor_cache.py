@@ -0,0 +1,62 @@
+# factor_cache.py
+"""
+In-process cache of the emission_factors table:
+- holds every factor row by process_code plus the list sorted by process_desc for the calculator
+- app_meta.factors_version is bumped by triggers on any INSERT/UPDATE/DELETE of emission_factors,
+  whoever makes the change (admin edit, init_db, import_excel, sqlite shell)
+- each lookup compares that single integer with the cached one, so every gunicorn worker sees a
+  change on its next request and otherwise never re-reads the factor table
+"""
+
+import sqlite3, threading
+
+FACTOR_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS app_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0);
+INSERT OR IGNORE INTO app_meta (key, value) VALUES ('factors_version', 1);
+CREATE TRIGGER IF NOT EXISTS trg_factors_version_ins AFTER INSERT ON emission_factors
+BEGIN UPDATE app_meta SET value = value + 1 WHERE key = 'factors_version'; END;
+CREATE TRIGGER IF NOT EXISTS trg_factors_version_upd AFTER UPDATE ON emission_factors
+BEGIN UPDATE app_meta SET value = value + 1 WHERE key = 'factors_version'; END;
+CREATE TRIGGER IF NOT EXISTS trg_factors_version_del AFTER DELETE ON emission_factors
+BEGIN UPDATE app_meta SET value = value + 1 WHERE key = 'factors_version'; END;
+"""
+
+_lock = threading.Lock()
+_state = {"version": None, "by_code": {}, "processes": []}
+
+def create_factor_meta(conn):
+    conn.executescript(FACTOR_META_SCHEMA)
+
+def factors_version(cur):
+    """Current factors_version, or None on a DB without the app_meta table."""
+    try:
+        cur.execute("SELECT value FROM app_meta WHERE key = 'factors_version'")
+        row = cur.fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        return None
+
+def _load(cur):
+    version = factors_version(cur)
+    with _lock:
+        if version is not None and version == _state["version"]:
+            return _state
+        cur.execute("SELECT * FROM emission_factors ORDER BY process_desc")
+        processes = [dict(r) for r in cur.fetchall()]
+        _state.update(version=version, processes=processes, by_code={p["process_code"]: p for p in processes})
+        return _state
+
+def processes(cur):
+    """All factor rows (dicts) ordered by process_desc."""
+    return _load(cur)["processes"]
+
+def get_factor(cur, process_code):
+    """Factor row for a code, or None."""
+    return _load(cur)["by_code"].get(process_code)
+
+def factors_by_code(cur):
+    return _load(cur)["by_code"]
+
+def invalidate():
+    with _lock:
+        _state["version"] = None
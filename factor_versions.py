@@ -0,0 +1,286 @@
+# factor_versions.py
+"""
+Versioned emission factors and historical recalculation:
+- factor_versions keeps every factor a process code has had, each with the entry dates it applies to,
+  [effective_from, effective_to) against emissions.created_at (effective_to NULL = open-ended)
+- set_version() records a factor for a date range, trimming / splitting the versions it overlaps, and
+  moves emission_factors.factor to the version in force today (so new entries use it); capture
+  records the current emission_factors values from a date, e.g. after importing a new DEFRA table
+- versions win over factor imports: init_db.py and import_excel.py call sync_current_factors() after
+  their factor sync, and init_db.py restates the workbook rows it wrote with recalculate()
+- recalculate() restates existing rows with one set-based UPDATE ... FROM factor_versions per id
+  window: emission = activity_value * factor, where activity_value (emission / factor_used as first stored,
+  filled in on a row's first restatement) keeps repeated restatements exact; rows stored with a zero
+  factor have no recoverable activity and are left alone
+- the id windows (RECALC_CHUNK_ROWS) are committed one by one, so the app keeps writing during a long
+  restatement and progress can be reported; the affected users' rollups are rebuilt at the end and
+  the aggregate / page caches follow the data versions the emissions UPDATE triggers bump
+- start_job() runs recalculate() on a background thread with its progress in a JSON status file
+  (a jobs.JobStore in RECALC_DIR), so any worker can answer a poll; app.py exposes it as
+  POST /admin/recalc_jobs + GET /admin/recalc_jobs/<id> when ADMIN_PASSWORD is set
+
+  python factor_versions.py set DG_CONS_EM 2.7 --from 2025-04-01 --source "DEFRA 2025"
+  python factor_versions.py capture --from 2025-04-01      # after import_excel.py defra_2025.csv
+  python factor_versions.py list DG_CONS_EM
+  python factor_versions.py recalc --from 2025-04-01 --to 2026-04-01
+"""
+
+import argparse, math, os, sys, tempfile, time
+from datetime import date, datetime
+from db import IN_LIST_CHUNK
+from jobs import JobStore
+from rollups import rebuild_user_rollups
+
+DB = "emissions.db"
+RECALC_DIR = os.getenv("RECALC_DIR", os.path.join(tempfile.gettempdir(), "carbon_recalc"))
+RECALC_CHUNK_ROWS = int(os.getenv("RECALC_CHUNK_ROWS", "20000"))
+
+VERSIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS factor_versions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    process_code TEXT NOT NULL, factor REAL NOT NULL,
+    effective_from TEXT NOT NULL, effective_to TEXT,
+    source TEXT, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_factor_versions_code ON factor_versions(process_code, effective_from);
+"""
+
+END_OF_TIME = "9999-12-31"  # upper bound for open-ended ranges in comparisons
+
+# rows in an id window whose version (joined on process code and entry date) has another factor
+RESTATE_WHERE = f"""
+    emissions.id > ? AND emissions.id <= ? AND emissions.created_at >= ? AND emissions.created_at < ?
+    AND v.process_code = emissions.process_code
+    AND emissions.created_at >= v.effective_from AND emissions.created_at < COALESCE(v.effective_to, '{END_OF_TIME}')
+    AND (emissions.activity_value IS NOT NULL OR emissions.factor_used != 0)
+    AND (emissions.factor_used IS NULL OR emissions.factor_used != v.factor)
+"""
+
+RESTATE_SQL = f"""
+    UPDATE emissions SET
+        activity_value = COALESCE(emissions.activity_value, emissions.emission / emissions.factor_used),
+        emission = COALESCE(emissions.activity_value, emissions.emission / emissions.factor_used) * v.factor,
+        factor_used = v.factor
+    FROM factor_versions v
+    WHERE {RESTATE_WHERE}
+"""
+
+AFFECTED_SQL = f"SELECT DISTINCT emissions.user_uk FROM emissions, factor_versions v WHERE {RESTATE_WHERE}"
+
+# emission_factors rows whose version in force on a day has another factor
+CURRENT_FACTOR_SQL = """
+    UPDATE emission_factors SET factor = v.factor, last_updated = ?
+    FROM factor_versions v
+    WHERE v.process_code = emission_factors.process_code
+    AND v.effective_from <= ? AND (v.effective_to IS NULL OR v.effective_to > ?)
+    AND emission_factors.factor != v.factor
+"""
+
+_jobs = JobStore(RECALC_DIR, 1, "recalc")  # one recalculation at a time per process
+
+def create_version_table(conn):
+    conn.executescript(VERSIONS_SCHEMA)
+    if "activity_value" not in {r[1] for r in conn.execute("PRAGMA table_info(emissions)")}:
+        conn.execute("ALTER TABLE emissions ADD COLUMN activity_value REAL")
+
+def _day(value, name):
+    try:
+        return date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD), got '{value}'")
+
+def _overlaps(a_from, a_to, b_from, b_to):
+    return (a_to or END_OF_TIME) > b_from and a_from < (b_to or END_OF_TIME)
+
+def set_version(cur, process_code, factor, effective_from, effective_to=None, source=None, now=None):
+    """Make factor the process's factor for entries dated [effective_from, effective_to); caller commits.
+
+    Returns the (effective_from, effective_to) range whose entries need recalculate().
+    """
+    effective_from = _day(effective_from, "effective_from")
+    effective_to = _day(effective_to, "effective_to") if effective_to else None
+    if effective_to is not None and effective_to <= effective_from:
+        raise ValueError("effective_to must be after effective_from")
+    factor = float(factor)
+    if not math.isfinite(factor):
+        raise ValueError("factor must be a finite number")
+    cur.execute("SELECT 1 FROM emission_factors WHERE process_code = ?", (process_code,))
+    if not cur.fetchone():
+        raise ValueError(f"Unknown process code '{process_code}'")
+    now = now or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    cur.execute("""
+        SELECT id, factor, effective_from, effective_to, source FROM factor_versions
+        WHERE process_code = ? ORDER BY effective_from
+    """, (process_code,))
+    for vid, v_factor, v_from, v_to, v_source in cur.fetchall():
+        if not _overlaps(v_from, v_to, effective_from, effective_to):
+            continue
+        head = v_from < effective_from
+        tail = effective_to is not None and (v_to or END_OF_TIME) > effective_to
+        if head:
+            cur.execute("UPDATE factor_versions SET effective_to = ? WHERE id = ?", (effective_from, vid))
+            if tail:  # the new range sits inside this version: keep its far end as its own row
+                cur.execute("""
+                    INSERT INTO factor_versions (process_code, factor, effective_from, effective_to, source, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (process_code, v_factor, effective_to, v_to, v_source, now))
+        elif tail:
+            cur.execute("UPDATE factor_versions SET effective_from = ? WHERE id = ?", (effective_to, vid))
+        else:
+            cur.execute("DELETE FROM factor_versions WHERE id = ?", (vid,))
+    cur.execute("""
+        INSERT INTO factor_versions (process_code, factor, effective_from, effective_to, source, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (process_code, factor, effective_from, effective_to, source, now))
+    sync_current_factor(cur, process_code, now)
+    return effective_from, effective_to
+
+def sync_current_factor(cur, process_code, now=None):
+    """Point emission_factors.factor at the version in force today, if there is one."""
+    today = date.today().isoformat()
+    cur.execute(CURRENT_FACTOR_SQL + " AND emission_factors.process_code = ?",
+                (now or datetime.now().strftime("%Y-%m-%d %H:%M:%S"), today, today, process_code))
+
+def sync_current_factors(cur, now=None):
+    """sync_current_factor() for every versioned code, e.g. after a factor import overwrote them; returns the count."""
+    today = date.today().isoformat()
+    cur.execute(CURRENT_FACTOR_SQL, (now or datetime.now().strftime("%Y-%m-%d %H:%M:%S"), today, today))
+    return max(cur.rowcount, 0)
+
+def capture(cur, effective_from, codes=None, source=None):
+    """Record each emission_factors factor (or only codes') as a version from effective_from; returns the codes."""
+    cur.execute("SELECT process_code, factor FROM emission_factors ORDER BY process_code")
+    rows = [(code, factor) for code, factor in cur.fetchall() if factor is not None and (not codes or code in codes)]
+    for code, factor in rows:
+        set_version(cur, code, factor, effective_from, source=source)
+    return [code for code, _ in rows]
+
+def versions(cur, codes=None, start=None, end=None):
+    """Versions as dicts, optionally only those for codes overlapping [start, end)."""
+    cur.execute("""
+        SELECT process_code, factor, effective_from, effective_to, source, created_at FROM factor_versions
+        ORDER BY process_code, effective_from
+    """)
+    cols = ["process_code", "factor", "effective_from", "effective_to", "source", "created_at"]
+    out = [dict(zip(cols, r)) for r in cur.fetchall()]
+    return [v for v in out if (not codes or v["process_code"] in codes)
+            and _overlaps(v["effective_from"], v["effective_to"], start or "", end)]
+
+def recalculate(repo, codes=None, start=None, end=None, progress=None, chunk_rows=RECALC_CHUNK_ROWS):
+    """Restate emissions dated in [start, end) (all dates if None) from their factor versions.
+
+    One UPDATE ... FROM factor_versions per id window (and per IN_LIST_CHUNK codes when codes
+    are given); progress(fraction, rows_restated) is called after every committed window.
+    """
+    start = _day(start, "start") if start else ""
+    end = _day(end, "end") if end else END_OF_TIME
+    cur = repo.cursor()
+    n_versions = len(versions(cur, codes, start, end))
+    codes = sorted(set(codes or []))
+    filters = [codes[i:i + IN_LIST_CHUNK] for i in range(0, len(codes), IN_LIST_CHUNK)] or [None]
+    cur.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM emissions")
+    first_id, last_id = cur.fetchone()
+    t0 = time.perf_counter()
+    restated, users = 0, set()
+    if n_versions:
+        for window in range(first_id - 1, last_id, chunk_rows):
+            for batch in filters:
+                params = (window, window + chunk_rows, start, end) + tuple(batch or ())
+                where = f" AND v.process_code IN ({', '.join('?' * len(batch))})" if batch else ""
+                cur.execute(AFFECTED_SQL + where, params)
+                users.update(r[0] for r in cur.fetchall())
+                cur.execute(RESTATE_SQL + where, params)
+                restated += max(cur.rowcount, 0)
+            repo.commit()  # one window per transaction: other writers get the lock in between
+            if progress:
+                progress(min((window + chunk_rows - first_id + 1) / (last_id - first_id + 1), 1.0), restated)
+    for user_uk in sorted(u for u in users if u is not None):
+        rebuild_user_rollups(cur, user_uk)
+    repo.commit()
+    return {"versions": n_versions, "rows": restated, "users": len(users),
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+# --- background jobs ---
+def get_job(job_id):
+    """Job status dict, or None if unknown."""
+    return _jobs.get(job_id)
+
+def _run_job(database, status, codes, start, end):
+    from repository import open_repository
+    status.update(status="running"); _jobs.write(status)
+    repo = open_repository(database)
+
+    def progress(fraction, rows):
+        status.update(progress=round(fraction, 4), rows=rows); _jobs.write(status)
+    try:
+        outcome = dict(status="done", progress=1.0, **recalculate(repo, codes, start, end, progress))
+    except Exception as e:
+        repo.rollback()
+        outcome = dict(status="failed", error=str(e))
+    finally:
+        repo.close()
+    _jobs.finish(status, **outcome)
+
+def start_job(database, codes=None, start=None, end=None):
+    """Queue a recalculation (one runs at a time) and return its initial status; raises ValueError on a bad date."""
+    start = _day(start, "start") if start else None
+    end = _day(end, "end") if end else None
+    status = _jobs.create(progress=0.0, rows=0, codes=list(codes or []), start=start, end=end)
+    _jobs.submit(_run_job, database, dict(status), codes, start, end)
+    return status
+
+# --- CLI ---
+def _print_progress(fraction, rows):
+    print(f"\r⚙️ {fraction * 100:5.1f}%  {rows} rows restated", end="", flush=True)
+
+def _recalc(repo, codes, start, end):
+    result = recalculate(repo, codes, start, end, _print_progress)
+    print(f"\n✅ {result['rows']} rows restated for {result['users']} user(s) from {result['versions']} "
+          f"version(s) in {result['seconds']}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DB, help="SQLite file or postgresql:// URL")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("set", help="record a factor for a date range and restate it")
+    p.add_argument("process_code"); p.add_argument("factor", type=float)
+    p.add_argument("--from", dest="start", required=True); p.add_argument("--to", dest="end")
+    p.add_argument("--source"); p.add_argument("--no-recalc", action="store_true")
+    p = sub.add_parser("capture", help="record the current emission_factors values from a date and restate")
+    p.add_argument("--from", dest="start", required=True); p.add_argument("--code", action="append")
+    p.add_argument("--source"); p.add_argument("--no-recalc", action="store_true")
+    p = sub.add_parser("list", help="show factor versions")
+    p.add_argument("codes", nargs="*")
+    p = sub.add_parser("recalc", help="restate emissions from the recorded versions")
+    p.add_argument("--code", action="append"); p.add_argument("--from", dest="start"); p.add_argument("--to", dest="end")
+    args = parser.parse_args()
+
+    from repository import open_repository
+    repo = open_repository(args.db)
+    try:
+        cur = repo.cursor()
+        if args.command == "list":
+            for v in versions(cur, args.codes):
+                print(f"{v['process_code']:<22}{v['factor']:>14g}  {v['effective_from']} .. {v['effective_to'] or '':<10}  "
+                      f"{v['source'] or ''}")
+        elif args.command == "recalc":
+            _recalc(repo, args.code, args.start, args.end)
+        else:
+            try:
+                if args.command == "set":
+                    start, end = set_version(cur, args.process_code.upper(), args.factor, args.start, args.end, args.source)
+                    codes = [args.process_code.upper()]
+                else:
+                    start, end = _day(args.start, "--from"), None
+                    codes = capture(cur, start, [c.upper() for c in args.code or []], args.source)
+            except ValueError as e:
+                repo.rollback()
+                print(f"❌ {e}")
+                sys.exit(1)
+            repo.commit()
+            print(f"✅ {len(codes)} factor version(s) recorded from {start}")
+            if not args.no_recalc:
+                _recalc(repo, codes, start, end)
+    finally:
+        repo.close()
@@ -0,0 +1,185 @@
+# formula_engine.py
+"""
+Small, sandboxed expression engine for the per-sheet calc formulas:
+- a formula is parsed once with ast and checked against a whitelist:
+  numbers, + - * /, unary -/+, row.get('key', default) and `or`
+- compile_formula() turns it into a Formula: call it with a row dict, or use
+  evaluate_columns() to run the same expression over NumPy columns for a whole sheet
+- formulas stored in the calc_formulas table override the built-in ones, so calc rules
+  can change without a deploy (`python formula_engine.py set CODE "expr"`)
+"""
+
+import ast, operator, sqlite3, sys
+from datetime import datetime
+import numpy as np
+
+DB = "emissions.db"
+
+FORMULA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calc_formulas (
+    process_code TEXT PRIMARY KEY, expression TEXT NOT NULL, updated_at TEXT
+);
+"""
+
+_BIN_OPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+_UNARY_OPS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+class FormulaError(ValueError):
+    """Raised when a formula uses anything outside the whitelist."""
+
+def _number(node):
+    """A numeric literal, optionally signed; None if node is something else."""
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        v = _number(node.operand)
+        return None if v is None else _UNARY_OPS[type(node.op)](v)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    return None
+
+def _compile(node, src):
+    """Return (row_fn, col_fn) for a whitelisted node.
+
+    row_fn(row) behaves exactly like Python's eval of the node. col_fn(cols, n) returns
+    (values, err) where err marks rows on which row_fn would have raised.
+    """
+    num = _number(node)
+    if num is not None:
+        return (lambda row: num), (lambda cols, n: (float(num), False))
+
+    if isinstance(node, ast.Call):
+        f = node.func
+        if not (isinstance(f, ast.Attribute) and f.attr == "get" and isinstance(f.value, ast.Name)
+                and f.value.id == "row" and not node.keywords and len(node.args) == 2
+                and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            raise FormulaError(f"only row.get('key', default) calls are allowed: {src!r}")
+        key = node.args[0].value
+        default = _number(node.args[1])
+        if default is None:
+            raise FormulaError(f"row.get default must be a number: {src!r}")
+        return (lambda row: row.get(key, default)), (lambda cols, n: (cols[key] if key in cols else float(default), False))
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op = _BIN_OPS[type(node.op)]
+        lrow, lcol = _compile(node.left, src)
+        rrow, rcol = _compile(node.right, src)
+        is_div = isinstance(node.op, ast.Div)
+        def col_fn(cols, n):
+            a, ea = lcol(cols, n); b, eb = rcol(cols, n)
+            with np.errstate(all="ignore"):
+                out = op(np.asarray(a, dtype="float64"), np.asarray(b, dtype="float64"))
+            err = ea | eb
+            if is_div:
+                err = err | (np.asarray(b) == 0)  # Python raises ZeroDivisionError here
+            return out, err
+        return (lambda row: op(lrow(row), rrow(row))), col_fn
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        op = _UNARY_OPS[type(node.op)]
+        orow, ocol = _compile(node.operand, src)
+        def col_fn(cols, n):
+            a, ea = ocol(cols, n)
+            return op(np.asarray(a, dtype="float64")), ea
+        return (lambda row: op(orow(row))), col_fn
+
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or):
+        parts = [_compile(v, src) for v in node.values]
+        def row_fn(row):
+            for prow, _ in parts[:-1]:
+                v = prow(row)
+                if v:
+                    return v
+            return parts[-1][0](row)
+        def col_fn(cols, n):
+            # evaluate right to left: result = a if a is truthy else (rest)
+            out, err = parts[-1][1](cols, n)
+            for _, pcol in reversed(parts[:-1]):
+                a, ea = pcol(cols, n)
+                truthy = np.asarray(a) != 0  # NaN is truthy, as in Python
+                out = np.where(truthy, a, out)
+                err = np.where(truthy, ea, ea | err)
+            return out, err
+        return row_fn, col_fn
+
+    raise FormulaError(f"unsupported expression {type(node).__name__} in {src!r}")
+
+class Formula:
+    """A validated, pre-compiled calc formula."""
+    __slots__ = ("source", "_row_fn", "_col_fn")
+
+    def __init__(self, source):
+        try:
+            tree = ast.parse(source.strip(), mode="eval")
+        except SyntaxError as e:
+            raise FormulaError(f"invalid formula {source!r}: {e.msg}")
+        self.source = source
+        self._row_fn, self._col_fn = _compile(tree.body, source)
+
+    def __call__(self, row):
+        """Evaluate for one row dict; like the old safe_eval_formula, errors give 0.0."""
+        try:
+            return float(self._row_fn(row))
+        except Exception:
+            return 0.0
+
+    def evaluate_columns(self, columns, n):
+        """Evaluate over a dict of equal-length float arrays; rows that would raise give 0.0."""
+        out, err = self._col_fn(columns, n)
+        out = np.broadcast_to(np.asarray(out, dtype="float64"), (n,)).copy()
+        out[np.broadcast_to(err, (n,))] = 0.0
+        return out
+
+    def __repr__(self):
+        return f"Formula({self.source!r})"
+
+def compile_formula(source):
+    return Formula(source)
+
+# --- Stored formulas ---
+def create_formula_table(conn):
+    conn.executescript(FORMULA_SCHEMA)
+
+def load_formulas(conn, defaults):
+    """Built-in formulas compiled once, overridden by valid rows in calc_formulas."""
+    formulas = {code: compile_formula(src) for code, src in defaults.items()}
+    try:
+        rows = conn.execute("SELECT process_code, expression FROM calc_formulas").fetchall()
+    except sqlite3.OperationalError:
+        return formulas  # table not migrated yet
+    for code, src in rows:
+        try:
+            formulas[code] = compile_formula(src)
+        except FormulaError as e:
+            print(f"⚠️ Ignoring stored formula for {code}: {e}")
+    return formulas
+
+def set_formula(conn, process_code, expression):
+    """Validate and store a formula override (caller commits)."""
+    compile_formula(expression)
+    conn.execute("""
+        INSERT INTO calc_formulas (process_code, expression, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(process_code) DO UPDATE SET expression=excluded.expression, updated_at=excluded.updated_at
+    """, (process_code, expression, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def delete_formula(conn, process_code):
+    conn.execute("DELETE FROM calc_formulas WHERE process_code = ?", (process_code,))
+
+if __name__ == "__main__":
+    usage = "usage: python formula_engine.py list | set CODE EXPRESSION | delete CODE"
+    args = sys.argv[1:]
+    conn = sqlite3.connect(DB)
+    create_formula_table(conn)
+    if args[:1] == ["list"]:
+        for code, src, ts in conn.execute("SELECT process_code, expression, updated_at FROM calc_formulas ORDER BY process_code"):
+            print(f"{code}: {src}  ({ts})")
+    elif args[:1] == ["set"] and len(args) == 3:
+        try:
+            set_formula(conn, args[1], args[2]); conn.commit()
+            print(f"✅ formula for {args[1]} saved")
+        except FormulaError as e:
+            print(f"❌ {e}")
+    elif args[:1] == ["delete"] and len(args) == 2:
+        delete_formula(conn, args[1]); conn.commit()
+        print(f"✅ formula override for {args[1]} removed")
+    else:
+        print(usage)
+    conn.close()
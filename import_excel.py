@@ -1,51 +1,228 @@
-import sqlite3
-import pandas as pd
-
-# Connect to SQLite database
-conn = sqlite3.connect("emissions.db")
-cur = conn.cursor()
-
-# Create table if not exists
-cur.execute("""
-CREATE TABLE IF NOT EXISTS emission_factors (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    process TEXT,
-    fuel_type TEXT,
-    activity_data REAL,
-    emission_factor REAL,
-    co2_emission REAL,
-    ch4_emission REAL,
-    n2o_emission REAL,
-    total_emission REAL
-)
-""")
-conn.commit()
-
-# Read Excel file
-excel_file = "Master Calculation.xlsx"
-df = pd.read_excel(excel_file)
-
-# Clear previous data
-cur.execute("DELETE FROM emission_factors")
-
-# Insert rows
-for _, row in df.iterrows():
-    cur.execute("""
-        INSERT INTO emission_factors (
-            process, fuel_type, activity_data, emission_factor,
-            co2_emission, ch4_emission, n2o_emission, total_emission
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        row.get("Process"),
-        row.get("Fuel Type"),
-        row.get("Activity Data"),
-        row.get("Emission Factor"),
-        row.get("CO2 Emission"),
-        row.get("CH4 Emission"),
-        row.get("N2O Emission"),
-        row.get("Total Emission")
-    ))
-
-conn.commit()
-conn.close()
-print("✅ Excel data imported successfully into emissions.db!")
+# import_excel.py
+"""
+Bulk loader for emission factor tables into emission_factors:
+- reads the workbook's Emission_factor sheet (the default) or any factor library, e.g. a full IPCC
+  or DEFRA export, from .xlsx (streamed with workbook.py, --sheet picks the sheet) or .csv
+- maps the table's columns onto the current schema (process_code, process_desc, scope, unit,
+  factor, calc_type) by name, see COLUMN_NAMES; --map "Column=field" overrides a guess
+- validates whole columns at once (missing codes, factors that are not finite numbers, unknown
+  scopes, duplicate codes with conflicting values) and reports every bad row in one pass; nothing
+  is written unless all rows pass, or --skip-bad loads the rest
+- applies the good rows through the import ledger (import_ledger.sync_factors) in chunked executemany
+  batches inside one transaction: new codes inserted, changed ones updated, unchanged ones left alone,
+  codes that dropped out of the same source retired
+- the workbook's own sheet keeps init_db's IPCC fallbacks and shares its ledger entries
+- codes with factor versions (factor_versions.py) keep the factor in force today
+
+  python import_excel.py
+  python import_excel.py defra_2024.csv --source defra_2024 --map "GHG Conversion Factor 2024=factor"
+"""
+
+import argparse, csv, os, re, sqlite3, sys, time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from migrations import apply_migrations
+from init_db import EXCEL, IPCC_FACTORS_BY_CODE, default_scope
+from import_ledger import FACTOR_SHEET, IMPORT_CHUNK_ROWS, sync_factors
+from factor_versions import sync_current_factors
+from workbook import iter_chunks, open_workbook
+
+DB = "emissions.db"
+FIELDS = ["process_code", "process_desc", "scope", "unit", "factor", "calc_type"]
+REQUIRED = ["process_code", "factor"]
+# (field, exact column names, name fragments) -- exact names win over fragments across all fields
+COLUMN_NAMES = [
+    ("process_code", ("process_code", "code", "id", "ef_id", "factor_id"), ("process",)),
+    ("factor", ("factor", "ef", "value", "emission_factor", "co2e_factor"), ("factor",)),
+    ("unit", ("unit", "units", "uom"), ("unit",)),
+    ("process_desc", ("process_desc", "description", "desc", "name"), ("desc",)),
+    ("scope", ("scope",), ("scope",)),
+    ("calc_type", ("calc_type",), ("calc",)),
+]
+SCOPE_RE = r"(?i)^\s*scope[\s_-]*([123])\s*$"
+MAX_REPORTED = 50  # bad rows printed; --report writes all of them
+
+def normalize(name):
+    return re.sub(r"[^0-9a-z]+", "_", str(name).strip().lower()).strip("_")
+
+def map_columns(columns, overrides=None):
+    """{field: source column} for the table's columns; overrides is {column: field}."""
+    mapping = {field: col for col, field in (overrides or {}).items()}
+    names = {col: normalize(col) for col in columns if col not in mapping.values()}
+    for exact in (True, False):
+        for field, exact_names, fragments in COLUMN_NAMES:
+            if field in mapping:
+                continue
+            for col, name in names.items():
+                if col in mapping.values():
+                    continue
+                if (name in exact_names) if exact else any(f in name for f in fragments):
+                    mapping[field] = col
+                    break
+    return mapping
+
+def read_table(path, sheet=None):
+    """The factor table as one DataFrame of raw cells, index = spreadsheet row number."""
+    if path.lower().endswith(".csv"):
+        df = pd.read_csv(path, dtype=object, keep_default_na=False, na_values=[""], skipinitialspace=True)
+    else:
+        book = open_workbook(path)
+        try:
+            sheet = sheet or ("Emission_factor" if "Emission_factor" in book.sheetnames else book.sheetnames[0])
+            frames = list(iter_chunks(book, sheet))
+        finally:
+            book.close()
+        df = pd.concat(frames) if frames else pd.DataFrame()
+    df.index = df.index + 2  # header is row 1
+    return df
+
+def _text(col):
+    """Stripped strings, NaN for empty cells."""
+    s = col.astype(object)
+    s = s.where(s.isna(), s.astype(str).str.strip())
+    return s.mask(s == "")
+
+def validate(df, mapping, fallbacks=None):
+    """(clean frame of FIELDS, bad rows as [(row, column, value, reason)]), checked column by column."""
+    fallbacks = fallbacks or {}
+    blank = pd.Series(np.nan, index=df.index, dtype=object)
+    clean = pd.DataFrame({field: _text(df[mapping[field]]) if field in mapping else blank for field in FIELDS})
+    errors = []
+
+    def flag(mask, field, reason):
+        col = mapping[field]
+        errors.extend((row, col, "" if pd.isna(value) else value, reason) for row, value in df.loc[mask, col].items())
+
+    codes = clean["process_code"] = clean["process_code"].str.upper()
+    no_code = codes.isna()
+    flag(no_code, "process_code", "missing process_code")
+
+    raw = df[mapping["factor"]]
+    if pd.api.types.is_numeric_dtype(raw):
+        empty, numeric = raw.isna(), raw.astype("float64")
+    else:
+        text = _text(raw)
+        empty, numeric = text.isna(), pd.to_numeric(text.str.replace(",", "", regex=False), errors="coerce")
+    not_number = ~empty & ~np.isfinite(numeric)
+    flag(not_number, "factor", "factor is not a finite number")
+    no_factor = ~no_code & empty & ~codes.isin(list(fallbacks))
+    flag(no_factor, "factor", "missing factor (and no fallback for this code)")
+    clean["factor"] = numeric.where(~not_number)
+
+    matched = clean["scope"].str.extract(SCOPE_RE, expand=False)
+    bad_scope = clean["scope"].notna() & matched.isna()
+    if bad_scope.any():
+        flag(bad_scope, "scope", "scope is not Scope 1, 2 or 3")
+    clean["scope"] = ("Scope_" + matched).where(matched.notna())
+
+    clean = clean[~(no_code | not_number | no_factor | bad_scope)]
+    # a code listed twice: exact repeats are dropped, conflicting values are errors
+    repeat = clean["process_code"].duplicated(keep="first")
+    if repeat.any():
+        signature = pd.util.hash_pandas_object(clean[FIELDS], index=False)
+        first = signature.groupby(clean["process_code"]).transform("first")
+        first_row = pd.Series(clean.index, index=clean.index).groupby(clean["process_code"]).transform("first")
+        conflict = repeat & (signature != first)
+        errors.extend((row, mapping["process_code"], code, f"duplicate process_code, conflicts with row {first_row[row]}")
+                      for row, code in clean.loc[conflict, "process_code"].items())
+        clean = clean[~repeat]
+    errors.sort(key=lambda e: e[0])
+    return clean, errors
+
+def to_rows(clean, fallbacks):
+    """Rows for sync_factors with init_db.factor_rows' defaults (fallback factors, description, scope), by code."""
+    extra = sorted(set(fallbacks) - set(clean["process_code"]))
+    if extra:  # fallback-only codes, as init_db inserts them
+        clean = pd.concat([clean, pd.DataFrame({"process_code": extra}, dtype=object)], ignore_index=True)
+    clean = clean.sort_values("process_code", kind="stable")
+    codes = clean["process_code"]
+    factor = clean["factor"].astype("float64")
+    factor = factor.where(factor.fillna(0.0) != 0, codes.map(fallbacks).astype("float64")).fillna(0.0)
+    keep = (factor != 0).to_numpy()
+    desc = clean["process_desc"].fillna("Emission from " + codes)
+    scope = clean["scope"].fillna(codes.map(default_scope))
+    columns = [codes, desc, scope, clean["unit"].fillna(""), factor, clean["calc_type"].fillna("single")]
+    return list(zip(*(c.to_numpy()[keep].tolist() for c in columns)))
+
+def write_report(path, errors):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["row", "column", "value", "reason"])
+        writer.writerows(errors)
+
+def parse_overrides(items):
+    overrides = {}
+    for item in items or []:
+        col, _, field = item.rpartition("=")
+        if field not in FIELDS or not col:
+            raise SystemExit(f"❌ --map expects 'Column=field' with field one of {', '.join(FIELDS)}: {item}")
+        overrides[col] = field
+    return overrides
+
+def run(args):
+    t0 = time.perf_counter()
+    default_source = os.path.abspath(args.path) == os.path.abspath(EXCEL) and args.sheet in (None, "Emission_factor")
+    source = args.source or (FACTOR_SHEET if default_source else os.path.splitext(os.path.basename(args.path))[0])
+    fallbacks = IPCC_FACTORS_BY_CODE if source == FACTOR_SHEET else {}
+
+    df = read_table(args.path, args.sheet)
+    overrides = parse_overrides(args.map)
+    unknown = [col for col in overrides if col not in df.columns]
+    if unknown:
+        print(f"❌ --map names columns that are not in the table: {', '.join(unknown)}")
+        return 1
+    mapping = map_columns(list(df.columns), overrides)
+    missing = [f for f in REQUIRED if f not in mapping]
+    if missing:
+        print(f"❌ No column for {', '.join(missing)} in {list(df.columns)}; name it with --map 'Column=field'.")
+        return 1
+    print("⚙️ Columns: " + ", ".join(f"{field} <- {col}" for field, col in mapping.items()))
+
+    clean, errors = validate(df, mapping, fallbacks)
+    if errors:
+        print(f"⚠️ {len(errors)} bad row(s) out of {len(df)}:")
+        for row, col, value, reason in errors[:MAX_REPORTED]:
+            print(f"   row {row}, {col}={value!r}: {reason}")
+        if len(errors) > MAX_REPORTED:
+            print(f"   ... and {len(errors) - MAX_REPORTED} more" + ("" if args.report else " (see --report)"))
+        if args.report:
+            write_report(args.report, errors)
+            print(f"⚠️ bad rows written to {args.report}")
+        if not args.skip_bad:
+            print("❌ Nothing imported; fix the rows above or pass --skip-bad.")
+            return 1
+
+    conn = sqlite3.connect(args.db)
+    try:
+        apply_migrations(conn)
+        cur = conn.cursor()
+        if not cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='emission_factors'").fetchone():
+            print(f"❌ {args.db} is not initialised; run `python init_db.py` first.")
+            return 1
+        cur.execute("BEGIN IMMEDIATE")  # the ledger / existing codes are read under the write lock
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        counts = sync_factors(cur, to_rows(clean, fallbacks), now, source, args.chunk_rows)
+        counts["versioned"] = sync_current_factors(cur, now)
+        conn.commit()  # one transaction for the whole table
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"✅ Emission factors from {source} imported into {args.db} in {time.perf_counter() - t0:.1f}s: "
+          f"{counts['inserted']} new, {counts['updated']} updated, {counts['unchanged']} unchanged, {counts['retired']} retired"
+          + (f", {counts['versioned']} kept at their factor version" if counts["versioned"] else ""))
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=EXCEL, help=".xlsx or .csv factor table")
+    parser.add_argument("--sheet", help="worksheet to read (default Emission_factor, else the first one)")
+    parser.add_argument("--source", help="name of this table in the import ledger (default: the file name)")
+    parser.add_argument("--map", action="append", metavar="COLUMN=FIELD", help="map a column to a schema field")
+    parser.add_argument("--skip-bad", action="store_true", help="import the valid rows even if some are bad")
+    parser.add_argument("--report", help="write every bad row to this CSV")
+    parser.add_argument("--chunk-rows", type=int, default=IMPORT_CHUNK_ROWS, help="rows per executemany batch")
+    parser.add_argument("--db", default=DB)
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,220 @@
+# import_ledger.py
+"""
+Import ledger for workbook data, so a re-import only touches what changed:
+- import_ledger has one row per imported workbook row: (sheet, row_key, row_hash, emission_id)
+  row_key hashes the row's source cells (plus its occurrence number among identical rows), row_hash
+  hashes what was computed from it (code, description, scope, unit, factor, emission)
+- import_sheets keeps per sheet the hash of its stored XML, the process codes its rows use and the hash
+  of that sheet's formula plus those codes' factor rows, so a sheet is skipped without being parsed
+  unless its own content, its formula or a factor it uses moved
+- on import a row whose key is new is inserted, a known row whose computed values moved (new factor
+  or formula) is updated in place, dropping the activity_value of any earlier restatement, and ledger
+  rows no longer in the workbook are retired: their emissions row is deleted and the ledger row keeps retired_at
+- factor rows go through the same ledger keyed by process_code, under the sheet name 'Emission_factor'
+  for the workbook and under their own source name for factor libraries loaded by import_excel.py
+- only workbook rows are ever touched; users and calculator entries are left alone
+"""
+
+import hashlib, json, os
+from collections import Counter
+from emission_inputs import insert_emissions
+from rollups import add_emissions, rebuild_user_rollups
+
+FACTOR_SHEET = "Emission_factor"
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_sheets (
+    sheet TEXT PRIMARY KEY, sheet_hash TEXT, calc_hash TEXT, row_count INTEGER, imported_at TEXT, codes TEXT
+);
+CREATE TABLE IF NOT EXISTS import_ledger (
+    sheet TEXT NOT NULL, row_key TEXT NOT NULL, row_hash TEXT NOT NULL,
+    emission_id INTEGER, imported_at TEXT, retired_at TEXT,
+    PRIMARY KEY (sheet, row_key)
+);
+CREATE INDEX IF NOT EXISTS idx_import_ledger_emission ON import_ledger(emission_id);
+"""
+
+UPSERT_LEDGER_SQL = """
+    INSERT INTO import_ledger (sheet, row_key, row_hash, emission_id, imported_at, retired_at)
+    VALUES (?, ?, ?, ?, ?, NULL)
+    ON CONFLICT(sheet, row_key) DO UPDATE SET
+        row_hash=excluded.row_hash, emission_id=excluded.emission_id,
+        imported_at=excluded.imported_at, retired_at=NULL
+"""
+
+def create_ledger_tables(conn):
+    conn.executescript(LEDGER_SCHEMA)
+    if "codes" not in {r[1] for r in conn.execute("PRAGMA table_info(import_sheets)")}:
+        conn.execute("ALTER TABLE import_sheets ADD COLUMN codes TEXT")
+
+def _hash(*parts):
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str).encode()).hexdigest()
+
+def calc_hash(factors, formula_source, codes):
+    """Hash of what turns one sheet's cells into emissions: its formula's source and the factor rows
+    (factor, scope, unit; null where missing) of the process codes it uses."""
+    return _hash(formula_source, factors.reindex(sorted(codes)).to_json(orient="split"))
+
+class SheetImport:
+    """Delta import of one sheet's computed rows (init_db.compute_sheet tuples) into emissions."""
+
+    def __init__(self, cur, sheet, now):
+        self.cur, self.sheet, self.now = cur, sheet, now
+        cur.execute("SELECT row_key, row_hash, emission_id, retired_at FROM import_ledger WHERE sheet = ?", (sheet,))
+        self.ledger = {r[0]: (r[1], r[2], r[3]) for r in cur.fetchall()}
+        self.occurrences = Counter()
+        self.seen = set()
+        self.codes = set()  # every process code in the sheet, skipped (factor-less) rows included
+        self.counts = {"inserted": 0, "updated": 0, "unchanged": 0, "retired": 0}
+
+    def add(self, rows, skipped=()):
+        """Classify one chunk of rows and apply it; skipped are the chunk's rows left out for lack of a factor."""
+        self.codes.update(s["process_code"] for s in skipped)
+        new, changed = [], []
+        for row in rows:
+            self.codes.add(row[1])
+            source = _hash(row[1], row[5])  # process code + every source cell (input_details)
+            self.occurrences[source] += 1
+            key = f"{source}#{self.occurrences[source]}"
+            self.seen.add(key)
+            row_hash = _hash(row[1], row[2], row[3], row[4], row[6], row[7])
+            entry = self.ledger.get(key)
+            if entry is None or entry[2] is not None or entry[1] is None:
+                new.append((key, row_hash, row))
+            elif entry[0] != row_hash:
+                changed.append((key, row_hash, row, entry[1]))
+            else:
+                self.counts["unchanged"] += 1
+        if new:
+            self._insert(new)
+        if changed:
+            self._update(changed)
+
+    def _insert(self, new):
+        cur = self.cur
+        rows = [row for _, _, row in new]
+        ids = insert_emissions(cur, [r + (self.now,) for r in rows])
+        add_emissions(cur, [(r[0], r[1], r[2], r[3], r[7]) for r in rows])
+        cur.executemany(UPSERT_LEDGER_SQL, [(self.sheet, key, row_hash, emission_id, self.now)
+                                            for (key, row_hash, _), emission_id in zip(new, ids)])
+        self.counts["inserted"] += len(rows)
+
+    def _update(self, changed):
+        cur = self.cur
+        cur.executemany("""
+            UPDATE emissions SET process_code = ?, process_desc = ?, scope = ?, unit = ?, factor_used = ?, emission = ?,
+                activity_value = NULL
+            WHERE id = ?
+        """, [(r[1], r[2], r[3], r[4], r[6], r[7], emission_id) for _, _, r, emission_id in changed])
+        cur.executemany(UPSERT_LEDGER_SQL, [(self.sheet, key, row_hash, emission_id, self.now)
+                                            for key, row_hash, _, emission_id in changed])
+        self.counts["updated"] += len(changed)
+
+    def finish(self, sheet_hash=None, factors=None, formula_source=None):
+        """Retire rows that were not seen and record the sheet's hashes; returns the counts."""
+        gone = [(key, entry[1]) for key, entry in self.ledger.items() if entry[2] is None and key not in self.seen]
+        if gone:
+            self.cur.executemany("DELETE FROM emissions WHERE id = ?", [(emission_id,) for _, emission_id in gone])
+            self.cur.executemany("UPDATE import_ledger SET retired_at = ? WHERE sheet = ? AND row_key = ?",
+                                 [(self.now, self.sheet, key) for key, _ in gone])
+            self.counts["retired"] += len(gone)
+        calc = calc_hash(factors, formula_source, self.codes) if factors is not None else None
+        self.cur.execute("""
+            INSERT INTO import_sheets (sheet, sheet_hash, calc_hash, row_count, imported_at, codes) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(sheet) DO UPDATE SET sheet_hash=excluded.sheet_hash, calc_hash=excluded.calc_hash,
+                row_count=excluded.row_count, imported_at=excluded.imported_at, codes=excluded.codes
+        """, (self.sheet, sheet_hash, calc, len(self.seen), self.now, json.dumps(sorted(self.codes))))
+        return self.counts
+
+def unchanged_sheet(cur, sheet, sheet_hash, factors, formula_source):
+    """True if the sheet was imported from exactly this content, and its formula and the factors of
+    the codes it used then are unchanged."""
+    if sheet_hash is None:
+        return False
+    cur.execute("SELECT sheet_hash, calc_hash, codes FROM import_sheets WHERE sheet = ?", (sheet,))
+    row = cur.fetchone()
+    if row is None or row[0] != sheet_hash or row[2] is None:
+        return False
+    return row[1] == calc_hash(factors, formula_source, json.loads(row[2]))
+
+def retire_missing_sheets(cur, sheets, now):
+    """Retire every live row of ledgered sheets that are no longer in the workbook; returns the count."""
+    cur.execute("SELECT sheet FROM import_sheets WHERE sheet != ?", (FACTOR_SHEET,))
+    missing = [r[0] for r in cur.fetchall() if r[0] not in sheets]
+    n = 0
+    for sheet in missing:
+        n += SheetImport(cur, sheet, now).finish()["retired"]
+        cur.execute("DELETE FROM import_sheets WHERE sheet = ?", (sheet,))
+    return n
+
+def adopt_unledgered(cur, user_uk):
+    """First ledgered import into a DB built before the ledger: drop its untracked workbook rows.
+
+    Only workbook sheets count as an earlier import: factor rows are ledgered (emission_id NULL) by
+    the factor sync that runs first, and by import_excel.py, before any sheet is.
+    """
+    cur.execute("""
+        SELECT 1 FROM import_sheets
+        UNION ALL SELECT 1 FROM import_ledger WHERE emission_id IS NOT NULL
+        LIMIT 1
+    """)
+    if cur.fetchone():
+        return 0
+    cur.execute("DELETE FROM emissions WHERE user_uk = ?", (user_uk,))
+    return cur.rowcount
+
+def refresh_rollups(cur, user_uk, counts):
+    """Inserts fold into the rollups as they go; updates and retirements need the user's rows rebuilt."""
+    if counts.get("updated") or counts.get("retired"):
+        rebuild_user_rollups(cur, user_uk)
+
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+def sync_factors(cur, rows, now, source=FACTOR_SHEET, chunk_rows=IMPORT_CHUNK_ROWS):
+    """Delta import of (process_code, process_desc, scope, unit, factor, calc_type) rows into emission_factors.
+
+    source names the factor table in the ledger: codes it imported before and no longer lists are
+    retired, unless another source still provides them.
+    """
+    cur.execute("SELECT row_key, row_hash, retired_at FROM import_ledger WHERE sheet = ?", (source,))
+    ledger = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+    cur.execute("SELECT process_code FROM emission_factors")
+    existing = {r[0] for r in cur.fetchall()}
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "retired": 0}
+    upserts, ledger_rows, seen = [], [], set()
+    for code, desc, scope, unit, factor, calc_type in rows:
+        seen.add(code)
+        row_hash = hashlib.sha1(repr((desc, scope, unit, float(factor), calc_type)).encode()).hexdigest()
+        entry = ledger.get(code)
+        if code in existing and entry is not None and entry[0] == row_hash and entry[1] is None:
+            counts["unchanged"] += 1
+            continue
+        counts["updated" if code in existing else "inserted"] += 1
+        upserts.append((code, desc, scope, unit, factor, calc_type, now))
+        ledger_rows.append((source, code, row_hash, None, now))
+    for batch in _chunks(upserts, chunk_rows):
+        cur.executemany("""
+            INSERT INTO emission_factors (process_code, process_desc, scope, unit, factor, calc_type, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(process_code) DO UPDATE SET
+                process_desc=excluded.process_desc, scope=excluded.scope, unit=excluded.unit, factor=excluded.factor,
+                calc_type=excluded.calc_type, last_updated=excluded.last_updated
+        """, batch)
+    for batch in _chunks(ledger_rows, chunk_rows):
+        cur.executemany(UPSERT_LEDGER_SQL, batch)
+    gone = [code for code, (_, retired_at) in ledger.items() if retired_at is None and code not in seen]
+    if gone:
+        # only codes this source imported; factors added by hand are never retired
+        cur.execute("SELECT DISTINCT row_key FROM import_ledger WHERE sheet != ? AND emission_id IS NULL AND retired_at IS NULL",
+                    (source,))
+        elsewhere = {r[0] for r in cur.fetchall()}
+        for batch in _chunks([c for c in gone if c not in elsewhere], chunk_rows):
+            cur.executemany("DELETE FROM emission_factors WHERE process_code = ?", [(c,) for c in batch])
+        for batch in _chunks(gone, chunk_rows):
+            cur.executemany("UPDATE import_ledger SET retired_at = ? WHERE sheet = ? AND row_key = ?",
+                            [(now, source, c) for c in batch])
+        counts["retired"] = len(gone)
+    return counts
@@ -1,20 +1,45 @@
 # init_db.py
 """
 Final robust initializer (fixed datetime serialization):
-- reads Master Calculation.xlsx
+- reads Master Calculation.xlsx once, streaming each sheet in chunks (workbook.py), so memory
+  follows WORKBOOK_CHUNK_ROWS rather than the workbook size
+- with --workers N (or INIT_DB_WORKERS) sheets are parsed and computed in a process pool while this
+  process stays the only writer, inserting the results in sheet order; workers hand over one chunk at
+  a time and wait once PARALLEL_QUEUE_CHUNKS are queued, so memory stays bounded per chunk there too
 - loads emission factors from 'Emission_factor' sheet (parses numeric EF)
 - falls back to IPCC_FACTORS_BY_CODE when EF missing
-- uses FORMULAS dict for derived totals per-sheet
+- uses calc_engine's per-sheet FORMULAS (overridable via the calc_formulas table) for derived totals
+- keeps emission_rollups in step with the inserted emissions
+- factor versions (factor_versions.py) win over the workbook: versioned codes keep the factor in force
+  today, and the workbook rows are restated from their versions after every import
+- records every imported row in the import ledger (import_ledger.py); with --incremental the DB is
+  updated in place instead of rebuilt: unchanged sheets are skipped, new rows inserted, rows whose
+  factor / formula moved updated, rows gone from the workbook retired, and users' own entries kept
 - safely serializes datetime and timestamp values in JSON
 """
 
-import sqlite3, os, re, json
+import argparse, sqlite3, os, json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from queue import Empty
 import pandas as pd
 import numpy as np
 from datetime import datetime, date
+from migrations import apply_migrations
+from formula_engine import compile_formula, set_formula
+from workbook import iter_chunks, open_workbook, sheet_digest
+import import_ledger
+import factor_versions
+import calc_engine
+from calc_engine import NUMBER_RE
 
 DB = "emissions.db"
 EXCEL = "Master Calculation.xlsx"
+SKIP_SHEETS = ["Emission_factor", "Description", "Processess"]
+INIT_DB_WORKERS = int(os.getenv("INIT_DB_WORKERS", "1"))
+PARALLEL_QUEUE_CHUNKS = int(os.getenv("PARALLEL_QUEUE_CHUNKS", "2"))  # computed chunks a sheet may run ahead of the writer
+WORKBOOK_USER = "COMPANY001"  # user_uk the workbook rows are stored under
 
 # === FALLBACK FACTORS ===
 IPCC_FACTORS_BY_CODE = {
@@ -34,51 +59,83 @@ IPCC_FACTORS_BY_CODE = {
     "TRANS_12_14WHS_EM": 2.68, "GEN_ITEM_PROD_EM": 5.0, "CORE_TRANS_BB_EM": 2.68
 }
 
-# === FORMULAS ===
-FORMULAS = {
-    "LPG_CONS_EM": "row.get('LPG_no',0) * row.get('Weight_LPG',0)",
-    "DG_CONS_EM": "row.get('Fuel_cons',0)",
-    "COMP_EM": "row.get('Compost_gen',0)",
-    "HEMV_FUEL_EM": "row.get('Fuel_Con',0) or row.get('Fuel_Cons',0)",
-    "OVER_B_EM": "row.get('T',0) or row.get('t',0) or row.get('m3',0)"
-}
-
 # === HELPERS ===
+NUMERIC_TYPES = (int, float, np.integer, np.floating)
+
 def parse_number(v):
     """Extract numeric value safely."""
     if pd.isna(v): return 0.0
-    if isinstance(v, (int, float, np.integer, np.floating)): return float(v)
+    if isinstance(v, NUMERIC_TYPES): return float(v)
     s = str(v).replace(",", "").strip()
-    m = re.search(r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?", s)
+    m = NUMBER_RE.search(s)
     return float(m.group(0)) if m else 0.0
 
-def safe_eval_formula(formula, row):
-    """Safely evaluate formulas."""
-    try:
-        return float(eval(formula, {"__builtins__": {}}, {"row": row}))
-    except Exception:
-        return 0.0
+def parse_number_column(col):
+    """Column-wise parse_number: returns a float64 array with the same value per cell."""
+    if pd.api.types.is_bool_dtype(col) or pd.api.types.is_numeric_dtype(col):
+        return np.nan_to_num(col.to_numpy(dtype="float64"), nan=0.0, posinf=np.inf, neginf=-np.inf)
+    if pd.api.types.is_datetime64_any_dtype(col):
+        # str(Timestamp) starts with the year, which is what the regex picks up
+        return col.dt.year.to_numpy(dtype="float64", na_value=0.0)
+    values = col.to_numpy(dtype=object)
+    out = np.zeros(len(values))
+    is_null = pd.isna(values)
+    is_str = np.fromiter((isinstance(v, str) for v in values), bool, len(values))
+    is_num = ~is_null & ~is_str & np.fromiter((isinstance(v, NUMERIC_TYPES) for v in values), bool, len(values))
+    if is_num.any():
+        out[is_num] = values[is_num].astype("float64")
+    if is_str.any():
+        matched = (pd.Series(values[is_str], dtype=object).str.replace(",", "", regex=False).str.strip()
+                   .str.extract(f"({NUMBER_RE.pattern})", expand=False))
+        out[is_str] = matched.astype("float64").fillna(0.0).to_numpy()
+    other = ~is_null & ~is_str & ~is_num  # dates/times stored in object columns, rare
+    if other.any():
+        out[other] = [parse_number(v) for v in values[other]]
+    return out
+
+def to_json_value(obj):
+    """Convert datetime, Timestamp, and NumPy types to plain JSON-able values."""
+    if isinstance(obj, (datetime, date, pd.Timestamp)):
+        return obj.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(obj, (np.integer,)):
+        return int(obj)
+    elif isinstance(obj, (np.floating,)):
+        return float(obj)
+    elif isinstance(obj, (np.ndarray, list)):
+        return [to_json_value(i) for i in obj]
+    elif isinstance(obj, dict):
+        return {k: to_json_value(v) for k, v in obj.items()}
+    else:
+        return obj
 
 def safe_json_dumps(data):
     """Convert datetime, Timestamp, and NumPy types before dumping JSON."""
-    def convert(obj):
-        if isinstance(obj, (datetime, date, pd.Timestamp)):
-            return obj.strftime("%Y-%m-%d %H:%M:%S")
-        elif isinstance(obj, (np.integer,)):
-            return int(obj)
-        elif isinstance(obj, (np.floating,)):
-            return float(obj)
-        elif isinstance(obj, (np.ndarray, list)):
-            return [convert(i) for i in obj]
-        elif isinstance(obj, dict):
-            return {k: convert(v) for k, v in obj.items()}
-        else:
-            return obj
-    return json.dumps(convert(data), ensure_ascii=False)
+    return json.dumps(to_json_value(data), ensure_ascii=False)
+
+PLAIN_JSON_TYPES = {str, int, float, bool, type(None)}
+
+def json_ready_column(col):
+    """to_json_value over one column of cells, touching only the cells that need converting."""
+    out = col.tolist()  # numpy scalars -> Python int/float
+    if col.dtype == object:
+        for i, v in enumerate(out):
+            if type(v) not in PLAIN_JSON_TYPES:
+                out[i] = to_json_value(v)
+    return out
 
 # === DATABASE CREATION ===
 def recreate_db():
+    saved_formulas, saved_versions = [], []
     if os.path.exists(DB):
+        old = sqlite3.connect(DB)
+        try:
+            saved_formulas = old.execute("SELECT process_code, expression FROM calc_formulas").fetchall()
+            saved_versions = old.execute("""
+                SELECT process_code, factor, effective_from, effective_to, source, created_at FROM factor_versions
+            """).fetchall()
+        except sqlite3.OperationalError:
+            pass
+        old.close()
         os.remove(DB)
         print("🗑 Deleted old DB")
     conn = sqlite3.connect(DB)
@@ -101,38 +158,66 @@ def recreate_db():
     );
     """)
     conn.commit()
+    apply_migrations(conn)  # rollups, history indexes, calc_formulas, factors_version
+    for code, expression in saved_formulas:  # formula overrides outlive a rebuild
+        set_formula(conn, code, expression)
+    conn.executemany("""
+        INSERT INTO factor_versions (process_code, factor, effective_from, effective_to, source, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, saved_versions)  # as do factor versions, re-applied after the import
+    conn.commit()
     print("✅ DB created.")
     return conn
 
+def open_db_in_place():
+    """The existing DB with migrations applied, for --incremental (created as usual if missing)."""
+    if not os.path.exists(DB):
+        return recreate_db()
+    conn = sqlite3.connect(DB)
+    apply_migrations(conn)
+    print("✅ DB opened for incremental import.")
+    return conn
+
 # === LOAD FACTOR SHEET ===
-def load_factors_sheet():
-    xls = pd.ExcelFile(EXCEL, engine='openpyxl')
-    if "Emission_factor" not in xls.sheet_names:
-        raise RuntimeError("Emission_factor sheet not found.")
-    df = xls.parse("Emission_factor")
-    df.columns = [str(c).strip() for c in df.columns]
-    proc_col = next((c for c in df.columns if 'process' in c.lower()), None)
-    ef_col = next((c for c in df.columns if 'ef' in c.lower() or 'factor' in c.lower()), None)
-    unit_col = next((c for c in df.columns if 'unit' in c.lower()), None)
-    desc_col = next((c for c in df.columns if 'desc' in c.lower()), None)
-    scope_col = next((c for c in df.columns if 'scope' in c.lower()), None)
-    mapping = {}
-    for _, r in df.iterrows():
-        code = str(r.get(proc_col)).strip().upper() if r.get(proc_col) else None
-        if not code: continue
-        factor = parse_number(r.get(ef_col))
-        mapping[code] = {
-            "factor": factor,
-            "unit": str(r.get(unit_col) or "").strip(),
-            "desc": str(r.get(desc_col) or "").strip(),
-            "scope": str(r.get(scope_col) or "").strip(),
-        }
-    return mapping
+def cell_text(v):
+    """Stripped cell text; empty for blank (NaN) cells."""
+    return "" if v is None or pd.isna(v) else str(v).strip()
 
-def insert_factors_to_db(conn, mapping):
-    cur = conn.cursor()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    inserted = 0; from_sheet=0; fallback=0
+def load_factors_sheet(book=None):
+    own = book is None
+    book = open_workbook(EXCEL) if own else book
+    try:
+        if "Emission_factor" not in book.sheetnames:
+            raise RuntimeError("Emission_factor sheet not found.")
+        mapping = {}
+        for df in iter_chunks(book, "Emission_factor"):
+            df.columns = [str(c).strip() for c in df.columns]
+            proc_col = next((c for c in df.columns if 'process' in c.lower()), None)
+            ef_col = next((c for c in df.columns if 'ef' in c.lower() or 'factor' in c.lower()), None)
+            unit_col = next((c for c in df.columns if 'unit' in c.lower()), None)
+            desc_col = next((c for c in df.columns if 'desc' in c.lower()), None)
+            scope_col = next((c for c in df.columns if 'scope' in c.lower()), None)
+            for _, r in df.iterrows():
+                code = str(r.get(proc_col)).strip().upper() if r.get(proc_col) else None
+                if not code: continue
+                factor = parse_number(r.get(ef_col))
+                mapping[code] = {
+                    "factor": factor,
+                    "unit": cell_text(r.get(unit_col)),
+                    "desc": cell_text(r.get(desc_col)),
+                    "scope": cell_text(r.get(scope_col)),
+                }
+        return mapping
+    finally:
+        if own:
+            book.close()
+
+def default_scope(code):
+    return "Scope_1" if "TRANS" not in code and not code.endswith("PROD_EM") else "Scope_3"
+
+def factor_rows(mapping):
+    """(process_code, process_desc, scope, unit, factor, calc_type) per code, IPCC fallbacks applied, codes without a factor left out."""
+    rows = []
     all_codes = set(mapping.keys()) | set(IPCC_FACTORS_BY_CODE.keys())
     for code in sorted(all_codes):
         entry = mapping.get(code, {})
@@ -140,82 +225,236 @@ def insert_factors_to_db(conn, mapping):
         if not factor: continue
         unit = entry.get("unit") or ""
         desc = entry.get("desc") or f"Emission from {code}"
-        scope = entry.get("scope") or ("Scope_1" if "TRANS" not in code and not code.endswith("PROD_EM") else "Scope_3")
-        cur.execute("""
-            INSERT INTO emission_factors (process_code, process_desc, scope, unit, factor, calc_type, last_updated)
-            VALUES (?, ?, ?, ?, ?, 'single', ?)
-            ON CONFLICT(process_code) DO UPDATE SET
-                process_desc=excluded.process_desc, scope=excluded.scope, unit=excluded.unit, factor=excluded.factor, last_updated=excluded.last_updated
-        """, (code, desc, scope, unit, factor, now))
-        inserted += 1
-    conn.commit()
-    print(f"✅ emission_factors inserted/updated: {inserted}")
+        scope = entry.get("scope") or default_scope(code)
+        rows.append((code, desc, scope, unit, factor, "single"))
+    return rows
 
-# === COMPUTE EMISSIONS ===
-def compute_and_insert_emissions(conn, factors_map):
-    xls = pd.ExcelFile(EXCEL, engine='openpyxl')
+def insert_factors_to_db(conn, mapping):
     cur = conn.cursor()
+    if not conn.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")  # the ledger is read under the write lock
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    inserted = 0; skipped_rows = []
+    counts = import_ledger.sync_factors(cur, factor_rows(mapping), now)
+    versioned = factor_versions.sync_current_factors(cur, now)  # the workbook does not override a version
+    conn.commit()
+    print(f"✅ emission_factors inserted/updated: {counts['inserted'] + counts['updated']}")
+    if counts["unchanged"] or counts["retired"]:
+        print(f"✅ emission_factors unchanged: {counts['unchanged']}, retired: {counts['retired']}")
+    if versioned:
+        print(f"✅ emission_factors reset to their factor version: {versioned}")
+
+# === COMPUTE EMISSIONS ===
+def factor_frame(factors_map):
+    """factor/scope/unit per process code, with the IPCC fallbacks, as a frame to merge against."""
+    rows = {code: (f, "Scope_1", "varies") for code, f in IPCC_FACTORS_BY_CODE.items()}
+    rows.update({code: (e.get("factor", IPCC_FACTORS_BY_CODE.get(code, 0.0)), e.get("scope", "Scope_1"), e.get("unit", "varies"))
+                 for code, e in factors_map.items()})
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["factor", "scope", "unit"])
+
+def compute_sheet(sheet, df, factors, formulas):
+    """Vectorized per-sheet computation.
+
+    Returns (emission rows ready for executemany, skipped row labels), row-for-row
+    identical to the old iterrows() loop.
+    """
+    df.columns = [str(c).strip() for c in df.columns]
+    cols = list(df.columns)
+    proc_col = next((c for c in cols if 'process' in c.lower()), None)
+    total_col = next((c for c in cols if 'total' in c.lower()), None)
+    n = len(df)
+    values = df.values  # same per-cell objects iterrows() hands out
+    if values.dtype.kind in "mM":
+        values = df.astype(object).values
+
+    numeric = [parse_number_column(df.iloc[:, i]) for i in range(len(cols))]
+    columns = dict(zip(cols, numeric))
+    columns.update({c.lower(): v for c, v in zip(cols, numeric)})
+
+    if proc_col:
+        pi = cols.index(proc_col)
+        codes = [str(v).strip().upper() if v else sheet for v in values[:, pi]]
+    else:
+        codes = [sheet] * n
+    looked_up = pd.DataFrame({"code": codes}).merge(factors, left_on="code", right_index=True, how="left")
+    factor = looked_up["factor"].fillna(0.0).to_numpy(dtype="float64")
+    scope = looked_up["scope"].fillna("Scope_1").tolist()
+    unit = looked_up["unit"].fillna("varies").tolist()
+
+    activity = calc_engine.compute_sheet(sheet, columns, n, formulas)
+    if activity is None:
+        activity = columns[total_col] if total_col else np.zeros(n)
+    emission = activity * factor
 
-    for sheet in xls.sheet_names:
-        if sheet in ["Emission_factor", "Description", "Processess"]:
-            continue
+    keep = factor != 0
+    skipped = [{"sheet": sheet, "row": df.index[i], "process_code": codes[i], "reason": "no_factor"}
+               for i in np.flatnonzero(~keep)]
+    kept = np.flatnonzero(keep)
+    cells = list(zip(*[json_ready_column(values[kept, j]) for j in range(len(cols))])) if len(kept) else []
+    rows = []
+    for i, row_cells in zip(kept, cells):
+        rows.append((WORKBOOK_USER, codes[i], f"Emission from {codes[i]}", scope[i], unit[i],
+                     json.dumps(dict(zip(cols, row_cells)), ensure_ascii=False), float(factor[i]), float(emission[i])))
+    return rows, skipped
+
+# --- pipeline: workbook chunks -> computed rows -> inserts, one chunk in memory at a time ---
+def emission_sheets(book):
+    return [s for s in book.sheetnames if s not in SKIP_SHEETS]
+
+def sheet_chunks(book, sheets):
+    """(sheet, DataFrame chunk) for the given sheets in order; (sheet, None) once if a sheet cannot be parsed."""
+    for sheet in sheets:
         try:
-            df = xls.parse(sheet)
+            for df in iter_chunks(book, sheet):
+                yield sheet, df
         except Exception as e:
             print(f"⚠️ Could not parse sheet {sheet}: {e}")
-            continue
-        if df.empty:
-            continue
-
-        df.columns = [str(c).strip() for c in df.columns]
-        proc_col = next((c for c in df.columns if 'process' in c.lower()), None)
-        total_col = next((c for c in df.columns if 'total' in c.lower()), None)
-        formula = FORMULAS.get(sheet)
-
-        for idx, r in df.iterrows():
-            row = {c: parse_number(r.get(c)) for c in df.columns}
-            row.update({c.lower(): parse_number(r.get(c)) for c in df.columns})
-            code = str(r.get(proc_col)).strip().upper() if proc_col and r.get(proc_col) else sheet
-            factor = factors_map.get(code, {}).get("factor", IPCC_FACTORS_BY_CODE.get(code, 0.0))
-
-            if factor == 0:
-                skipped_rows.append({"sheet": sheet, "row": idx, "reason": "no_factor"}); continue
-
-            total_activity = 0.0
-            if formula:
-                total_activity = safe_eval_formula(formula, row)
-            elif total_col:
-                total_activity = parse_number(r.get(total_col))
-
-            emission = total_activity * factor
-            input_details = {c: (r.get(c).strftime("%Y-%m-%d %H:%M:%S") if isinstance(r.get(c), (datetime, pd.Timestamp)) else r.get(c)) for c in df.columns}
-
-            cur.execute("""
-                INSERT INTO emissions (user_uk, process_code, process_desc, scope, unit, input_details, factor_used, emission, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                "COMPANY001", code, f"Emission from {code}",
-                factors_map.get(code, {}).get("scope", "Scope_1"),
-                factors_map.get(code, {}).get("unit", "varies"),
-                safe_json_dumps(input_details),
-                factor, emission, now
-            ))
-            inserted += 1
+            yield sheet, None
+
+def computed_chunks(chunks, factors, formulas):
+    """(sheet, rows, skipped) per chunk, see compute_sheet(); rows is None for a sheet that failed to parse."""
+    for sheet, df in chunks:
+        if df is None:
+            yield sheet, None, []
+        elif not df.empty:
+            yield (sheet, *compute_sheet(sheet, df, factors, formulas))
+
+_worker_books = {}  # path -> read-only workbook, opened once per pool process
+
+def compute_sheet_job(path, sheet, factors, formula_sources, out):
+    """Process-pool task: put one sheet's chunks on the queue out as (rows, skipped), then None;
+    an error message (str) instead if the sheet cannot be parsed. put() blocks while out is full."""
+    formulas = {code: compile_formula(src) for code, src in formula_sources.items()}  # compiled code does not pickle
+    try:
+        book = _worker_books.get(path) or _worker_books.setdefault(path, open_workbook(path))
+        for _, rows, skipped in computed_chunks(((sheet, df) for df in iter_chunks(book, sheet)), factors, formulas):
+            out.put((rows, skipped))
+    except Exception as e:
+        out.put(str(e))
+        return
+    out.put(None)
+
+def _sheet_results(out, future):
+    """Items a compute_sheet_job puts on out, up to its final None or error."""
+    while True:
+        try:
+            item = out.get(timeout=1)
+        except Empty:
+            if not future.done():
+                continue
+            try:
+                item = out.get_nowait()  # puts finish before the task does
+            except Empty:
+                future.result()  # raises if the worker died
+                raise RuntimeError("sheet worker stopped without finishing its sheet")
+        yield item
+        if item is None or isinstance(item, str):
+            return
+
+def parallel_chunks(sheets, factors, formulas, workers):
+    """computed_chunks() for the given sheets, computed in parallel, yielded in sheet order chunk by chunk."""
+    sources = {code: f.source for code, f in formulas.items()}
+    print(f"⚙️ Computing {len(sheets)} sheets on {workers} processes")
+    manager = Manager()
+    pool = ProcessPoolExecutor(max_workers=workers)
+    queues, futures = [], []
+    try:
+        queues.extend(manager.Queue(PARALLEL_QUEUE_CHUNKS) for _ in sheets)
+        futures.extend(pool.submit(compute_sheet_job, EXCEL, sheet, factors, sources, out) for sheet, out in zip(sheets, queues))
+        # same order, so ids match a sequential run; sheets are picked up in this order too, so the one
+        # being written is always running or finished and later ones wait on their full queues
+        for sheet, out, future in zip(sheets, queues, futures):
+            for item in _sheet_results(out, future):
+                if isinstance(item, str):
+                    print(f"⚠️ Could not parse sheet {sheet}: {item}")
+                    yield sheet, None, []
+                elif item is not None:
+                    yield (sheet, *item)
+    finally:  # on an early exit, drain the sheets already started so no worker blocks on a full queue
+        pool.shutdown(wait=False, cancel_futures=True)
+        for out, future in zip(queues, futures):
+            while not future.done():
+                try:
+                    out.get(timeout=0.1)
+                except Empty:
+                    pass
+        pool.shutdown()
+        manager.shutdown()
+
+def compute_and_insert_emissions(conn, factors_map, book=None, workers=INIT_DB_WORKERS, incremental=False):
+    own = book is None
+    book = open_workbook(EXCEL) if own else book
+    cur = conn.cursor()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    factors = factor_frame(factors_map)
+    formulas = calc_engine.sheet_formulas(conn)
+    sources = {code: f.source for code, f in formulas.items()}
+    totals = Counter(); skipped_rows = []
+
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")  # hold the write lock before the ledger and ids are read
+    try:
+        if incremental:
+            adopted = import_ledger.adopt_unledgered(cur, WORKBOOK_USER)
+            if adopted:
+                print(f"⚠️ No import ledger yet: replaced {adopted} untracked workbook rows")
+                totals["retired"] += adopted
+        sheets = emission_sheets(book)
+        digests = {sheet: sheet_digest(book, sheet) for sheet in sheets}
+        totals["retired"] += import_ledger.retire_missing_sheets(cur, sheets, now)
+        if incremental:
+            todo = [s for s in sheets if not import_ledger.unchanged_sheet(cur, s, digests[s], factors, sources.get(s))]
+            print(f"⚙️ {len(sheets) - len(todo)} of {len(sheets)} sheets unchanged since the last import")
+        else:
+            todo = sheets
+        if workers > 1 and todo:
+            chunks = parallel_chunks(todo, factors, formulas, workers)
+        else:
+            chunks = computed_chunks(sheet_chunks(book, todo), factors, formulas)
+        imports, failed = {}, set()
+        for sheet, rows, skipped in chunks:  # single writer; skipped rows merged across workers
+            if rows is None:
+                failed.add(sheet)  # left as it was, retried next time
+                continue
+            skipped_rows.extend(skipped)
+            if sheet not in imports:
+                imports[sheet] = import_ledger.SheetImport(cur, sheet, now)
+            if rows or skipped:
+                imports[sheet].add(rows, skipped)
+        for sheet in todo:
+            if sheet not in failed:
+                importer = imports.get(sheet) or import_ledger.SheetImport(cur, sheet, now)
+                totals.update(importer.finish(digests[sheet], factors, sources.get(sheet)))
+        import_ledger.refresh_rollups(cur, WORKBOOK_USER, totals)
+    finally:
+        if own:
+            book.close()
 
     conn.commit()
-    print(f"✅ Inserted emissions rows: {inserted}, Skipped: {len(skipped_rows)}")
+    print(f"✅ Inserted emissions rows: {totals['inserted']}, Skipped: {len(skipped_rows)}")
+    if incremental:
+        print(f"✅ Updated: {totals['updated']}, unchanged: {totals['unchanged']}, retired: {totals['retired']}")
+    # rows were computed with the workbook's factors; the ledger keeps those hashes, so restated
+    # rows stay unchanged on the next run and rewritten ones are restated again here
+    restated = factor_versions.recalculate(conn)
+    if restated["rows"]:
+        print(f"✅ Restated from factor versions: {restated['rows']} rows")
 
 # === MAIN ===
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild emissions.db from Master Calculation.xlsx.")
+    parser.add_argument("--workers", type=int, default=INIT_DB_WORKERS, help="processes computing sheets (1 = in-process)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="apply only the workbook's changes to the existing DB instead of rebuilding it")
+    args = parser.parse_args()
     try:
         print("Starting DB initialization...")
-        conn = recreate_db()
-        factors_map = load_factors_sheet()
+        conn = open_db_in_place() if args.incremental else recreate_db()
+        book = open_workbook(EXCEL)  # opened once for both passes
+        factors_map = load_factors_sheet(book)
         print(f"Loaded {len(factors_map)} factor entries.")
         insert_factors_to_db(conn, factors_map)
-        compute_and_insert_emissions(conn, factors_map)
+        compute_and_insert_emissions(conn, factors_map, book, args.workers, args.incremental)
+        book.close()
         conn.close()
         print("🎯 Initialization complete.")
     except Exception as e:
@@ -0,0 +1,235 @@
+# instrumentation.py
+"""
+Opt-in request instrumentation (INSTRUMENTATION=1, or app.config["INSTRUMENTATION"] = True):
+- a WSGI middleware times every request end to end, streamed bodies included, and splits the time
+  into database (every execute / fetch / commit, via db.QUERY_HOOKS), JSON (app.json loads / dumps)
+  and template rendering (Flask's template signals)
+- /metrics serves the counters in Prometheus text format, labelled by route pattern; they are kept
+  per process, so with several gunicorn workers each scrape sees the worker that answered
+- statements slower than SLOW_QUERY_MS are logged with their SQL on the "carbon_dashboard.sql" logger
+  (parameters are left out, they can hold user data)
+- a request is profiled with cProfile when it sends `X-Profile: <PROFILE_TOKEN>` or is picked by
+  PROFILE_SAMPLE_RATE; the .prof file and a cumulative-time summary go to PROFILE_DIR and the
+  response carries X-Profile-Id
+"""
+
+import cProfile, io, logging, os, pstats, random, threading, time, uuid
+from flask import Response, before_render_template, request, template_rendered
+from flask.json.provider import DefaultJSONProvider
+import db
+
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "0") in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger("carbon_dashboard.sql")
+
+_current = threading.local()  # .timings of the request running on this thread
+_lock = threading.Lock()
+_requests = {}   # (route, method, status) -> count
+_routes = {}     # route -> {"count", "seconds", "db", "json", "template", "queries", "buckets"}
+_slow_queries = 0
+
+def _timings():
+    return getattr(_current, "timings", None)
+
+def _on_query(sql, ms, kind):
+    global _slow_queries
+    t = _timings()
+    if t is not None:
+        t["db"] += ms / 1000
+        if kind == "execute":
+            t["queries"] += 1
+    if ms >= SLOW_QUERY_MS:
+        with _lock:
+            _slow_queries += 1
+        log.warning("slow query (%s, %.1f ms, route %s): %s", kind, ms,
+                    t["route"] if t is not None else "-", " ".join(str(sql).split()))
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """app.json provider that counts request.get_json() and jsonify() time as JSON time."""
+
+    def loads(self, s, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().loads(s, **kwargs)
+        finally:
+            _add("json", t0)
+
+    def dumps(self, obj, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            _add("json", t0)
+
+def _add(part, t0):
+    t = _timings()
+    if t is not None:
+        t[part] += time.perf_counter() - t0
+
+def _template_started(sender, template, context, **extra):
+    t = _timings()
+    if t is not None:
+        t["template_t0"] = time.perf_counter()
+
+def _template_done(sender, template, context, **extra):
+    t = _timings()
+    if t is not None and t.get("template_t0"):
+        t["template"] += time.perf_counter() - t.pop("template_t0")
+
+def _set_route():
+    t = _timings()
+    if t is not None:
+        t["route"] = request.url_rule.rule if request.url_rule else "<unmatched>"
+
+def _record(t, method, status, seconds):
+    with _lock:
+        key = (t["route"], method, status)
+        _requests[key] = _requests.get(key, 0) + 1
+        r = _routes.get(t["route"])
+        if r is None:
+            r = _routes[t["route"]] = {"count": 0, "seconds": 0.0, "db": 0.0, "json": 0.0, "template": 0.0,
+                                       "queries": 0, "buckets": [0] * len(BUCKETS)}
+        r["count"] += 1
+        r["seconds"] += seconds
+        for part in ("db", "json", "template", "queries"):
+            r[part] += t[part]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                r["buckets"][i] += 1
+
+def _should_profile(environ):
+    if PROFILE_TOKEN and environ.get("HTTP_X_PROFILE") == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def _save_profile(profiler, profile_id, t, method):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile_id)
+    profiler.dump_stats(base + ".prof")
+    out = io.StringIO()
+    out.write(f"{method} {t['route']}  db {t['db'] * 1000:.1f} ms  json {t['json'] * 1000:.1f} ms  "
+              f"template {t['template'] * 1000:.1f} ms  queries {t['queries']}\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write(out.getvalue())
+
+class _Body:
+    """Response iterable that finishes the request's timings when the server closes it."""
+
+    def __init__(self, body, finish):
+        self._body, self._finish = body, finish
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._finish()
+
+class InstrumentationMiddleware:
+    """Wraps app.wsgi_app; see the module docstring."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        t = {"route": "<unmatched>", "db": 0.0, "json": 0.0, "template": 0.0, "queries": 0}
+        method = environ.get("REQUEST_METHOD", "GET")
+        status = ["000"]
+        profiler = cProfile.Profile() if _should_profile(environ) else None
+        profile_id = None
+        if profiler:
+            profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        def _start_response(s, headers, exc_info=None):
+            status[0] = s.split(" ", 1)[0]
+            if profile_id:
+                headers = list(headers) + [("X-Profile-Id", profile_id)]
+            return start_response(s, headers, exc_info)
+
+        def finish():
+            if _timings() is t:
+                _current.timings = None
+            seconds = time.perf_counter() - t0
+            if profiler:
+                profiler.disable()
+                try:
+                    _save_profile(profiler, profile_id, t, method)
+                except OSError as e:
+                    log.warning("could not save profile %s: %s", profile_id, e)
+            _record(t, method, status[0], seconds)
+
+        _current.timings = t
+        t0 = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            body = self.wsgi_app(environ, _start_response)
+        except BaseException:
+            status[0] = "500"
+            finish()
+            raise
+        return _Body(body, finish)
+
+def _esc(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_metrics():
+    """Current counters in Prometheus text exposition format."""
+    with _lock:
+        requests = dict(_requests)
+        routes = {k: dict(v, buckets=list(v["buckets"])) for k, v in _routes.items()}
+        slow = _slow_queries
+    lines = ["# HELP http_requests_total Requests handled by this worker.",
+             "# TYPE http_requests_total counter"]
+    for (route, method, status), n in sorted(requests.items()):
+        lines.append(f'http_requests_total{{route="{_esc(route)}",method="{method}",status="{status}"}} {n}')
+    lines += ["# HELP http_request_duration_seconds Wall time per request, streamed body included.",
+              "# TYPE http_request_duration_seconds histogram"]
+    for route, r in sorted(routes.items()):
+        label = f'route="{_esc(route)}"'
+        for bound, n in zip(BUCKETS, r["buckets"]):
+            lines.append(f'http_request_duration_seconds_bucket{{{label},le="{bound}"}} {n}')
+        lines.append(f'http_request_duration_seconds_bucket{{{label},le="+Inf"}} {r["count"]}')
+        lines.append(f'http_request_duration_seconds_sum{{{label}}} {r["seconds"]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{{label}}} {r["count"]}')
+    for part, help_text in (("db", "Time spent executing and fetching queries."),
+                            ("json", "Time spent in JSON loads / dumps."),
+                            ("template", "Time spent rendering templates.")):
+        name = f"http_request_{part}_seconds_total"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f'{name}{{route="{_esc(route)}"}} {r[part]:.6f}' for route, r in sorted(routes.items())]
+    lines += ["# HELP db_queries_total Statements executed.", "# TYPE db_queries_total counter"]
+    lines += [f'db_queries_total{{route="{_esc(route)}"}} {r["queries"]}' for route, r in sorted(routes.items())]
+    lines += [f"# HELP db_slow_queries_total Statements slower than {SLOW_QUERY_MS:g} ms.",
+              "# TYPE db_slow_queries_total counter", f"db_slow_queries_total {slow}"]
+    # connection-layer counters from db.py (SQLite only)
+    for name, value in db.stats().items():
+        metric = f"sqlite_{name}"
+        kind = "gauge" if name.endswith(("_max", "_avg")) else "counter"
+        lines += [f"# TYPE {metric} {kind}", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
+
+def init_app(app):
+    """Install the middleware, hooks and /metrics when instrumentation is switched on."""
+    if not (INSTRUMENTATION or app.config.get("INSTRUMENTATION")):
+        return
+    if _on_query not in db.QUERY_HOOKS:
+        db.QUERY_HOOKS.append(_on_query)
+    app.json = TimedJSONProvider(app)
+    app.before_request(_set_route)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_done, app)
+    app.wsgi_app = InstrumentationMiddleware(app.wsgi_app)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,63 @@
+# jobs.py
+"""
+File-backed background jobs, shared by export_jobs.py and factor_versions.py:
+- a JobStore keeps each job's status as <directory>/<job id>.json, replaced atomically on every
+  update, so any gunicorn worker can answer a poll for a job another worker is running
+- submit() runs the job on the store's own thread pool, created under a lock on first use (per process)
+- job ids are uuid4 strings and get() rejects anything else, so paths are never built from user input
+"""
+
+import json, os, threading, uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+def now_text():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+class JobStore:
+    """Status files in one directory plus the thread pool that runs the jobs."""
+
+    def __init__(self, directory, workers, thread_name_prefix):
+        self.directory = directory
+        self.workers = workers
+        self.thread_name_prefix = thread_name_prefix
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def status_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def write(self, status):
+        tmp = self.status_path(status["id"]) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(status, f)
+        os.replace(tmp, self.status_path(status["id"]))
+
+    def get(self, job_id):
+        """Job status dict, or None if unknown / evicted."""
+        try:
+            uuid.UUID(job_id)
+            with open(self.status_path(job_id)) as f:
+                return json.load(f)
+        except (ValueError, OSError):
+            return None
+
+    def create(self, **fields):
+        """Write and return the status of a new queued job."""
+        os.makedirs(self.directory, exist_ok=True)
+        status = {"id": str(uuid.uuid4()), "status": "queued", "error": None,
+                  "created_at": now_text(), "finished_at": None}
+        status.update(fields)
+        self.write(status)
+        return status
+
+    def finish(self, job, **fields):
+        """Record the job's outcome (status="done" / "failed", results or error) in its status dict."""
+        job.update(fields, finished_at=now_text())
+        self.write(job)
+
+    def submit(self, fn, *args):
+        with self._lock:  # two first submits racing must not each start a pool
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.thread_name_prefix)
+        return self._pool.submit(fn, *args)
@@ -0,0 +1,203 @@
+# loadtest.py
+"""
+Multi-tenant load test against a locally started gunicorn:
+- every tenant is one company account (a bench_user_<i> from `python benchmark.py generate`, i.e. its
+  own user_uk); --users virtual users pick tenants round-robin and run concurrently
+- each virtual user signs in through index(), makes --visit-length requests drawn from --mix
+  (calculator POSTs spread over every process code, calculator / dashboard views, CSV exports),
+  then signs in again with a fresh cookie jar, until --duration runs out
+- the report gives throughput, error rate by cause and p50 / p95 / p99 / max latency per action;
+  "database is locked" failures are counted from gunicorn's error log, where the app's tracebacks land
+- defaults mirror render.yaml (`gunicorn app:app`: one sync worker), so the numbers are for the
+  deployed shape; raise --workers / --threads to see how far that can be pushed
+
+  python benchmark.py generate --users 50 --rows 200 --db /tmp/load.db
+  python loadtest.py --db /tmp/load.db --users 20 --duration 60 --workers 1 --out load.json
+"""
+
+import argparse, json, os, platform, random, re, sqlite3, tempfile, threading, time
+from collections import Counter
+from datetime import datetime
+from benchmark import Gunicorn, HttpSession, git_commit, percentile, random_inputs
+
+DEFAULT_MIX = "calculator_post=5,dashboard=3,calculator_get=2,export_csv=1"
+ACTIONS = ("calculator_post", "calculator_get", "dashboard", "export_csv")
+LOCKED_RE = re.compile(r"database is locked")
+
+def parse_mix(text):
+    """'action=weight,...' -> {action: weight}."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise SystemExit(f"❌ Unknown action '{name}' in --mix (choose from {', '.join(ACTIONS)}).")
+        mix[name] = float(weight or 1)
+    return mix
+
+def action_request(name, rng, plans):
+    """(method, path, form) for one action; calculator POSTs cycle through every process code."""
+    if name == "calculator_post":
+        plan = rng.choice(plans)
+        return "POST", "/calculator", {"process": plan.process_code, **random_inputs(rng, plan)}
+    if name == "calculator_get":
+        return "GET", "/calculator", None
+    if name == "dashboard":
+        return "GET", "/dashboard", None
+    return "GET", "/export_data", None
+
+def ok_status(name, status):
+    if name == "login":
+        return status == 302  # a failed login re-renders the form with 200
+    if name == "calculator_post":
+        return status == 302  # 200 means the form came back with a validation error
+    return status == 200
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}  # action -> [ms] of successful requests
+        self.errors = Counter()  # (action, cause)
+
+    def add(self, name, ms, cause=None):
+        with self.lock:
+            if cause:
+                self.errors[(name, cause)] += 1
+            else:
+                self.latencies.setdefault(name, []).append(ms)
+
+def timed(recorder, name, fn):
+    t0 = time.perf_counter()
+    try:
+        status = fn()
+        cause = None if ok_status(name, status) else f"http_{status}"
+    except OSError as e:  # refused / reset / timed out
+        cause = type(e).__name__
+    recorder.add(name, (time.perf_counter() - t0) * 1000, cause)
+    return cause is None
+
+def virtual_user(idx, base_url, tenants, plans, mix, args, deadline, recorder):
+    rng = random.Random(args.seed * 1000 + idx)
+    names, weights = list(mix), list(mix.values())
+    username = tenants[idx % len(tenants)]
+    time.sleep(args.ramp * idx / max(args.users, 1))
+    while time.time() < deadline:
+        session = HttpSession(base_url)
+        if not timed(recorder, "login", lambda: session.login(username)):
+            time.sleep(0.1)
+            continue
+        for _ in range(args.visit_length):
+            if time.time() >= deadline:
+                break
+            name = rng.choices(names, weights)[0]
+            method, path, form = action_request(name, rng, plans)
+            timed(recorder, name, lambda: session.request(method, path, form))
+            if args.think_ms:
+                time.sleep(rng.uniform(0, 2 * args.think_ms) / 1000)
+
+def summarize(recorder, elapsed, locked):
+    actions = {}
+    total_ok = total_err = 0
+    for name in ["login", *ACTIONS]:
+        lat = sorted(recorder.latencies.get(name, []))
+        errors = sum(n for (a, _), n in recorder.errors.items() if a == name)
+        if not lat and not errors:
+            continue
+        total_ok += len(lat); total_err += errors
+        actions[name] = {
+            "requests": len(lat) + errors, "errors": errors,
+            "error_rate": errors / (len(lat) + errors),
+            "p50_ms": percentile(lat, 50), "p95_ms": percentile(lat, 95), "p99_ms": percentile(lat, 99),
+            "max_ms": lat[-1] if lat else None,
+            "throughput_rps": (len(lat) + errors) / elapsed,
+        }
+    every = sorted(ms for lat in recorder.latencies.values() for ms in lat)
+    total = total_ok + total_err
+    return {
+        "elapsed_s": elapsed, "requests": total, "errors": total_err,
+        "error_rate": total_err / total if total else 0.0,
+        "throughput_rps": total / elapsed if elapsed else None,
+        "p50_ms": percentile(every, 50), "p95_ms": percentile(every, 95), "p99_ms": percentile(every, 99),
+        "max_ms": every[-1] if every else None,
+        "errors_by_cause": {f"{a}:{c}": n for (a, c), n in sorted(recorder.errors.items())},
+        "database_locked": locked,
+        "actions": actions,
+    }
+
+def count_locked(log_path):
+    try:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            return sum(1 for line in f if LOCKED_RE.search(line) and "OperationalError" in line)
+    except OSError:
+        return None
+
+def run(args):
+    from calc_engine import PLANS
+    conn = sqlite3.connect(args.db)
+    tenants = [r[0] for r in conn.execute("SELECT username FROM users WHERE username LIKE 'bench_user_%' ORDER BY id")]
+    conn.close()
+    if not tenants:
+        raise SystemExit("❌ No bench users in this DB; run `python benchmark.py generate` first.")
+    tenants = tenants[:args.tenants] if args.tenants else tenants
+    plans = [p for p in PLANS.values() if p.fields]
+    mix = parse_mix(args.mix)
+    log_path = args.log or os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "gunicorn.log")
+    recorder = Recorder()
+    with Gunicorn(args.db, args.workers, args.threads, log_path=log_path) as server:
+        print(f"⚙️ gunicorn on {server.base_url}: {args.workers} worker(s) x {args.threads} thread(s), "
+              f"{args.users} virtual users over {len(tenants)} tenants for {args.duration}s")
+        start = time.time()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=virtual_user, daemon=True,
+                                    args=(i, server.base_url, tenants, plans, mix, args, deadline, recorder))
+                   for i in range(args.users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+    result = summarize(recorder, elapsed, count_locked(log_path))
+    report = {
+        "meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "db": args.db, "workers": args.workers,
+                 "threads": args.threads, "users": args.users, "tenants": len(tenants), "duration_s": args.duration,
+                 "visit_length": args.visit_length, "think_ms": args.think_ms, "mix": mix, "gunicorn_log": log_path},
+        "result": result,
+    }
+    print_report(result)
+    out = args.out or f"load-{report['meta']['commit'] or 'local'}-w{args.workers}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"🎯 results written to {out}")
+    return report
+
+def print_report(r):
+    def ms(v):
+        return "-" if v is None else f"{v:.1f}"
+    print(f"{'action':<18}{'reqs':>8}{'err%':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, a in r["actions"].items():
+        print(f"{name:<18}{a['requests']:>8}{a['error_rate'] * 100:>7.2f}%{a['throughput_rps']:>9.1f}"
+              f"{ms(a['p50_ms']):>9}{ms(a['p95_ms']):>9}{ms(a['p99_ms']):>9}{ms(a['max_ms']):>9}")
+    print(f"{'total':<18}{r['requests']:>8}{r['error_rate'] * 100:>7.2f}%{r['throughput_rps'] or 0:>9.1f}"
+          f"{ms(r['p50_ms']):>9}{ms(r['p95_ms']):>9}{ms(r['p99_ms']):>9}{ms(r['max_ms']):>9}")
+    for cause, n in r["errors_by_cause"].items():
+        print(f"⚠️ {cause}: {n}")
+    locked = r["database_locked"]
+    print(("⚠️" if locked else "✅") + f" 'database is locked' errors: {'unknown' if locked is None else locked}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="DB built by `benchmark.py generate` (it is written to)")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--tenants", type=int, default=0, help="limit to the first N bench users (0 = all)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load after ramp-up starts")
+    parser.add_argument("--ramp", type=float, default=2, help="seconds over which virtual users start")
+    parser.add_argument("--visit-length", type=int, default=20, help="requests per sign-in")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"action weights, default {DEFAULT_MIX}")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--log", help="where to keep gunicorn's error log (default: a temp dir)")
+    parser.add_argument("--out")
+    run(parser.parse_args())
@@ -0,0 +1,65 @@
+# migrations.py
+"""
+Schema migrations for emissions.db:
+- each step is (version, description, fn) and runs once; progress is kept in PRAGMA user_version
+- init_db.recreate_db() runs them on a fresh DB, app.py runs them on startup
+- `python migrations.py` upgrades emissions.db in place
+"""
+
+import sqlite3
+from rollups import ensure_rollups
+from formula_engine import create_formula_table
+from factor_cache import create_factor_meta
+from aggregates import create_month_index
+from emission_inputs import backfill_inputs
+from page_cache import create_version_table
+from import_ledger import create_ledger_tables
+from factor_versions import create_version_table as create_factor_versions
+
+DB = "emissions.db"
+
+def _create_history_indexes(conn):
+    # keyset pagination / "last 10" lookups walk (user_uk, created_at, id) in order and stop at LIMIT;
+    # the second index covers the rollup rebuild so it never touches the wide input_details rows
+    conn.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_emissions_user_created ON emissions(user_uk, created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_emissions_user_scope_proc ON emissions(user_uk, scope, process_code, emission);
+    """)
+
+MIGRATIONS = [
+    (1, "emission_rollups table", ensure_rollups),
+    (2, "history indexes on emissions", _create_history_indexes),
+    (3, "calc_formulas table", create_formula_table),
+    (4, "factors_version counter + triggers", create_factor_meta),
+    (5, "month expression index on emissions", create_month_index),
+    (6, "emission_inputs table + backfill from input_details", backfill_inputs),
+    (7, "user_data_versions counter + triggers", create_version_table),
+    (8, "import_sheets / import_ledger tables", create_ledger_tables),
+    (9, "factor_versions table + emissions.activity_value", create_factor_versions),
+    (10, "covering month index on emissions (adds created_at)", create_month_index),
+    (11, "import_sheets.codes for per-sheet change detection", create_ledger_tables),
+]
+
+def apply_migrations(conn):
+    """Run every migration newer than the DB's user_version; returns the versions applied."""
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='emissions'")
+    if not cur.fetchone():
+        return []  # not initialised yet, init_db.py owns the base tables
+    current = cur.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+    for version, desc, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        fn(conn)
+        conn.execute(f"PRAGMA user_version = {int(version)}")
+        conn.commit()
+        applied.append(version)
+        print(f"✅ migration {version}: {desc}")
+    return applied
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB)
+    applied = apply_migrations(conn)
+    conn.close()
+    print(f"🎯 {len(applied)} migration(s) applied." if applied else "Schema already up to date.")
@@ -0,0 +1,169 @@
+# page_cache.py
+"""
+Rendered-page cache for the dashboard and calculator:
+- user_data_versions keeps a counter per user_uk, bumped by triggers on every INSERT / UPDATE / DELETE
+  of that user's emissions rows, whichever code path makes the change
+- a page is stored per (page, user_uk) together with the version token it was rendered from
+  (the user's data version, plus factors_version for the calculator, plus BUILD_TOKEN), so a write
+  simply makes the stored copy stale and the next render replaces it
+- BUILD_TOKEN hashes the app's code and templates once at startup (or is PAGE_CACHE_BUILD, e.g. the
+  deployed commit), so a deploy invalidates every cached page and ETag
+- an in-process LRU bounded by PAGE_CACHE_SIZE entries and PAGE_CACHE_MAX_BYTES; with PAGE_CACHE_DIR
+  set, pages are also written there so every gunicorn worker can reuse them
+- responses carry an ETag derived from the token, so a repeat visit gets a 304 after one version
+  lookup, without reading entries or rendering the template
+"""
+
+import hashlib, json, os, tempfile, threading
+from collections import OrderedDict
+from flask import Response, request
+
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "512"))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "")
+PAGE_CACHE_FS_MAX = int(os.getenv("PAGE_CACHE_FS_MAX", "5000"))
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data_versions (user_uk TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0);
+CREATE TRIGGER IF NOT EXISTS trg_user_version_ins AFTER INSERT ON emissions WHEN NEW.user_uk IS NOT NULL
+BEGIN
+    INSERT INTO user_data_versions (user_uk, version) VALUES (NEW.user_uk, 1)
+    ON CONFLICT(user_uk) DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_user_version_upd AFTER UPDATE ON emissions WHEN NEW.user_uk IS NOT NULL
+BEGIN
+    INSERT INTO user_data_versions (user_uk, version) VALUES (NEW.user_uk, 1)
+    ON CONFLICT(user_uk) DO UPDATE SET version = version + 1;
+    UPDATE user_data_versions SET version = version + 1
+    WHERE user_uk = OLD.user_uk AND OLD.user_uk IS NOT NEW.user_uk;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_user_version_del AFTER DELETE ON emissions WHEN OLD.user_uk IS NOT NULL
+BEGIN
+    UPDATE user_data_versions SET version = version + 1 WHERE user_uk = OLD.user_uk;
+END;
+"""
+
+_lock = threading.Lock()
+_mem = OrderedDict()  # (page, user_uk) -> (token, html)
+_mem_bytes = 0
+_fs_writes = 0
+
+def build_token(root=APP_DIR):
+    """Hash of the .py / .html / .js files in root and root/templates: changes whenever a deploy does."""
+    digest = hashlib.sha1()
+    for folder in (root, os.path.join(root, "templates")):
+        try:
+            names = sorted(n for n in os.listdir(folder) if n.endswith((".py", ".html", ".js")))
+        except OSError:
+            continue
+        for name in names:
+            try:
+                with open(os.path.join(folder, name), "rb") as f:
+                    digest.update(name.encode() + b"\0" + f.read())
+            except OSError:
+                pass
+    return digest.hexdigest()[:12]
+
+BUILD_TOKEN = os.getenv("PAGE_CACHE_BUILD") or build_token()
+
+def create_version_table(conn):
+    conn.executescript(VERSION_SCHEMA)
+
+def data_version(cur, user_uk):
+    """The user's data version (0 before their first entry)."""
+    cur.execute("SELECT version FROM user_data_versions WHERE user_uk = ?", (user_uk,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def etag_for(page, user_uk, token):
+    return hashlib.sha1(json.dumps([page, user_uk, token]).encode()).hexdigest()
+
+def _fs_path(page, user_uk):
+    return os.path.join(PAGE_CACHE_DIR, hashlib.sha1(f"{page}:{user_uk}".encode()).hexdigest() + ".html")
+
+def _fs_get(page, user_uk, token):
+    try:
+        with open(_fs_path(page, user_uk), encoding="utf-8") as f:
+            if json.loads(f.readline()) != token:
+                return None
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+def _fs_put(page, user_uk, token, html):
+    global _fs_writes
+    os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=PAGE_CACHE_DIR, suffix=".part")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(json.dumps(token) + "\n"); f.write(html)
+    os.replace(tmp, _fs_path(page, user_uk))  # atomic, so other workers never read half a page
+    _fs_writes += 1
+    if _fs_writes % 100 == 0:
+        _fs_prune()
+
+def _fs_prune():
+    """Keep the newest PAGE_CACHE_FS_MAX pages in PAGE_CACHE_DIR."""
+    try:
+        paths = [os.path.join(PAGE_CACHE_DIR, n) for n in os.listdir(PAGE_CACHE_DIR) if n.endswith(".html")]
+        if len(paths) <= PAGE_CACHE_FS_MAX:
+            return
+        paths.sort(key=os.path.getmtime)
+        for p in paths[:len(paths) - PAGE_CACHE_FS_MAX]:
+            os.remove(p)
+    except OSError:
+        pass
+
+def get(page, user_uk, token):
+    """Cached HTML for (page, user_uk) if it was rendered from this token, else None."""
+    key = (page, user_uk)
+    with _lock:
+        hit = _mem.get(key)
+        if hit and hit[0] == token:
+            _mem.move_to_end(key)
+            return hit[1]
+    if PAGE_CACHE_DIR:
+        html = _fs_get(page, user_uk, token)
+        if html is not None:
+            _mem_put(key, token, html)
+        return html
+    return None
+
+def _mem_put(key, token, html):
+    global _mem_bytes
+    size = len(html)
+    with _lock:
+        old = _mem.pop(key, None)
+        if old:
+            _mem_bytes -= len(old[1])
+        if size > PAGE_CACHE_MAX_BYTES:
+            return
+        _mem[key] = (token, html)
+        _mem_bytes += size
+        while _mem and (len(_mem) > PAGE_CACHE_SIZE or _mem_bytes > PAGE_CACHE_MAX_BYTES):
+            _, (_, evicted) = _mem.popitem(last=False)
+            _mem_bytes -= len(evicted)
+
+def put(page, user_uk, token, html):
+    _mem_put((page, user_uk), token, html)
+    if PAGE_CACHE_DIR:
+        try:
+            _fs_put(page, user_uk, token, html)
+        except OSError:
+            pass  # the filesystem copy is only an optimisation
+
+def cached_page(page, user_uk, token, render):
+    """Response for a per-user page: 304 on a matching If-None-Match, cached HTML, or render() + store."""
+    token = [BUILD_TOKEN, token]
+    etag = etag_for(page, user_uk, token)
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        html = get(page, user_uk, token)
+        if html is None:
+            html = render()
+            put(page, user_uk, token, html)
+        resp = Response(html, mimetype="text/html")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"  # browsers revalidate every visit
+    return resp
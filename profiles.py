@@ -0,0 +1,59 @@
+# profiles.py
+"""
+Signed-in user for routes and templates:
+- the session cookie carries only user_uk; the profile row is cached per worker for PROFILE_TTL seconds
+- User is a __slots__ object without the password hash, so templates keep writing user.company etc.
+- cookies issued before the slim session (session["user"] = full row) are upgraded on first use
+"""
+
+import os, threading, time
+
+PROFILE_TTL = int(os.getenv("PROFILE_TTL", "300"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+_lock = threading.Lock()
+_profiles = {}  # user_uk -> (expires_at, User)
+
+class User:
+    """Profile of a signed-in user (every users column except the password hash)."""
+    __slots__ = ("id", "user_uk", "username", "nodal_person", "designation", "company", "phone", "email", "created_at")
+
+    def __init__(self, row):
+        keys = row.keys()
+        for name in self.__slots__:
+            setattr(self, name, row[name] if name in keys else None)
+
+def session_user_uk(session):
+    """user_uk of the signed-in user, or None; rewrites a legacy full-row cookie to the slim form."""
+    user_uk = session.get("user_uk")
+    if user_uk is None and isinstance(session.get("user"), dict):
+        user_uk = session.pop("user").get("user_uk")
+        if user_uk:
+            session["user_uk"] = user_uk
+    return user_uk
+
+def get_user(repo, user_uk):
+    """Cached User for user_uk, or None if the account no longer exists."""
+    now = time.monotonic()
+    with _lock:
+        hit = _profiles.get(user_uk)
+        if hit and hit[0] > now:
+            return hit[1]
+    row = repo.get_user_by_uk(user_uk)
+    if row is None:
+        invalidate(user_uk)
+        return None
+    user = User(row)
+    with _lock:
+        _profiles.pop(user_uk, None)
+        _profiles[user_uk] = (now + PROFILE_TTL, user)
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            del _profiles[next(iter(_profiles))]  # oldest insert first
+    return user
+
+def invalidate(user_uk=None):
+    with _lock:
+        if user_uk is None:
+            _profiles.clear()
+        else:
+            _profiles.pop(user_uk, None)
@@ -0,0 +1,434 @@
+# repository.py
+"""
+Storage layer the routes go through instead of raw cursors:
+- Repository holds every query the web app makes, written once in SQL that runs on both SQLite and
+  PostgreSQL (qmark parameters, ON CONFLICT upserts, row-value comparisons)
+- SQLiteRepository uses db.py's per-thread connection; PostgresRepository borrows connections from a
+  psycopg2 ThreadedConnectionPool, rewrites ? to %s and streams exports through server-side cursors
+- DATABASE_URL=postgresql://... selects Postgres (needs the optional psycopg2 package), otherwise
+  the app keeps using emissions.db
+- `python repository.py copy-to-postgres [url]` creates the Postgres schema and copies emissions.db into it
+"""
+
+import os, re, sqlite3, sys, threading, time, uuid
+from flask import current_app, g
+import db
+import factor_cache
+import page_cache
+from aggregates import cached_aggregates
+from bulk import write_rows
+from emission_inputs import insert_emissions, load_inputs, sync_inputs
+from exports import BATCH_SIZE, export_query, iter_export_rows
+from migrations import apply_migrations
+from rollups import REBUILD_SQL, add_emission, dashboard_summary
+
+DB = "emissions.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+
+PG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id BIGSERIAL PRIMARY KEY,
+    user_uk TEXT UNIQUE, username TEXT UNIQUE, password TEXT,
+    nodal_person TEXT, designation TEXT, company TEXT, phone TEXT, email TEXT UNIQUE, created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS emission_factors (
+    id BIGSERIAL PRIMARY KEY,
+    process_code TEXT UNIQUE, process_desc TEXT, scope TEXT, unit TEXT, factor DOUBLE PRECISION DEFAULT 0,
+    calc_type TEXT DEFAULT 'single', last_updated TEXT
+);
+CREATE TABLE IF NOT EXISTS emissions (
+    id BIGSERIAL PRIMARY KEY,
+    user_uk TEXT, process_code TEXT, process_desc TEXT, scope TEXT, unit TEXT,
+    input_details TEXT, factor_used DOUBLE PRECISION, emission DOUBLE PRECISION, created_at TEXT,
+    activity_value DOUBLE PRECISION
+);
+ALTER TABLE emissions ADD COLUMN IF NOT EXISTS activity_value DOUBLE PRECISION;
+CREATE INDEX IF NOT EXISTS idx_emissions_user_created ON emissions(user_uk, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_emissions_user_scope_proc ON emissions(user_uk, scope, process_code, emission);
+DROP INDEX IF EXISTS idx_emissions_user_month;
+CREATE INDEX IF NOT EXISTS idx_emissions_user_month_cover
+    ON emissions(user_uk, (substr(created_at, 1, 7)), scope, process_code, emission, created_at);
+CREATE TABLE IF NOT EXISTS emission_inputs (
+    emission_id BIGINT NOT NULL REFERENCES emissions(id) ON DELETE CASCADE, position INTEGER NOT NULL,
+    input_key TEXT, question TEXT, value_text TEXT, value_num DOUBLE PRECISION,
+    PRIMARY KEY (emission_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_emission_inputs_key ON emission_inputs(input_key, emission_id);
+CREATE TABLE IF NOT EXISTS emission_rollups (
+    user_uk TEXT NOT NULL, scope TEXT NOT NULL DEFAULT '', process_code TEXT NOT NULL DEFAULT '',
+    process_desc TEXT, total_emission DOUBLE PRECISION DEFAULT 0, entry_count BIGINT DEFAULT 0,
+    PRIMARY KEY (user_uk, scope, process_code)
+);
+CREATE TABLE IF NOT EXISTS calc_formulas (
+    process_code TEXT PRIMARY KEY, expression TEXT NOT NULL, updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS app_meta (key TEXT PRIMARY KEY, value BIGINT NOT NULL DEFAULT 0);
+INSERT INTO app_meta (key, value) VALUES ('factors_version', 1) ON CONFLICT (key) DO NOTHING;
+CREATE OR REPLACE FUNCTION bump_factors_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE app_meta SET value = value + 1 WHERE key = 'factors_version';
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_factors_version ON emission_factors;
+CREATE TRIGGER trg_factors_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON emission_factors
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_factors_version();
+CREATE TABLE IF NOT EXISTS user_data_versions (user_uk TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0);
+CREATE OR REPLACE FUNCTION bump_user_versions() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_data_versions (user_uk, version)
+        SELECT DISTINCT user_uk, 1 FROM new_rows WHERE user_uk IS NOT NULL
+        ON CONFLICT (user_uk) DO UPDATE SET version = user_data_versions.version + 1;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE user_data_versions SET version = version + 1 WHERE user_uk IN (SELECT user_uk FROM old_rows);
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_user_version_ins ON emissions;
+CREATE TRIGGER trg_user_version_ins AFTER INSERT ON emissions REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_versions();
+DROP TRIGGER IF EXISTS trg_user_version_upd ON emissions;
+CREATE TRIGGER trg_user_version_upd AFTER UPDATE ON emissions REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_versions();
+DROP TRIGGER IF EXISTS trg_user_version_del ON emissions;
+CREATE TRIGGER trg_user_version_del AFTER DELETE ON emissions REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_user_versions();
+CREATE TABLE IF NOT EXISTS import_sheets (
+    sheet TEXT PRIMARY KEY, sheet_hash TEXT, calc_hash TEXT, row_count INTEGER, imported_at TEXT, codes TEXT
+);
+ALTER TABLE import_sheets ADD COLUMN IF NOT EXISTS codes TEXT;
+CREATE TABLE IF NOT EXISTS import_ledger (
+    sheet TEXT NOT NULL, row_key TEXT NOT NULL, row_hash TEXT NOT NULL,
+    emission_id BIGINT, imported_at TEXT, retired_at TEXT,
+    PRIMARY KEY (sheet, row_key)
+);
+CREATE INDEX IF NOT EXISTS idx_import_ledger_emission ON import_ledger(emission_id);
+CREATE TABLE IF NOT EXISTS factor_versions (
+    id BIGSERIAL PRIMARY KEY,
+    process_code TEXT NOT NULL, factor DOUBLE PRECISION NOT NULL,
+    effective_from TEXT NOT NULL, effective_to TEXT,
+    source TEXT, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_factor_versions_code ON factor_versions(process_code, effective_from);
+"""
+
+# tables copy-to-postgres moves (rollups are rebuilt, app_meta is bumped by the factor trigger)
+COPY_TABLES = ["users", "emission_factors", "emissions", "emission_inputs", "calc_formulas", "import_sheets", "import_ledger",
+               "factor_versions"]
+
+_QMARK = re.compile(r"'[^']*'|\?")
+
+def is_postgres(target):
+    return target.startswith(("postgres://", "postgresql://"))
+
+def to_pyformat(sql):
+    """qmark SQL -> psycopg2 %s SQL (literal % doubled, ? inside string literals left alone)."""
+    return _QMARK.sub(lambda m: "%s" if m.group(0) == "?" else m.group(0), sql.replace("%", "%%"))
+
+class PgCursor:
+    """psycopg2 cursor that takes the qmark SQL shared with SQLite."""
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    _sql = None
+
+    def execute(self, sql, params=None):
+        self._sql, t0 = sql, time.perf_counter()
+        try:
+            if params is None:
+                self._cur.execute(sql)
+            else:
+                self._cur.execute(to_pyformat(sql), tuple(params))
+        finally:
+            if db.QUERY_HOOKS:
+                db.report_query(sql, t0)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        from psycopg2.extras import execute_batch
+        self._sql, t0 = sql, time.perf_counter()
+        try:
+            execute_batch(self._cur, to_pyformat(sql), [tuple(p) for p in seq_of_params], page_size=500)
+        finally:
+            if db.QUERY_HOOKS:
+                db.report_query(sql, t0)
+        return self
+
+    def _fetch(self, method, *args):
+        t0 = time.perf_counter()
+        try:
+            return getattr(self._cur, method)(*args)
+        finally:
+            if db.QUERY_HOOKS:
+                db.report_query(self._sql, t0, "fetch")
+
+    def fetchone(self):
+        return self._fetch("fetchone")
+
+    def fetchmany(self, size=None):
+        return self._fetch("fetchmany", *([] if size is None else [size]))
+
+    def fetchall(self):
+        return self._fetch("fetchall")
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+class Repository:
+    """Every query the app makes; subclasses supply the connection and dialect details."""
+    IntegrityError = sqlite3.IntegrityError
+    OperationalError = sqlite3.OperationalError
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def begin(self):
+        """Open a write transaction explicitly (Postgres opens one on the first statement anyway)."""
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    # --- users ---
+    def create_user(self, user_uk, username, password, nodal_person, designation, company, phone, email, created_at):
+        self.cursor().execute("""
+            INSERT INTO users (user_uk, username, password, nodal_person, designation, company, phone, email, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_uk, username, password, nodal_person, designation, company, phone, email, created_at))
+
+    def get_user(self, username):
+        cur = self.cursor()
+        cur.execute("SELECT * FROM users WHERE username = ?", (username,))
+        return cur.fetchone()
+
+    def get_user_by_uk(self, user_uk):
+        cur = self.cursor()
+        cur.execute("""
+            SELECT id, user_uk, username, nodal_person, designation, company, phone, email, created_at
+            FROM users WHERE user_uk = ?
+        """, (user_uk,))
+        return cur.fetchone()
+
+    # --- factors (served from factor_cache) ---
+    def processes(self):
+        return factor_cache.processes(self.cursor())
+
+    def get_factor(self, process_code):
+        return factor_cache.get_factor(self.cursor(), process_code)
+
+    def factors_by_code(self):
+        return factor_cache.factors_by_code(self.cursor())
+
+    # --- versions (page / aggregate cache validation) ---
+    def data_version(self, user_uk):
+        return page_cache.data_version(self.cursor(), user_uk)
+
+    def factors_version(self):
+        return factor_cache.factors_version(self.cursor())
+
+    # --- emissions ---
+    def recent_emissions(self, user_uk, limit=10):
+        cur = self.cursor()
+        cur.execute("""
+            SELECT id, process_code, process_desc, scope, unit, input_details, factor_used, emission, created_at
+            FROM emissions
+            WHERE user_uk = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (user_uk, limit))
+        return cur.fetchall()
+
+    def entries_page(self, user_uk, after=None, limit=50):
+        """Up to limit rows older than the (created_at, id) key after, newest first."""
+        cur = self.cursor()
+        cur.execute(f"""
+            SELECT id, created_at, process_desc, scope, unit, input_details, emission
+            FROM emissions
+            WHERE user_uk = ? {"AND (created_at, id) < (?, ?)" if after else ""}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        """, (user_uk, *(after or ()), limit))
+        return cur.fetchall()
+
+    def add_emission(self, user_uk, factor_row, input_details_json, factor, emission, created_at):
+        """Insert one calculator entry and fold it into the rollups (caller commits)."""
+        code, desc, scope = factor_row["process_code"], factor_row["process_desc"], factor_row["scope"]
+        cur = self.cursor()
+        insert_emissions(cur, [(user_uk, code, desc, scope, factor_row["unit"], input_details_json, factor, emission, created_at)])
+        add_emission(cur, user_uk, code, desc, scope, emission)
+
+    def add_rows(self, user_uk, rows):
+        """Write rows already computed by bulk.compute_rows() (caller commits)."""
+        return write_rows(self.cursor(), user_uk, rows)
+
+    def inputs_for(self, ids):
+        """{emission_id: [(question, value_text, value_num), ...]} from emission_inputs."""
+        return load_inputs(self.cursor(), ids)
+
+    def dashboard_summary(self, user_uk, top_n=5):
+        return dashboard_summary(self.cursor(), user_uk, top_n)
+
+    def aggregates(self, user_uk, granularity, start=None, end=None, scope=None):
+        """Time-bucketed totals (aggregates.py), cached until the user's next write."""
+        return cached_aggregates(self.cursor(), user_uk, granularity, start, end, scope)
+
+    def export_cursor(self, user_uk, filters):
+        """Executed cursor over a user's export rows."""
+        cur = self.cursor()
+        cur.execute(*export_query(user_uk, **filters))
+        return cur
+
+    def export_batches(self, user_uk, filters):
+        """Export rows in EXPORT_COLUMNS order, a batch at a time (exports.iter_export_rows)."""
+        return iter_export_rows(self.export_cursor(user_uk, filters), self.cursor())
+
+class SQLiteRepository(Repository):
+
+    def begin(self):
+        self.conn.execute("BEGIN IMMEDIATE")  # take the write lock now, not at the first INSERT
+
+class PostgresRepository(Repository):
+    """Repository over a psycopg2 connection, returned to its pool on close()."""
+
+    def __init__(self, conn, pool=None):
+        import psycopg2
+        super().__init__(conn)
+        self.pool = pool
+        self.IntegrityError = psycopg2.IntegrityError
+        self.OperationalError = psycopg2.OperationalError
+
+    def cursor(self):
+        from psycopg2.extras import DictCursor
+        return PgCursor(self.conn.cursor(cursor_factory=DictCursor))
+
+    def export_cursor(self, user_uk, filters):
+        # named cursor = server-side: rows arrive itersize at a time instead of all at execute()
+        from psycopg2.extras import DictCursor
+        cur = self.conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=DictCursor)
+        cur.itersize = BATCH_SIZE
+        sql, params = export_query(user_uk, **filters)
+        cur.execute(to_pyformat(sql), tuple(params))
+        return cur
+
+    def close(self):
+        if self.pool is None:
+            self.conn.close()
+            return
+        if not self.conn.closed:
+            self.conn.rollback()  # never hand a pooled connection back mid-transaction
+        self.pool.putconn(self.conn, close=bool(self.conn.closed))
+
+# --- Postgres pool (one per worker process, created on first use so it is never shared across a fork) ---
+_pools = {}
+_pool_lock = threading.Lock()
+
+def _pg_pool(url):
+    with _pool_lock:
+        pool = _pools.get(url)
+        if pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            pool = _pools[url] = ThreadedConnectionPool(PG_POOL_MIN, PG_POOL_MAX, url)
+        return pool
+
+def _pg_connect(url):
+    import psycopg2
+    return psycopg2.connect(url)
+
+def open_repository(target):
+    """Standalone repository with its own connection (threads, scripts, streamed responses); call close()."""
+    if is_postgres(target):
+        return PostgresRepository(_pg_connect(target))
+    return SQLiteRepository(db.connect(target))
+
+def get_repo():
+    """The repository bound to the current request."""
+    if "repo" not in g:
+        target = current_app.config["DATABASE"]
+        if is_postgres(target):
+            pool = _pg_pool(target)
+            g.repo = PostgresRepository(pool.getconn(), pool)
+        else:
+            g.repo = SQLiteRepository(db.get_db())
+    return g.repo
+
+def release_repo(exc=None):
+    repo = g.pop("repo", None)
+    if isinstance(repo, PostgresRepository):
+        repo.close()  # SQLite connections stay with their thread, db.release_db() handles them
+
+def init_schema(target):
+    """Bring the configured database up to the schema this app expects."""
+    if is_postgres(target):
+        conn = _pg_connect(target)
+        with conn, conn.cursor() as cur:
+            cur.execute(PG_SCHEMA)
+        conn.close()
+    else:
+        conn = db.connect(target)
+        apply_migrations(conn)
+        conn.close()
+
+def init_app(app, sqlite_path):
+    """Use DATABASE_URL when set, else the SQLite file; registers per-request teardown."""
+    db.init_app(app, sqlite_path)
+    app.config["DATABASE"] = DATABASE_URL or sqlite_path
+    app.teardown_appcontext(release_repo)
+
+def copy_to_postgres(sqlite_path, url):
+    """Create the Postgres schema and replace its contents with the SQLite database's tables."""
+    from psycopg2.extras import execute_values
+    src = sqlite3.connect(sqlite_path)
+    dst = _pg_connect(url)
+    counts = {}
+    with dst, dst.cursor() as cur:
+        cur.execute(PG_SCHEMA)
+        cur.execute(f"TRUNCATE {', '.join(COPY_TABLES)}, emission_rollups RESTART IDENTITY")
+        for table in COPY_TABLES:
+            if not src.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone():
+                continue
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+            pg_cols = {r[0] for r in cur.fetchall()}
+            src_cur = src.execute(f"SELECT * FROM {table}")
+            cols = [d[0] for d in src_cur.description if d[0] in pg_cols]
+            idx = [i for i, d in enumerate(src_cur.description) if d[0] in pg_cols]
+            counts[table] = 0
+            while True:
+                rows = src_cur.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                execute_values(cur, f"INSERT INTO {table} ({', '.join(cols)}) VALUES %s",
+                               [tuple(r[i] for i in idx) for r in rows])
+                counts[table] += len(rows)
+            if "id" in cols:
+                cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}")
+        counts["emission_inputs"] = counts.get("emission_inputs", 0) + sync_inputs(PgCursor(cur))
+        cur.execute(REBUILD_SQL)
+        counts["emission_rollups"] = cur.rowcount
+    dst.close(); src.close()
+    return counts
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "copy-to-postgres":
+        url = sys.argv[2] if len(sys.argv) > 2 else DATABASE_URL
+        if not is_postgres(url):
+            print("❌ Give a postgresql:// URL (argument or DATABASE_URL).")
+            sys.exit(1)
+        for table, n in copy_to_postgres(DB, url).items():
+            print(f"✅ {table}: {n} rows")
+    else:
+        print("Usage: python repository.py copy-to-postgres [postgresql://...]")
@@ -0,0 +1,100 @@
+# rollups.py
+"""
+Per-user emission rollups used by the dashboard:
+- emission_rollups keeps one row per (user_uk, scope, process_code)
+- writers call add_emission()/add_emissions() in the same transaction as the emissions INSERT
+- dashboard_summary() reads total, per-scope split and top processes from the rollup rows
+- `python rollups.py` rebuilds the table from emissions for existing databases
+"""
+
+import sqlite3
+
+DB = "emissions.db"
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS emission_rollups (
+    user_uk TEXT NOT NULL, scope TEXT NOT NULL DEFAULT '', process_code TEXT NOT NULL DEFAULT '',
+    process_desc TEXT, total_emission REAL DEFAULT 0, entry_count INTEGER DEFAULT 0,
+    PRIMARY KEY (user_uk, scope, process_code)
+);
+"""
+
+UPSERT_SQL = """
+    INSERT INTO emission_rollups (user_uk, scope, process_code, process_desc, total_emission, entry_count)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_uk, scope, process_code) DO UPDATE SET
+        process_desc=excluded.process_desc,
+        total_emission=emission_rollups.total_emission + excluded.total_emission,
+        entry_count=emission_rollups.entry_count + excluded.entry_count
+"""
+
+REBUILD_SQL = """
+    INSERT INTO emission_rollups (user_uk, scope, process_code, process_desc, total_emission, entry_count)
+    SELECT user_uk, COALESCE(scope, ''), COALESCE(process_code, ''), MAX(process_desc), SUM(emission), COUNT(*)
+    FROM emissions
+    WHERE user_uk IS NOT NULL
+    GROUP BY user_uk, COALESCE(scope, ''), COALESCE(process_code, '')
+"""
+
+def create_rollup_table(conn):
+    conn.executescript(ROLLUP_SCHEMA)
+
+def add_emission(cur, user_uk, process_code, process_desc, scope, emission):
+    """Fold a single new emissions row into the rollups (caller commits)."""
+    cur.execute(UPSERT_SQL, (user_uk, scope or "", process_code or "", process_desc, float(emission or 0.0), 1))
+
+def add_emissions(cur, rows):
+    """Fold many (user_uk, process_code, process_desc, scope, emission) rows, one upsert per key."""
+    totals = {}
+    for user_uk, code, desc, scope, emission in rows:
+        key = (user_uk, scope or "", code or "")
+        t = totals.setdefault(key, [desc, 0.0, 0])
+        t[0] = desc; t[1] += float(emission or 0.0); t[2] += 1
+    cur.executemany(UPSERT_SQL, [(u, s, c, d, total, n) for (u, s, c), (d, total, n) in totals.items()])
+
+def rebuild_rollups(conn):
+    """Recompute every rollup row from the emissions table."""
+    cur = conn.cursor()
+    create_rollup_table(conn)
+    cur.execute("DELETE FROM emission_rollups")
+    cur.execute(REBUILD_SQL)
+    conn.commit()
+    return cur.rowcount
+
+def rebuild_user_rollups(cur, user_uk):
+    """Recompute one user's rollup rows (after updates or deletes of their emissions; caller commits)."""
+    cur.execute("DELETE FROM emission_rollups WHERE user_uk = ?", (user_uk,))
+    cur.execute(REBUILD_SQL.replace("WHERE user_uk IS NOT NULL", "WHERE user_uk = ?"), (user_uk,))
+
+def ensure_rollups(conn):
+    """Create the rollup table on databases that predate it and backfill it once."""
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('emissions', 'emission_rollups')")
+    tables = {r[0] for r in cur.fetchall()}
+    if "emission_rollups" in tables:
+        return
+    if "emissions" in tables:
+        rebuild_rollups(conn)
+    else:
+        create_rollup_table(conn)
+        conn.commit()
+
+def dashboard_summary(cur, user_uk, top_n=5):
+    """Return (total_emission, scope_data, [(process_desc, emission), ...top_n])."""
+    cur.execute("""
+        SELECT scope, SUM(total_emission) FROM emission_rollups
+        WHERE user_uk = ? GROUP BY scope
+    """, (user_uk,))
+    scope_data = {r[0]: float(r[1] or 0.0) for r in cur.fetchall()}
+    cur.execute("""
+        SELECT process_desc, SUM(total_emission) AS e FROM emission_rollups
+        WHERE user_uk = ? GROUP BY process_desc ORDER BY e DESC LIMIT ?
+    """, (user_uk, top_n))
+    top = [(r[0], float(r[1] or 0.0)) for r in cur.fetchall()]
+    return sum(scope_data.values()), scope_data, top
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB)
+    n = rebuild_rollups(conn)
+    conn.close()
+    print(f"✅ emission_rollups rebuilt: {n} rows")
@@ -0,0 +1,71 @@
+# test_aggregates.py
+"""
+/api/aggregates bucketing: calendar months (widened to whole months, empty ones listed as 0),
+fiscal years starting in April (FY2025-26 = 2025-04 .. 2026-03), days, and the cache following the
+user's next write.
+"""
+
+import json, sqlite3
+import pytest
+from aggregates import FISCAL_YEAR_START_MONTH, fiscal_year, fy_label
+from emission_inputs import insert_emissions
+
+pytestmark = pytest.mark.skipif(FISCAL_YEAR_START_MONTH != 4, reason="expects the default April fiscal year")
+
+ROWS = [  # (created_at, scope, process_code, emission)
+    ("2025-03-31 23:59:59", "Scope_1", "DG_CONS_EM", 1.0),
+    ("2025-04-01 00:00:00", "Scope_1", "DG_CONS_EM", 2.0),
+    ("2025-04-15 12:00:00", "Scope_2", "ELECT_EM", 4.0),
+    ("2025-06-30 08:00:00", "Scope_1", "LPG_CONS_EM", 8.0),
+    ("2026-03-01 00:00:00", "Scope_1", "DG_CONS_EM", 16.0),
+    ("2026-04-02 00:00:00", "Scope_1", "DG_CONS_EM", 32.0),
+]
+
+def _add(database, user_uk, rows):
+    conn = sqlite3.connect(database)
+    insert_emissions(conn.cursor(), [(user_uk, code, f"Emission from {code}", scope, "", json.dumps({}), 1.0, emission, at)
+                                     for at, scope, code, emission in rows])
+    conn.commit()
+    conn.close()
+
+@pytest.fixture
+def emissions(client, database):
+    _add(database, client.user_uk, ROWS)
+    _add(database, "someone-else", ROWS)
+
+def _buckets(client, query):
+    r = client.get("/api/aggregates?" + query)
+    assert r.status_code == 200, r.get_json()
+    return {b["bucket"]: (b["total"], b["entries"]) for b in r.get_json()["buckets"]}
+
+def test_fiscal_year_boundaries():
+    assert [fiscal_year(2025, m) for m in (1, 3, 4, 12)] == [2024, 2024, 2025, 2025]
+    assert fy_label(2025) == "FY2025-26" and fy_label(1999) == "FY1999-00"
+    assert fiscal_year(2025, 1, start_month=1) == 2025 and fy_label(2025, start_month=1) == "FY2025"
+
+def test_fy_buckets(client, emissions):
+    assert _buckets(client, "granularity=fy") == {
+        "FY2024-25": (1.0, 1), "FY2025-26": (30.0, 4), "FY2026-27": (32.0, 1)}
+    # a range is widened to whole fiscal years
+    assert _buckets(client, "granularity=fy&start=2025-05-01&end=2025-05-31") == {"FY2025-26": (30.0, 4)}
+
+def test_month_buckets_list_empty_months(client, emissions):
+    assert _buckets(client, "granularity=month&start=2025-03-31&end=2025-07-01") == {
+        "2025-03": (1.0, 1), "2025-04": (6.0, 2), "2025-05": (0.0, 0), "2025-06": (8.0, 1), "2025-07": (0.0, 0)}
+    months = _buckets(client, "granularity=month")
+    assert len(months) == 14 and min(months) == "2025-03" and max(months) == "2026-04"
+    assert _buckets(client, "granularity=month&start=2025-04-01&end=2025-04-30&scope=Scope_2") == {"2025-04": (4.0, 1)}
+
+def test_day_buckets(client, emissions):
+    assert _buckets(client, "granularity=day&start=2025-03-31&end=2025-04-02") == {
+        "2025-03-31": (1.0, 1), "2025-04-01": (2.0, 1), "2025-04-02": (0.0, 0)}
+
+def test_cached_result_follows_the_next_write(client, database, emissions):
+    assert _buckets(client, "granularity=fy")["FY2026-27"] == (32.0, 1)
+    _add(database, client.user_uk, [("2026-05-01 00:00:00", "Scope_1", "DG_CONS_EM", 64.0)])
+    assert _buckets(client, "granularity=fy")["FY2026-27"] == (96.0, 2)
+
+@pytest.mark.parametrize("query", ["granularity=week", "start=2025-13-01", "start=2025-05-01&end=2025-04-01",
+                                   "granularity=day&start=2020-01-01&end=2025-01-01"])
+def test_bad_requests_are_400(client, query):
+    assert client.get("/api/aggregates?" + query).status_code == 400
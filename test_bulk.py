@@ -0,0 +1,81 @@
+# test_bulk.py
+"""
+Bulk submission (/api/emissions/bulk): per-record validation errors, partial inserts by default,
+all-or-nothing with ?atomic=1, and CSV uploads.
+"""
+
+import io, sqlite3
+import pytest
+import bulk
+
+GOOD = [{"process_code": "DG_CONS_EM", "inputs": {"Fuel_cons": "100"}},
+        {"process_code": "LPG_CONS_EM", "inputs": {"LPG_no": 3, "Weight_LPG": "14.2"}}]
+BAD = [
+    ({"inputs": {"Fuel_cons": 1}}, "Missing process_code."),
+    ({"process_code": "NOPE_EM", "inputs": {}}, "Unknown process_code 'NOPE_EM'."),
+    ({"process_code": "AC_R32_EM", "inputs": {}}, "No emission factor configured for 'AC_R32_EM'."),
+    ({"process_code": "DG_CONS_EM", "inputs": ["100"]}, "'inputs' must be an object of question key -> value."),
+    ({"process_code": "DG_CONS_EM", "inputs": {"Fuel_cons": 1, "Litres": 2}}, "Unknown input key(s) for DG_CONS_EM: Litres."),
+    ("DG_CONS_EM", "Missing process_code."),
+]
+
+def _stored(database, user_uk):
+    conn = sqlite3.connect(database)
+    try:
+        rows = conn.execute("SELECT process_code, factor_used, emission FROM emissions WHERE user_uk = ? ORDER BY id",
+                            (user_uk,)).fetchall()
+        rollup = conn.execute("SELECT round(SUM(total_emission), 6), SUM(entry_count) FROM emission_rollups WHERE user_uk = ?",
+                              (user_uk,)).fetchone()
+    finally:
+        conn.close()
+    return rows, rollup
+
+def test_partial_insert_reports_each_bad_record(client, database):
+    records = [GOOD[0]] + [rec for rec, _ in BAD] + [GOOD[1]]
+    r = client.post("/api/emissions/bulk", json={"records": records})
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body["inserted"] == 2
+    results = body["results"]
+    assert [res["status"] for res in results] == ["ok"] + ["error"] * len(BAD) + ["ok"]
+    assert [res["error"] for res in results[1:-1]] == [error for _, error in BAD]
+    assert [res["index"] for res in results] == list(range(len(records)))
+    assert results[0]["emission"] == pytest.approx(268.0)
+    assert results[-1]["activity_value"] == pytest.approx(42.6)
+    rows, rollup = _stored(database, client.user_uk)
+    assert [r[0] for r in rows] == ["DG_CONS_EM", "LPG_CONS_EM"]  # submission order
+    assert rollup == (pytest.approx(268.0 + 42.6 * 2.94), 2)
+
+def test_atomic_rejects_the_whole_batch(client, database):
+    records = GOOD + [BAD[1][0]]
+    r = client.post("/api/emissions/bulk?atomic=1", json={"records": records})
+    assert r.status_code == 400
+    body = r.get_json()
+    assert body["inserted"] == 0
+    assert [res["status"] for res in body["results"]] == ["skipped", "skipped", "error"]
+    assert _stored(database, client.user_uk) == ([], (None, None))
+
+def test_atomic_inserts_when_every_record_is_valid(client, database):
+    r = client.post("/api/emissions/bulk?atomic=true", json=GOOD)  # a bare list works too
+    assert (r.status_code, r.get_json()["inserted"]) == (200, 2)
+    assert len(_stored(database, client.user_uk)[0]) == 2
+
+def test_csv_upload(client, database):
+    csv = "process_code,Fuel_cons\nDG_CONS_EM,10\nDG_CONS_EM,\nNOPE_EM,3\n"
+    r = client.post("/api/emissions/bulk", data={"file": (io.BytesIO(csv.encode()), "rows.csv")},
+                    content_type="multipart/form-data")
+    body = r.get_json()
+    assert body["inserted"] == 2
+    assert [res["status"] for res in body["results"]] == ["ok", "ok", "error"]
+    assert [row[2] for row in _stored(database, client.user_uk)[0]] == [pytest.approx(26.8), 0.0]
+
+@pytest.mark.parametrize("payload", [{"records": 5}, {"rows": []}, "text"])
+def test_bad_payload_is_400(client, payload):
+    r = client.post("/api/emissions/bulk", json=payload)
+    assert r.status_code == 400 and "error" in r.get_json()
+
+def test_too_many_records_is_400(client, monkeypatch):
+    monkeypatch.setattr(bulk, "MAX_BULK_RECORDS", 2)
+    r = client.post("/api/emissions/bulk", json=GOOD + GOOD)
+    assert r.status_code == 400
+    assert "limit is 2" in r.get_json()["error"]
@@ -0,0 +1,34 @@
+# test_calc_engine.py
+"""
+calc_engine.Plan: compute_batch() over columns of records gives, record for record, what compute()
+gives for each one, for every process in PROCESS_QUESTIONS plus a question-less code.
+"""
+
+import math, random
+import pytest
+from calc_engine import PLANS, get_plan
+
+VALUES = ["12", "3.5 kg", "", None, "abc", "0", "1,200", 7, 0, "-4", "2e3", " 8 ", "n/a 5"]
+
+def _records(plan, n=60, seed=7):
+    rng = random.Random(seed)
+    records = []
+    for _ in range(n):
+        record = {}
+        for key in plan.input_keys:
+            if rng.random() < 0.8:  # some keys left out of the submission entirely
+                record[key] = rng.choice(VALUES)
+        records.append(record)
+    return records
+
+@pytest.mark.parametrize("code", sorted(PLANS) + ["NO_QUESTIONS_EM"])
+def test_compute_batch_matches_compute(code):
+    plan = get_plan(code)
+    records = _records(plan)
+    batch = plan.compute_batch({k: [r.get(k) for r in records] for k in plan.input_keys})
+    for record, value in zip(records, batch.tolist()):
+        expected = plan.compute(record)
+        if expected is None:  # question-less process without a numeric quantity
+            assert math.isnan(value), record
+        else:
+            assert value == expected, record
@@ -0,0 +1,50 @@
+# test_export_jobs.py
+"""
+Export job store (jobs.JobStore via export_jobs.py): eviction drops finished jobs only, and
+concurrent first submits share one thread pool.
+"""
+
+import os, threading, time
+import export_jobs
+from jobs import JobStore
+
+def _store(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path), 1, "test")
+    monkeypatch.setattr(export_jobs, "EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(export_jobs, "_jobs", store)
+    return store
+
+def _job(store, status, age, now):
+    job = store.create(user_uk="u", format="xlsx", rows=None, filters={})
+    if status != "queued":
+        store.finish(job, status=status)
+    os.utime(store.status_path(job["id"]), (now - age, now - age))
+    return job["id"]
+
+def test_evict_keeps_unfinished_jobs(tmp_path, monkeypatch):
+    store = _store(tmp_path, monkeypatch)
+    monkeypatch.setattr(export_jobs, "EXPORT_MAX_JOBS", 1)
+    now = time.time()
+    old_done = _job(store, "done", export_jobs.EXPORT_TTL + 10, now)
+    old_queued = _job(store, "queued", export_jobs.EXPORT_TTL + 10, now)
+    stale = _job(store, "running", export_jobs.EXPORT_STALE + 10, now)
+    done = [_job(store, "done", age, now) for age in (30, 20, 10)]
+    assert export_jobs.evict_expired(now) == 4
+    assert {f[:-5] for f in os.listdir(tmp_path)} == {old_queued, done[-1]}
+    assert store.get(stale) is None and store.get(old_done) is None
+
+def test_first_submits_share_one_pool(tmp_path):
+    store = JobStore(str(tmp_path), 2, "test")
+    barrier = threading.Barrier(8)
+    pools = []
+
+    def submit():
+        barrier.wait()
+        store.submit(lambda: None).result()
+        pools.append(store._pool)
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(p) for p in pools}) == 1
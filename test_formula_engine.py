@@ -0,0 +1,64 @@
+# test_formula_engine.py
+"""
+formula_engine: the AST whitelist rejects everything but numbers, + - * /, unary signs,
+row.get('key', number) and `or`; evaluate_columns() gives what calling the Formula per row gives.
+"""
+
+import numpy as np
+import pytest
+from formula_engine import FormulaError, compile_formula
+
+@pytest.mark.parametrize("source", [
+    "row.__class__",                          # attribute access
+    "row.keys",
+    "row.get('a', 0).real",
+    "__import__('os').system('true')",        # calls other than row.get
+    "abs(row.get('a', 0))",
+    "row.pop('a', 0)",
+    "other.get('a', 0)",
+    "row.get('a', 0, 1)",
+    "row.get('a', default=0)",
+    "row.get(key, 0)",
+    "row.get('a', row.get('b', 0))",
+    "row.get('a', 'x')",
+    "__builtins__",                           # dunder / bare names
+    "row",
+    "lambda: 1",                              # lambdas
+    "(lambda r: r)(row)",
+    "row.get('a', 0) ** 2",                   # operators outside the whitelist
+    "row.get('a', 0) // 2",
+    "row.get('a', 0) and 1",
+    "row.get('a', 0) if 1 else 0",
+    "[1][0]",
+    "'text'",
+    "True",
+    "1 +",                                    # not Python at all
+])
+def test_rejects_outside_whitelist(source):
+    with pytest.raises(FormulaError):
+        compile_formula(source)
+
+ROWS = [
+    {"a": 2.0, "b": 3.0, "c": 0.0},
+    {"a": 0.0, "b": 5.0, "c": 4.0},
+    {"a": -1.5, "b": 0.0, "c": 0.0},
+    {"a": float("nan"), "b": 1.0, "c": 2.0},
+    {"a": 0.0, "b": 0.0, "c": 0.0},
+]
+
+@pytest.mark.parametrize("source", [
+    "3",
+    "-2.5",
+    "row.get('a', 0) * row.get('b', 0)",
+    "row.get('a', 0) + row.get('missing', 7) - -row.get('c', 0)",
+    "row.get('a', 0) / row.get('b', 0)",       # division by zero gives 0.0 on that row
+    "row.get('b', 0) / (row.get('a', 0) - row.get('a', 0))",
+    "row.get('a', 0) or row.get('c', 0) or row.get('b', 1)",
+    "(row.get('a', 0) or 10) * +row.get('b', 0)",
+    "row.get('missing', 0) or 4",
+])
+def test_evaluate_columns_matches_call(source):
+    formula = compile_formula(source)
+    columns = {k: np.array([r[k] for r in ROWS]) for k in ROWS[0]}
+    expected = [formula(row) for row in ROWS]
+    np.testing.assert_array_equal(formula.evaluate_columns(columns, len(ROWS)), np.array(expected))
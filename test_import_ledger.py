@@ -0,0 +1,163 @@
+# test_import_ledger.py
+"""
+Incremental workbook import (init_db.py --incremental) against a database built before the import
+ledger existed: the untracked workbook rows are replaced once, never duplicated, whether the factor
+sync or import_excel.py has ledgered factor rows first; and ledger rows keep the ids SQLite actually
+assigned after retirements. Runs on copies in a temp dir.
+"""
+
+import os, sqlite3
+import pytest
+import init_db
+import import_ledger
+import factor_versions
+import import_excel
+from workbook import open_workbook
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXCEL = os.path.join(HERE, "Master Calculation.xlsx")
+
+pytestmark = pytest.mark.skipif(not os.path.exists(EXCEL), reason="needs Master Calculation.xlsx")
+
+def _import(incremental):
+    conn = init_db.open_db_in_place() if incremental else init_db.recreate_db()
+    book = open_workbook(init_db.EXCEL)
+    try:
+        factors_map = init_db.load_factors_sheet(book)
+        init_db.insert_factors_to_db(conn, factors_map)
+        init_db.compute_and_insert_emissions(conn, factors_map, book, workers=1, incremental=incremental)
+    finally:
+        book.close()
+        conn.close()
+
+def _state(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("""
+            SELECT process_code, scope, unit, input_details, factor_used, round(emission, 9)
+            FROM emissions WHERE user_uk = ? ORDER BY 1, 4
+        """, (init_db.WORKBOOK_USER,)).fetchall()
+        rollups = conn.execute("""
+            SELECT scope, process_code, round(total_emission, 6), entry_count FROM emission_rollups
+            WHERE user_uk = ? ORDER BY 1, 2
+        """, (init_db.WORKBOOK_USER,)).fetchall()
+        ledgered = conn.execute("""
+            SELECT COUNT(*) FROM import_ledger l JOIN emissions e ON e.id = l.emission_id
+            WHERE l.retired_at IS NULL
+        """).fetchone()[0]
+    finally:
+        conn.close()
+    return rows, rollups, ledgered
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.setattr(init_db, "EXCEL", EXCEL)
+    monkeypatch.setattr(init_db, "DB", str(tmp_path / "full.db"))
+    _import(incremental=False)
+    monkeypatch.setattr(init_db, "DB", str(tmp_path / "legacy.db"))
+    return tmp_path
+
+def _legacy_db(path):
+    """A DB as the pre-ledger init_db left it: base tables and the workbook rows, no migrations."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_uk TEXT UNIQUE, username TEXT UNIQUE, password TEXT,
+        nodal_person TEXT, designation TEXT, company TEXT, phone TEXT, email TEXT UNIQUE, created_at TEXT
+    );
+    CREATE TABLE emission_factors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        process_code TEXT UNIQUE, process_desc TEXT, scope TEXT, unit TEXT, factor REAL DEFAULT 0,
+        calc_type TEXT DEFAULT 'single', last_updated TEXT
+    );
+    CREATE TABLE emissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_uk TEXT, process_code TEXT, process_desc TEXT, scope TEXT, unit TEXT,
+        input_details TEXT, factor_used REAL, emission REAL, created_at TEXT
+    );
+    """)
+    conn.execute("ATTACH DATABASE ? AS full", (str(path.parent / "full.db"),))
+    conn.execute("INSERT INTO emission_factors SELECT id, process_code, process_desc, scope, unit, factor, calc_type, last_updated FROM full.emission_factors")
+    conn.execute("""
+        INSERT INTO emissions (user_uk, process_code, process_desc, scope, unit, input_details, factor_used, emission, created_at)
+        SELECT user_uk, process_code, process_desc, scope, unit, input_details, factor_used, emission, created_at FROM full.emissions
+    """)
+    conn.execute("INSERT INTO emissions (user_uk, process_code, scope, emission, input_details, created_at) VALUES ('u1', 'DG_CONS_EM', 'Scope_1', 5, '{}', '2026-01-01')")
+    conn.commit()
+    conn.close()
+
+def test_incremental_adopts_pre_ledger_db(workdir):
+    _legacy_db(workdir / "legacy.db")
+    _import(incremental=True)
+    full = _state(workdir / "full.db")
+    assert _state(workdir / "legacy.db") == full
+    _import(incremental=True)  # nothing changed: a second run is a no-op
+    assert _state(workdir / "legacy.db") == full
+    conn = sqlite3.connect(workdir / "legacy.db")
+    assert conn.execute("SELECT COUNT(*) FROM emissions WHERE user_uk = 'u1'").fetchone()[0] == 1
+    conn.close()
+
+def test_incremental_after_factor_import(workdir, monkeypatch):
+    _legacy_db(workdir / "legacy.db")
+    args = type("Args", (), dict(path=EXCEL, sheet=None, source=None, map=None, skip_bad=False, report=None,
+                                 chunk_rows=import_excel.IMPORT_CHUNK_ROWS, db=init_db.DB))
+    monkeypatch.setattr(import_excel, "EXCEL", EXCEL)
+    assert import_excel.run(args) == 0
+    _import(incremental=True)
+    assert _state(workdir / "legacy.db") == _state(workdir / "full.db")
+
+def _sheet_rows(n, tag=""):
+    return [(init_db.WORKBOOK_USER, "DG_CONS_EM", "Emission from DG_CONS_EM", "Scope_1", "l",
+             f'{{"Row": {i}{tag}}}', 2.0, 2.0 * i) for i in range(1, n + 1)]
+
+def test_ledger_ids_follow_autoincrement(tmp_path, monkeypatch):
+    """Rows inserted after the top ids were retired are ledgered under the ids SQLite gave them."""
+    monkeypatch.setattr(init_db, "DB", str(tmp_path / "ids.db"))
+    conn = init_db.recreate_db()
+    cur = conn.cursor()
+    for rows in (_sheet_rows(3), _sheet_rows(2), _sheet_rows(2) + _sheet_rows(1, ', "new": 1')):
+        job = import_ledger.SheetImport(cur, "S", "2026-01-01 00:00:00")
+        job.add(rows)
+        job.finish()
+        conn.commit()
+    live = cur.execute("""
+        SELECT e.id, e.input_details FROM import_ledger l JOIN emissions e ON e.id = l.emission_id
+        WHERE l.sheet = 'S' AND l.retired_at IS NULL ORDER BY e.id
+    """).fetchall()
+    assert live == [(1, '{"Row": 1}'), (2, '{"Row": 2}'), (4, '{"Row": 1, "new": 1}')]
+    assert cur.execute("SELECT COUNT(*) FROM emissions").fetchone()[0] == 3
+    conn.close()
+
+def _restated(path, code):
+    conn = sqlite3.connect(path)
+    try:
+        factor = conn.execute("SELECT factor FROM emission_factors WHERE process_code = ?", (code,)).fetchone()[0]
+        rows = conn.execute("SELECT input_details, factor_used, round(emission, 9) FROM emissions WHERE process_code = ? ORDER BY 1",
+                            (code,)).fetchall()
+        total = conn.execute("SELECT round(SUM(total_emission), 6) FROM emission_rollups WHERE process_code = ?", (code,)).fetchone()[0]
+    finally:
+        conn.close()
+    return factor, rows, total
+
+def test_factor_versions_survive_reimport(workdir, monkeypatch):
+    """A versioned code keeps its factor, and the workbook rows their restatement, through re-imports and a rebuild."""
+    path = workdir / "full.db"
+    monkeypatch.setattr(init_db, "DB", str(path))
+    conn = sqlite3.connect(path)
+    original = {d: (f, e) for d, f, e in _restated(path, "DG_CONS_EM")[1]}
+    factor_versions.set_version(conn.cursor(), "DG_CONS_EM", 3.0, "2000-01-01")
+    conn.commit()
+    factor_versions.recalculate(conn)
+    # a re-parse that rewrites the rows in place (as after a formula change) must not undo the version
+    conn.execute("UPDATE import_ledger SET row_hash = 'stale' WHERE emission_id IN (SELECT id FROM emissions WHERE process_code = 'DG_CONS_EM')")
+    conn.execute("DELETE FROM import_sheets")
+    conn.commit()
+    conn.close()
+    expected = [(d, 3.0, round(e / f * 3.0, 9)) for d, (f, e) in sorted(original.items())]
+    for incremental in (True, True, False):
+        _import(incremental=incremental)
+        factor, rows, total = _restated(path, "DG_CONS_EM")
+        assert factor == 3.0
+        assert [(d, f, pytest.approx(e)) for d, f, e in rows] == expected
+        assert total == pytest.approx(sum(e for _, _, e in expected))
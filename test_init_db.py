@@ -0,0 +1,76 @@
+# test_init_db.py
+"""
+init_db.compute_sheet (vectorized) against the row-by-row loop it replaced: same emissions rows and
+skipped rows, cell for cell, on small sheets with NaN, blank, text and date cells.
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+import calc_engine
+import init_db
+from init_db import IPCC_FACTORS_BY_CODE, WORKBOOK_USER, parse_number, safe_json_dumps
+
+FACTORS = {
+    "LPG_CONS_EM": {"factor": 2.94, "scope": "Scope_1", "unit": "kg"},
+    "ELECT_EM": {"factor": 0.82, "scope": "Scope_2", "unit": "kWh"},
+    "NO_EF": {"factor": 0.0, "scope": "Scope_1", "unit": "t"},
+}
+
+def _scalar_sheet(sheet, df, factors_map, formulas):
+    """The pre-vectorization iterrows() loop, kept here as the reference."""
+    df.columns = [str(c).strip() for c in df.columns]
+    proc_col = next((c for c in df.columns if 'process' in c.lower()), None)
+    total_col = next((c for c in df.columns if 'total' in c.lower()), None)
+    formula = formulas.get(sheet)
+    rows, skipped = [], []
+    for idx, r in df.iterrows():
+        row = {c: parse_number(r.get(c)) for c in df.columns}
+        row.update({c.lower(): parse_number(r.get(c)) for c in df.columns})
+        code = str(r.get(proc_col)).strip().upper() if proc_col and r.get(proc_col) else sheet
+        factor = factors_map.get(code, {}).get("factor", IPCC_FACTORS_BY_CODE.get(code, 0.0))
+        if factor == 0:
+            skipped.append({"sheet": sheet, "row": idx, "process_code": code, "reason": "no_factor"})
+            continue
+        activity = 0.0
+        if formula:
+            activity = formula(row)
+        elif total_col:
+            activity = parse_number(r.get(total_col))
+        details = {c: (r.get(c).strftime("%Y-%m-%d %H:%M:%S") if isinstance(r.get(c), (datetime, pd.Timestamp)) else r.get(c))
+                   for c in df.columns}
+        rows.append((WORKBOOK_USER, code, f"Emission from {code}", factors_map.get(code, {}).get("scope", "Scope_1"),
+                     factors_map.get(code, {}).get("unit", "varies"), safe_json_dumps(details), factor, activity * factor))
+    return rows, skipped
+
+SHEETS = {
+    # formula sheet: LPG_no * Weight_LPG, codes from the Process column
+    "LPG_CONS_EM": pd.DataFrame({
+        " Process ": ["LPG_CONS_EM", " lpg_cons_em ", np.nan, "", "DG_CONS_EM", "NO_EF", "UNKNOWN", "LPG_CONS_EM"],
+        "LPG_no": [3, "4 cylinders", np.nan, 2, "1,200", 5, 1, ""],
+        "Weight_LPG": [14.2, 14.2, 14.2, "n/a", 2.0, 1.0, 1.0, 19.0],
+        # NaT only on a skipped row: both paths raise on a blank date in a kept row
+        "Date": [datetime(2024, 4, 1), datetime(2024, 4, 2), datetime(2024, 4, 3), datetime(2024, 4, 4),
+                 datetime(2024, 4, 5), pd.NaT, datetime(2024, 4, 7), datetime(2024, 4, 8)],
+        "Remarks": ["ok", np.nan, "", "text only", None, "x", "y", "z"],
+    }),
+    # no formula: the Total column is the activity; no Process column, so every row is the sheet's code
+    "ELECT_EM": pd.DataFrame({
+        "Month": ["Apr", "May", "Jun", np.nan, "Aug"],
+        "Total (kWh)": [120.5, "3.5 units", np.nan, "", "1e3"],
+        "Meter": [1, 2, 3, 4, 5],
+    }),
+    # every cell numeric: iterrows() upcasts the row to float, the vectorized path must too
+    "COMP_EM": pd.DataFrame({"Compost_gen": [1, 2, 0], "Bins": [3, 4, 5]}),
+}
+
+@pytest.mark.parametrize("sheet", sorted(SHEETS))
+def test_compute_sheet_matches_row_loop(sheet):
+    formulas = calc_engine.sheet_formulas()
+    factors_map = dict(FACTORS, COMP_EM={"factor": 0.03, "scope": "Scope_1", "unit": "t"})
+    expected = _scalar_sheet(sheet, SHEETS[sheet].copy(), factors_map, formulas)
+    rows, skipped = init_db.compute_sheet(sheet, SHEETS[sheet].copy(), init_db.factor_frame(factors_map), formulas)
+    assert rows == expected[0]
+    assert skipped == expected[1]
+    assert rows  # the sheets are not all skipped
@@ -0,0 +1,34 @@
+# test_page_cache.py
+"""
+Rendered-page cache: a new build (BUILD_TOKEN) misses both the stored HTML and the browser's ETag.
+"""
+
+import flask
+import page_cache
+
+def _visit(app, etag=None):
+    renders = []
+    headers = {"If-None-Match": etag} if etag else {}
+    with app.test_request_context(headers=headers):
+        resp = page_cache.cached_page("dashboard", "u1", [3], lambda: renders.append(1) or "<p>page</p>")
+    return resp.status_code, resp.get_etag()[0], len(renders)
+
+def test_new_build_invalidates_pages(monkeypatch, tmp_path):
+    app = flask.Flask(__name__)
+    monkeypatch.setattr(page_cache, "PAGE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(page_cache, "BUILD_TOKEN", "build-1")
+    status, etag, renders = _visit(app)
+    assert (status, renders) == (200, 1)
+    assert _visit(app, etag) == (304, etag, 0)
+    assert _visit(app)[2] == 0  # served from the cache
+    monkeypatch.setattr(page_cache, "BUILD_TOKEN", "build-2")
+    status, new_etag, renders = _visit(app, etag)
+    assert (status, renders) == (200, 1) and new_etag != etag
+
+def test_build_token_follows_templates(tmp_path):
+    (tmp_path / "templates").mkdir()
+    page = tmp_path / "templates" / "dashboard.html"
+    page.write_text("<p>v1</p>")
+    before = page_cache.build_token(str(tmp_path))
+    page.write_text("<p>v2</p>")
+    assert page_cache.build_token(str(tmp_path)) != before
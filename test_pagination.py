@@ -0,0 +1,64 @@
+# test_pagination.py
+"""
+Keyset pagination of the dashboard activity log (/dashboard/entries): newest first by
+(created_at, id), every row exactly once across pages, a last page without a cursor, and 400 for a
+cursor the app did not issue.
+"""
+
+import base64, json, sqlite3
+import pytest
+from emission_inputs import insert_emissions
+
+# created_at values with ties, so the id tiebreak decides the order inside a second
+STAMPS = ["2026-01-02 10:00:00", "2026-01-01 09:00:00", "2026-01-02 10:00:00", "2026-01-03 08:00:00",
+          "2026-01-01 09:00:00", "2026-01-02 10:00:00", "2025-12-31 23:59:59"]
+
+def _add(database, user_uk, stamps):
+    conn = sqlite3.connect(database)
+    ids = insert_emissions(conn.cursor(), [
+        (user_uk, "DG_CONS_EM", "Emission from DG_CONS_EM", "Scope_1", "l",
+         json.dumps({"Total DG fuel consumed (litres)?": i}), 2.68, 2.68 * i, stamp)
+        for i, stamp in enumerate(stamps, 1)])
+    conn.commit()
+    conn.close()
+    return ids
+
+@pytest.fixture
+def entries(client, database):
+    ids = _add(database, client.user_uk, STAMPS)
+    _add(database, "someone-else", STAMPS)  # never listed for the client's user
+    return [i for _, i in sorted(zip(STAMPS, ids), reverse=True)]
+
+def _pages(client, limit):
+    pages, cursor = [], None
+    while True:
+        url = f"/dashboard/entries?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        body = client.get(url).get_json()
+        pages.append([e["id"] for e in body["entries"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+@pytest.mark.parametrize("limit, sizes", [(3, [3, 3, 1]), (1, [1] * 7), (7, [7]), (50, [7])])
+def test_pages_cover_every_row_once(client, entries, limit, sizes):
+    pages = _pages(client, limit)
+    assert [len(p) for p in pages] == sizes  # no empty trailing page, even when limit divides the count
+    assert [i for page in pages for i in page] == entries
+
+def test_rows_added_after_the_first_page_do_not_shift_later_pages(client, database, entries):
+    first = client.get("/dashboard/entries?limit=3").get_json()
+    _add(database, client.user_uk, ["2026-02-01 00:00:00"])
+    rest = client.get(f"/dashboard/entries?limit=50&cursor={first['next_cursor']}").get_json()
+    assert [e["id"] for e in first["entries"] + rest["entries"]] == entries
+
+def test_entries_carry_their_inputs(client, entries):
+    entry = client.get("/dashboard/entries?limit=1").get_json()["entries"][0]
+    assert entry["id"] == entries[0]
+    assert entry["input_details"] == {"Total DG fuel consumed (litres)?": 4.0}
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+                                    base64.urlsafe_b64encode(b'["2026-01-01", "x"]').decode()])
+def test_bad_cursor_is_400(client, entries, cursor):
+    r = client.get(f"/dashboard/entries?cursor={cursor}")
+    assert r.status_code == 400
+    assert r.get_json() == {"error": "invalid cursor"}
@@ -0,0 +1,152 @@
+# test_repository.py
+"""
+Every Repository method on both backends: SQLiteRepository on a scratch file, and PostgresRepository
+on DATABASE_URL after copy_to_postgres() loads that same file into it. The Postgres case is skipped
+without DATABASE_URL or psycopg2. DATABASE_URL must name a scratch database: the copy truncates its tables.
+"""
+
+import os, uuid
+from datetime import date
+import pytest
+import bulk
+import db
+import factor_cache
+import repository
+from exports import EXPORT_COLUMNS
+from repository import PostgresRepository, SQLiteRepository, copy_to_postgres, is_postgres
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def repo(request, database):
+    factor_cache.invalidate()  # the factor cache is per process, not per database
+    if request.param == "sqlite":
+        repo = SQLiteRepository(db.connect(database))
+    else:
+        pytest.importorskip("psycopg2")
+        url = os.getenv("DATABASE_URL", "")
+        if not is_postgres(url):
+            pytest.skip("needs DATABASE_URL=postgresql://... (a scratch database)")
+        copy_to_postgres(database, url)
+        repo = PostgresRepository(repository._pg_connect(url))
+    yield repo
+    repo.rollback()
+    repo.close()
+    factor_cache.invalidate()
+
+@pytest.fixture
+def user_uk(repo):
+    user_uk = str(uuid.uuid4())
+    repo.create_user(user_uk, f"u-{user_uk[:8]}", "hash", "Nodal", "Eng", "Acme", "1", f"{user_uk[:8]}@example.com",
+                     "2026-01-01 00:00:00")
+    repo.commit()
+    return user_uk
+
+ENTRIES = [  # (code, litres / quantity, created_at)
+    ("DG_CONS_EM", 10.0, "2026-01-05 10:00:00"),
+    ("DG_CONS_EM", 20.0, "2026-02-01 09:00:00"),
+    ("ELECT_EM", 100.0, "2026-02-01 09:00:00"),
+    ("DG_CONS_EM", 5.0, "2025-12-31 08:00:00"),
+]
+
+@pytest.fixture
+def entries(repo, user_uk):
+    for code, value, created_at in ENTRIES:
+        factor_row = repo.get_factor(code)
+        question = "Total DG fuel consumed (litres)?" if code == "DG_CONS_EM" else "Units (kWh)?"
+        repo.add_emission(user_uk, factor_row, f'{{"{question}": {value}}}', factor_row["factor"],
+                          value * factor_row["factor"], created_at)
+    repo.commit()
+    return user_uk
+
+def _ids(rows):
+    return [r["id"] for r in rows]
+
+def test_users(repo, user_uk):
+    row = repo.get_user_by_uk(user_uk)
+    assert (row["user_uk"], row["company"]) == (user_uk, "Acme")
+    assert "password" not in row.keys()
+    assert repo.get_user(row["username"])["password"] == "hash"
+    assert repo.get_user("nobody") is None and repo.get_user_by_uk("nobody") is None
+    with pytest.raises(repo.IntegrityError):
+        repo.create_user(str(uuid.uuid4()), row["username"], "x", None, None, None, None, "other@example.com", "")
+    repo.rollback()
+
+def test_factors(repo):
+    processes = repo.processes()
+    assert [p["process_desc"] for p in processes] == sorted(p["process_desc"] for p in processes)
+    assert repo.get_factor("DG_CONS_EM")["factor"] == 2.68
+    assert repo.get_factor("NOPE") is None
+    assert set(repo.factors_by_code()) == {p["process_code"] for p in processes}
+    version = repo.factors_version()
+    repo.cursor().execute("UPDATE emission_factors SET factor = ? WHERE process_code = ?", (2.7, "DG_CONS_EM"))
+    repo.commit()
+    assert repo.factors_version() > version
+    assert repo.get_factor("DG_CONS_EM")["factor"] == 2.7  # the cache follows the version
+
+def test_add_emission_and_reads(repo, user_uk):
+    assert repo.data_version(user_uk) == 0
+    factor_row = repo.get_factor("DG_CONS_EM")
+    repo.begin()
+    repo.add_emission(user_uk, factor_row, '{"q": 1}', 2.68, 2.68, "2026-01-01 00:00:00")
+    repo.rollback()
+    assert repo.recent_emissions(user_uk) == [] and repo.data_version(user_uk) == 0
+
+def test_recent_and_pages(repo, entries):
+    recent = repo.recent_emissions(entries, limit=3)
+    assert [r["created_at"] for r in recent] == ["2026-02-01 09:00:00", "2026-02-01 09:00:00", "2026-01-05 10:00:00"]
+    newest_first = _ids(repo.entries_page(entries, limit=10))
+    assert len(newest_first) == 4 and newest_first[:2] == sorted(newest_first[:2], reverse=True)
+    first = repo.entries_page(entries, limit=2)
+    rest = repo.entries_page(entries, (first[-1]["created_at"], first[-1]["id"]), limit=10)
+    assert _ids(first) + _ids(rest) == newest_first
+    assert repo.data_version(entries) == len(ENTRIES)
+
+def test_inputs_and_summary(repo, entries):
+    ids = _ids(repo.entries_page(entries, limit=10))
+    inputs = repo.inputs_for(ids + [10 ** 9])
+    assert inputs[10 ** 9] == []
+    assert sorted(items[0][2] for items in (inputs[i] for i in ids)) == [5.0, 10.0, 20.0, 100.0]
+    total, scopes, top = repo.dashboard_summary(entries, top_n=1)
+    assert total == pytest.approx(35 * 2.68 + 100 * 0.82)
+    assert scopes == {"Scope_1": pytest.approx(35 * 2.68 + 100 * 0.82)}  # init_db's default scopes
+    assert len(top) == 1 and top[0][1] == pytest.approx(35 * 2.68)
+
+def test_aggregates(repo, entries):
+    result = repo.aggregates(entries, "month", date(2025, 12, 1), date(2026, 2, 28))
+    assert [(b["bucket"], b["entries"]) for b in result["buckets"]] == [("2025-12", 1), ("2026-01", 1), ("2026-02", 2)]
+    assert result["buckets"][2]["total"] == pytest.approx(20 * 2.68 + 100 * 0.82)
+
+def test_add_rows(repo, user_uk):
+    factors = repo.factors_by_code()
+    records = [{"process_code": "DG_CONS_EM", "inputs": {"Fuel_cons": "7"}},
+               {"process_code": "LPG_CONS_EM", "inputs": {"LPG_no": 2, "Weight_LPG": 10}}]
+    valid, results = bulk.validate_records(records, factors)
+    assert repo.add_rows(user_uk, bulk.compute_rows(user_uk, valid, factors, results)) == 2
+    repo.commit()
+    assert sorted(r["emission"] for r in repo.recent_emissions(user_uk)) == [pytest.approx(7 * 2.68), pytest.approx(20 * 2.94)]
+    assert repo.dashboard_summary(user_uk)[0] == pytest.approx(7 * 2.68 + 20 * 2.94)
+
+def test_exports(repo, entries):
+    rows = [row for batch in repo.export_batches(entries, {}) for row in batch]
+    assert len(rows) == len(ENTRIES) and len(rows[0]) == len(EXPORT_COLUMNS)
+    assert rows[0][0] >= rows[-1][0]  # newest first
+    assert rows[-1][4] == "Total DG fuel consumed (litres)?: 5.0"
+    filtered = repo.export_cursor(entries, {"start": date(2026, 2, 1), "end": date(2026, 2, 1), "scope": "Scope_1"}).fetchall()
+    assert len(filtered) == 2
+
+def test_copy_to_postgres_copies_every_table(repo, entries, database):
+    if not isinstance(repo, PostgresRepository):
+        pytest.skip("Postgres only")
+    src = SQLiteRepository(db.connect(database))
+    try:
+        src.add_emission(entries, src.get_factor("DG_CONS_EM"), '{"q": 3}', 2.68, 8.04, "2026-03-01 00:00:00")
+        src.commit()
+        counts = copy_to_postgres(database, os.environ["DATABASE_URL"])
+        for table in ("emissions", "emission_inputs", "emission_factors"):
+            n = src.cursor().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            assert counts[table] == n
+            cur = repo.cursor(); cur.execute(f"SELECT COUNT(*) FROM {table}")
+            assert cur.fetchone()[0] == n
+    finally:
+        src.close()
+    repo.rollback()
+    assert repo.dashboard_summary(entries)[0] == pytest.approx(8.04)  # rollups rebuilt from the copied rows
@@ -0,0 +1,39 @@
+# test_write_queue.py
+"""
+Write-behind queue group commit: jobs batched into one transaction each run under their own
+savepoint, so a job that raises is rolled back alone and the rest of its batch still commits.
+"""
+
+import sqlite3
+import pytest
+import write_queue
+from write_queue import WriteQueue
+
+def _insert(tag, fail=False):
+    def job(repo):
+        repo.cursor().execute("INSERT INTO emissions (user_uk, process_code, emission) VALUES (?, 'DG_CONS_EM', 1)", (tag,))
+        if fail:
+            raise ValueError(f"{tag} failed")
+    return job
+
+def test_failed_job_rolls_back_only_its_savepoint(database, monkeypatch):
+    monkeypatch.setattr(write_queue, "WRITE_QUEUE_INTERVAL_MS", 500)  # the three jobs share one batch
+    queue = WriteQueue(database)
+    tickets = [queue.submit(tag, _insert(tag, fail=tag == "b")) for tag in ("a", "b", "c")]
+    assert queue.flush(10)
+    assert tickets[0].wait(1) and tickets[2].wait(1)
+    with pytest.raises(ValueError, match="b failed"):
+        tickets[1].wait(1)
+    assert (queue.stats["batches"], queue.stats["max_batch"], queue.stats["failed_jobs"]) == (1, 3, 1)
+    conn = sqlite3.connect(database)
+    users = [r[0] for r in conn.execute("SELECT user_uk FROM emissions WHERE user_uk IN ('a', 'b', 'c') ORDER BY id")]
+    conn.close()
+    assert users == ["a", "c"]
+
+def test_pending_jobs_are_tracked_per_user(database, monkeypatch):
+    monkeypatch.setattr(write_queue, "WRITE_QUEUE_INTERVAL_MS", 200)
+    queue = WriteQueue(database)
+    queue.submit("a", _insert("a"))
+    assert queue._pending["a"] == 1
+    assert queue.wait_for_user("a", timeout=10)
+    assert not queue._pending
@@ -0,0 +1,98 @@
+# workbook.py
+"""
+Streaming reader for Master Calculation.xlsx:
+- the workbook is opened once in openpyxl's read-only mode (rows are streamed from the file instead of
+  building every cell up front) and shared by the factor sheet and the emission sheets
+- iter_chunks() yields a sheet as DataFrames of at most WORKBOOK_CHUNK_ROWS rows, built the way
+  pandas.read_excel builds a whole sheet (same cell conversion, header naming, NaN for blanks,
+  trailing empty rows dropped) with the index running on across chunks, so row labels are unchanged
+- sheet_digest() hashes a sheet's stored XML (plus the shared strings and styles it refers to)
+  without parsing it, so an unchanged sheet can be skipped before any row is read
+- column dtypes (and the width of rows wider than the header) are settled per chunk; a sheet
+  shorter than one chunk comes out exactly as read_excel returns it
+"""
+
+import hashlib, os, weakref
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+WORKBOOK_CHUNK_ROWS = int(os.getenv("WORKBOOK_CHUNK_ROWS", "5000"))
+
+def open_workbook(path):
+    """Read-only workbook; call close() when done (it keeps the file open)."""
+    from openpyxl import load_workbook
+    return load_workbook(path, read_only=True, data_only=True, keep_links=False)
+
+def _convert_cell(cell):
+    # as pandas' openpyxl reader: empty -> "", error -> NaN, integral numbers -> int
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return float("nan")
+    if cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+def _rows(ws):
+    """Converted rows without trailing empty cells; empty rows only where more data follows."""
+    ws.reset_dimensions()  # the stored dimensions are often wrong
+    blank = 0
+    for row in ws.rows:
+        values = [_convert_cell(c) for c in row]
+        while values and values[-1] == "":
+            values.pop()
+        if not values:
+            blank += 1
+            continue
+        for _ in range(blank):
+            yield []
+        blank = 0
+        yield values
+
+def _frame(header, rows, start, width):
+    data = [header + [""] * (width - len(header))] + [r + [""] * (width - len(r)) for r in rows]
+    df = TextParser(data, header=0, skip_blank_lines=False).read()
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+def iter_chunks(book, sheet, chunk_rows=WORKBOOK_CHUNK_ROWS):
+    """DataFrames of up to chunk_rows data rows from one sheet, first row as the header."""
+    rows = _rows(book[sheet])
+    header = next(rows, None)
+    if header is None:
+        return
+    width = len(header)  # widest row so far; read_excel pads to the widest row of the whole sheet
+    chunk, start = [], 0
+    for row in rows:
+        chunk.append(row)
+        width = max(width, len(row))
+        if len(chunk) >= chunk_rows and width:  # leading empty rows wait for the first real one
+            yield _frame(header, chunk, start, width)
+            start += len(chunk); chunk = []
+    if chunk:
+        yield _frame(header, chunk, start, width)
+
+_common_digests = weakref.WeakKeyDictionary()  # book -> hash of its shared strings + styles
+
+def _digest(archive, names):
+    h = hashlib.sha256()
+    for name in names:
+        try:
+            with archive.open(name) as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        except KeyError:
+            h.update(b"-")
+    return h.hexdigest()
+
+def sheet_digest(book, sheet):
+    """Content hash of one sheet as stored in the .xlsx, or None where it cannot be read directly."""
+    archive, path = getattr(book, "_archive", None), getattr(book[sheet], "_worksheet_path", None)
+    if archive is None or path is None:
+        return None
+    common = _common_digests.get(book)
+    if common is None:
+        common = _common_digests[book] = _digest(archive, ("xl/sharedStrings.xml", "xl/styles.xml"))
+    return hashlib.sha256((common + _digest(archive, (path,))).encode()).hexdigest()
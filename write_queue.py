@@ -0,0 +1,203 @@
+# write_queue.py
+"""
+Optional write-behind queue for calculator and bulk submissions (WRITE_QUEUE=1):
+- routes compute their rows as before, then submit() a write job instead of committing themselves
+- one writer thread per worker process drains the queue: it waits up to WRITE_QUEUE_INTERVAL_MS for
+  more jobs, runs up to WRITE_QUEUE_MAX_BATCH of them in one transaction (each under its own savepoint,
+  so a failing job does not take the rest of the batch with it) and commits once, so a burst of
+  submissions shares one fsync and one turn at the SQLite write lock
+- WRITE_QUEUE_ACK=commit (default): the submitting request waits for its batch to commit, so every
+  later request sees the entry whichever worker serves it
+  WRITE_QUEUE_ACK=enqueue: the request returns at once; login_required waits for the user's own
+  pending jobs before serving their next request (read-your-writes within the worker process, so
+  run one gunicorn worker with --threads in this mode)
+- batching needs concurrent requests in the same process, i.e. gunicorn --threads N
+- pending jobs are flushed when the process exits
+"""
+
+import atexit, logging, os, queue, threading, time
+from collections import Counter
+
+WRITE_QUEUE = os.getenv("WRITE_QUEUE", "0") in ("1", "true", "yes")
+WRITE_QUEUE_ACK = os.getenv("WRITE_QUEUE_ACK", "commit")
+WRITE_QUEUE_INTERVAL_MS = float(os.getenv("WRITE_QUEUE_INTERVAL_MS", "5"))
+WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "500"))
+WRITE_QUEUE_RETRIES = int(os.getenv("WRITE_QUEUE_RETRIES", "3"))
+WRITE_QUEUE_WAIT_MS = float(os.getenv("WRITE_QUEUE_WAIT_MS", "10000"))
+
+log = logging.getLogger("carbon_dashboard.write_queue")
+
+class Ticket:
+    """Handle for one submitted job; wait() returns once its batch has committed (or failed)."""
+
+    def __init__(self, user_uk, job):
+        self.user_uk, self.job = user_uk, job
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """True when the job is committed; re-raises the job's error if it failed."""
+        if not self._done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+class WriteQueue:
+    """Single writer thread applying job(repo) calls in group-committed batches."""
+
+    def __init__(self, target):
+        self.target = target
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._pending = Counter()  # user_uk -> jobs submitted but not yet committed
+        self._thread = None
+        self._pid = None
+        self.stats = {"jobs": 0, "batches": 0, "max_batch": 0, "failed_jobs": 0, "retries": 0}
+
+    def _ensure_thread(self):
+        # started on first use in each worker, never inherited across gunicorn's fork
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._thread.start()
+
+    def submit(self, user_uk, job):
+        """Queue job(repo) (it must not commit) for user_uk; returns its Ticket."""
+        ticket = Ticket(user_uk, job)
+        with self._cond:
+            self._ensure_thread()
+            self._pending[user_uk] += 1
+        self._queue.put(ticket)
+        return ticket
+
+    def wait_for_user(self, user_uk, timeout=WRITE_QUEUE_WAIT_MS / 1000):
+        """Block until none of user_uk's jobs are pending; False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending.get(user_uk):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def flush(self, timeout=30):
+        """Block until every submitted job is committed or failed."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while sum(self._pending.values()):
+                left = deadline - time.monotonic()
+                if left <= 0 or self._thread is None or not self._thread.is_alive():
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + WRITE_QUEUE_INTERVAL_MS / 1000
+        while len(batch) < WRITE_QUEUE_MAX_BATCH:
+            left = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=left) if left > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _apply(self, repo, batch):
+        """Run the batch in one transaction; returns the tickets that failed on their own."""
+        failed = []
+        for ticket in batch:
+            ticket.error = None  # from an earlier attempt of this batch
+        repo.begin()
+        cur = repo.cursor()
+        for ticket in batch:
+            cur.execute("SAVEPOINT write_job")
+            try:
+                ticket.job(repo)
+            except repo.OperationalError:
+                raise  # locked / disconnected: the whole batch is retried
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT write_job")
+                ticket.error = e
+                failed.append(ticket)
+            cur.execute("RELEASE SAVEPOINT write_job")
+        repo.commit()
+        return failed
+
+    def _reopen(self, repo):
+        from repository import open_repository
+        try:
+            repo.close()
+        except Exception:
+            pass
+        return open_repository(self.target)
+
+    def _run(self):
+        from repository import open_repository
+        repo = open_repository(self.target)
+        while True:
+            batch = self._next_batch()
+            for attempt in range(WRITE_QUEUE_RETRIES + 1):
+                try:
+                    failed = self._apply(repo, batch)
+                    break
+                except Exception as e:  # lock timeout, lost connection...: retry the whole batch
+                    try:
+                        repo.rollback()
+                    except Exception:
+                        repo = self._reopen(repo)
+                    if attempt == WRITE_QUEUE_RETRIES:
+                        log.error("write batch of %d jobs failed: %s", len(batch), e)
+                        for ticket in batch:
+                            ticket.error = e
+                        failed = batch
+                    else:
+                        self.stats["retries"] += 1
+                        time.sleep(0.05 * (attempt + 1))
+            for ticket in failed:
+                log.warning("write job for %s failed: %s", ticket.user_uk, ticket.error)
+            with self._cond:
+                self.stats["jobs"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+                self.stats["failed_jobs"] += len(failed)
+                for ticket in batch:
+                    self._pending[ticket.user_uk] -= 1
+                    if not self._pending[ticket.user_uk]:
+                        del self._pending[ticket.user_uk]
+                    ticket._done.set()
+                self._cond.notify_all()
+
+_queue = None
+
+def enabled():
+    return _queue is not None
+
+def submit(user_uk, job):
+    """Queue job(repo); with WRITE_QUEUE_ACK=commit also wait for it (re-raising its error)."""
+    ticket = _queue.submit(user_uk, job)
+    if WRITE_QUEUE_ACK == "commit" and not ticket.wait(WRITE_QUEUE_WAIT_MS / 1000):
+        raise TimeoutError("write queue did not commit in time")
+    return ticket
+
+def wait_for_user(user_uk):
+    """Read-your-writes: let the user's queued jobs land before their request reads anything."""
+    if _queue is not None and not _queue.wait_for_user(user_uk):
+        log.warning("still waiting on queued writes for %s", user_uk)
+
+def stats():
+    if _queue is None:
+        return None
+    with _queue._cond:
+        out = dict(_queue.stats, pending=sum(_queue._pending.values()), ack=WRITE_QUEUE_ACK)
+    out["avg_batch"] = out["jobs"] / out["batches"] if out["batches"] else 0.0
+    return out
+
+def init_app(app):
+    """Create the queue for app.config["DATABASE"] when WRITE_QUEUE (or app.config) switches it on."""
+    global _queue
+    if not (WRITE_QUEUE or app.config.get("WRITE_QUEUE")):
+        return
+    _queue = WriteQueue(app.config["DATABASE"])
+    atexit.register(_queue.flush)